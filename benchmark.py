@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+# Benchmarks for the hot paths of main.py. Runs without a window.
+#
+# python3 benchmark.py                        - run everything and print the results
+# python3 benchmark.py --only=draw_text,smg   - only the benchmarks whose names contain one of these
+# python3 benchmark.py --quick                - shorter runs, for a rough idea
+# python3 benchmark.py --seed=N               - seed for the game's random streams (1234 by default)
+# python3 benchmark.py --save-baseline=FILE   - store the results as JSON
+# python3 benchmark.py --baseline=FILE        - compare with stored results (exits with 1 on a regression
+#                                               bigger than --threshold percent, 10 by default)
+
+import os
+import sys
+import time
+import json
+import random
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+import pygame
+os.chdir(os.path.dirname(os.path.abspath(__file__))) # The game loads everything relative to its folder
+sys.path.insert(0, os.getcwd())
+import main as game
+
+def init():
+	pygame.mixer.pre_init(44100, -16, 2, 4096)
+	pygame.init()
+	pygame.mixer.init()
+	pygame.display.set_mode((256, 224))
+
+# make_stage: A stage with a fresh player, like the game sets up (with the weapons of the earlier stages)
+def make_stage(i, script = None):
+	random.seed(1234)
+	player = game.Player(game.RandomStreams(int(game.get_option("--seed", "1234"))))
+	if(script is None):
+		script = game.default_input_script
+	player.set_input(game.ScriptedInputController(script))
+	for weapon in range(1, i + 1):
+		player.weapons.add_weapon(weapon)
+	stage = game.Stage(i, game.get_stage_data(), player, game.SoundController(), game.HUDController(), game.MusicController())
+	return stage
+
+def get_free_tiles(tilemap, first_row, last_row):
+	tiles = []
+	for row in range(max(0, first_row), min(len(tilemap.collision_grid), last_row)):
+		for column in range(16):
+			if(tilemap.collision_grid[row][column] == 0):
+				tiles.append([column, row])
+	return tiles
+
+# -- Micro benchmarks - each setup returns the function to time and how many operations one call does -- #
+
+def setup_collide_vecproj():
+	stage = make_stage(0)
+	tilemap = stage.tilemap
+	hitboxes = []
+	for i in range(256):
+		hitboxes.append(pygame.Rect(random.randint(0, 240), stage.camera.scroll_position + random.randint(0, 215), 16, 9))
+	def run():
+		for hitbox in hitboxes:
+			tilemap.collide_vecproj(hitbox, [1.2, -1.2])
+	return run, len(hitboxes)
+
+def setup_shot_intersects_obstacle():
+	stage = make_stage(2)
+	tilemap = stage.tilemap
+	lines = []
+	for i in range(256):
+		p1 = [random.randint(0, 240), stage.camera.scroll_position + random.randint(0, 208)]
+		p2 = [random.randint(0, 240), stage.camera.scroll_position + random.randint(0, 208)]
+		lines.append([p1, p2])
+	def run():
+		for line in lines:
+			tilemap.clear_sight_cache() # Time the traversal, not the memo
+			game.shot_intersects_obstacle(line[0], line[1], tilemap)
+	return run, len(lines)
+
+def setup_draw_ground():
+	stage = make_stage(2)
+	dest = pygame.Surface((256, 224))
+	def run():
+		stage.tilemap.draw_ground(dest)
+	return run, 1
+
+def setup_draw_ground_upper():
+	stage = make_stage(2)
+	dest = pygame.Surface((256, 224))
+	def run():
+		stage.uppermap.draw_ground(dest)
+	return run, 1
+
+def setup_draw_text():
+	hud_con = game.HUDController()
+	dest = pygame.Surface((256, 224))
+	def run():
+		hud_con.draw_text(dest, "Forte Carcerário", 75, 44)
+	return run, 1
+
+def setup_bullet_update():
+	stage = make_stage(0)
+	bullets = []
+	for i in range(100):
+		bullets.append(game.Bullet(stage.bullet_con.sprite_table, [128, stage.camera.scroll_position + 112], random.random() * 360, 1, 10, False, stage.camera))
+	def run():
+		for bullet in bullets:
+			bullet.update(1 / 60)
+	return run, len(bullets)
+
+def setup_update_anim():
+	animation = game.Animation("guard.png", 4, 4, "walk")
+	def run():
+		animation.update_anim(1 / 60)
+	return run, 1
+
+def setup_enemy_update_all():
+	stage = make_stage(2)
+	enemy_con = stage.enemy_con
+	def run():
+		enemy_con.update_all(1 / 60, stage.bullet_con, stage.tilemap, stage.player, stage.item_con, stage.particle_con, stage.sound_con)
+	return run, 1
+
+micro_benchmarks = [
+	["collide_vecproj", setup_collide_vecproj],
+	["shot_intersects_obstacle", setup_shot_intersects_obstacle],
+	["draw_ground", setup_draw_ground],
+	["draw_ground_upper", setup_draw_ground_upper],
+	["draw_text", setup_draw_text],
+	["bullet_update", setup_bullet_update],
+	["update_anim", setup_update_anim],
+	["enemy_update_all", setup_enemy_update_all]
+]
+
+# -- Macro scenarios - each setup returns a function that runs one frame and returns False when the scenario is over -- #
+
+def run_frame(stage, dest):
+	stage.player.input_con.update()
+	stage.update(1 / 60)
+	stage.draw(dest)
+	stage.draw_transitions(dest)
+	stage.update_progress()
+
+def setup_enemies_onscreen():
+	count = int(game.get_option("--enemies", "30"))
+	stage = make_stage(2, [[1, []]])
+	stage.player.lives = 1000
+	first_row = int(stage.camera.scroll_position) // 16
+	tiles = get_free_tiles(stage.tilemap, first_row + 1, first_row + 10)
+	random.shuffle(tiles)
+	for tile in tiles:
+		if(count == 0):
+			break
+		if(stage.enemy_con.check_tile_for_enemy(tile)):
+			continue
+		stage.enemy_con.add_enemy(stage.enemy_con.create_enemy("soldier", tile[0], tile[1]), stage.enemy_con.enemies)
+		count -= 1
+	stage.scroll_lock = True
+	dest = pygame.Surface((256, 224))
+	frames = [600]
+	def run():
+		run_frame(stage, dest)
+		frames[0] -= 1
+		return frames[0] > 0
+	return run
+
+def setup_smg():
+	stage = make_stage(3, [[1, [pygame.K_x]]]) # Hold the trigger for the whole run
+	stage.player.lives = 1000
+	stage.player.weapons.ammo = [100000, 100000]
+	stage.player.weapons.switch_to(3)
+	dest = pygame.Surface((256, 224))
+	frames = [600]
+	def run():
+		run_frame(stage, dest)
+		frames[0] -= 1
+		return frames[0] > 0
+	return run
+
+def setup_stage3_scroll():
+	stage = make_stage(2, [[2, [pygame.K_UP, pygame.K_x]], [1, [pygame.K_UP]]])
+	stage.player.lives = 1000
+	dest = pygame.Surface((256, 224))
+	def run():
+		run_frame(stage, dest)
+		# Keep the camera moving even when the player gets stuck, so the whole stage goes by
+		stage.scroll_lock = False
+		if(stage.camera.scroll_position > 0):
+			stage.camera.scroll(min(2, stage.camera.scroll_position))
+			if(stage.camera.get_screen_y(stage.player.animations.get_position()[1]) > 180):
+				stage.player.moveto(112, stage.camera.scroll_position + 120)
+		return stage.camera.scroll_position > 0
+	return run
+
+macro_benchmarks = [
+	["enemies_onscreen", setup_enemies_onscreen],
+	["smg_10s", setup_smg],
+	["stage3_scroll", setup_stage3_scroll]
+]
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run_micro(setup, duration):
+	run, ops = setup()
+	run() # Warm up the caches
+	calls = 0
+	start = time.perf_counter()
+	elapsed = 0
+	while(elapsed < duration):
+		run()
+		calls += 1
+		elapsed = time.perf_counter() - start
+	return {"ops_per_sec": calls * ops / elapsed}
+
+def run_macro(setup):
+	run = setup()
+	frame_times = []
+	running = True
+	while(running):
+		start = time.perf_counter()
+		running = run()
+		frame_times.append((time.perf_counter() - start) * 1000)
+	return {
+		"frames": len(frame_times),
+		"fps": len(frame_times) / (sum(frame_times) / 1000),
+		"p50_ms": percentile(frame_times, 50),
+		"p95_ms": percentile(frame_times, 95),
+		"p99_ms": percentile(frame_times, 99)
+	}
+
+# get_score: The number that is compared with the baseline (bigger is better)
+def get_score(result):
+	if("ops_per_sec" in result):
+		return result["ops_per_sec"]
+	return result["fps"]
+
+def format_result(result):
+	if("ops_per_sec" in result):
+		return "%12.1f ops/s" % result["ops_per_sec"]
+	return "%8.1f fps  p50 %6.2f ms  p95 %6.2f ms  p99 %6.2f ms  (%d frames)" % (result["fps"], result["p50_ms"], result["p95_ms"], result["p99_ms"], result["frames"])
+
+def main():
+	init()
+	duration = 0.2 if "--quick" in sys.argv else 1.0
+	only = game.get_option("--only", "")
+	filters = only.split(",") if only else []
+	baseline = dict()
+	if(game.get_option("--baseline", "")):
+		with open(game.get_option("--baseline", ""), "r") as baseline_file:
+			baseline = json.load(baseline_file)
+	threshold = float(game.get_option("--threshold", "10"))
+	results = dict()
+	regressions = []
+	for name, setup in micro_benchmarks + macro_benchmarks:
+		if(filters and not any(f in name for f in filters)):
+			continue
+		if([name, setup] in micro_benchmarks):
+			result = run_micro(setup, duration)
+		else:
+			result = run_macro(setup)
+		results[name] = result
+		line = name.ljust(26) + format_result(result)
+		if(name in baseline):
+			change = (get_score(result) / get_score(baseline[name]) - 1) * 100
+			line += "  %+6.1f%% vs baseline" % change
+			if(change < -threshold):
+				regressions.append(name)
+				line += "  REGRESSION"
+		print(line)
+	if(game.get_option("--save-baseline", "")):
+		with open(game.get_option("--save-baseline", ""), "w") as baseline_file:
+			json.dump(results, baseline_file, indent=1, sort_keys=True)
+	pygame.quit()
+	if(regressions):
+		print("Slower than the baseline:", ", ".join(regressions))
+		sys.exit(1)
+
+if __name__ == '__main__': main()
@@ -6,36 +6,143 @@ import math
 import os
 import sys
 import random
+import time
+import struct
+import array
+import bisect
+import threading
+from collections import OrderedDict, deque
+try:
+	import numpy # Optional - only needed by ArrayBulletController
+except ImportError:
+	numpy = None
 
+TICKS_PER_SECOND = 60 # The frame-count timers (ai_timer, walk_frame_count, death_counter...) count ticks of this rate
 
+# ImageCache: Keeps every decoded (and display-converted) image around, so each file is only read from disk once
+class ImageCache:
+	def __init__(self, max_bytes = 0):
+		self.images = OrderedDict()
+		self.max_bytes = max_bytes # Budget for the cached surfaces, in bytes - 0 means unlimited
+		self.used_bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock() # The next stage is loaded on a worker thread (see StagePreloader)
 
+	def get(self, folder, filename):
+		with self.lock:
+			return self.load(folder, filename)
+
+	def load(self, folder, filename):
+		key = (folder, filename)
+		image = self.images.get(key)
+		if(image is not None):
+			self.hits += 1
+			self.images.move_to_end(key)
+			return image
+		self.misses += 1
+		#print("Loading PNG @ sprites -", folder, "-", filename) #DBG!
+		image = pygame.image.load(os.path.join("graphics", folder, filename));
+		if image.get_alpha() is None:
+			image = image.convert()
+		else:
+			image = image.convert_alpha()
+		self.images[key] = image
+		self.used_bytes += surface_bytes(image)
+		self.evict()
+		return image
+
+	def evict(self):
+		if(self.max_bytes <= 0):
+			return
+		# Drop the least recently used images until we fit the budget again (the newest one always stays)
+		while(self.used_bytes > self.max_bytes and len(self.images) > 1):
+			key, image = self.images.popitem(last=False)
+			self.used_bytes -= surface_bytes(image)
+
+	def set_budget(self, max_bytes):
+		with self.lock:
+			self.max_bytes = max_bytes
+			self.evict()
+
+	def clear(self):
+		with self.lock:
+			self.images.clear()
+			self.used_bytes = 0
+
+	def get_stats(self):
+		return {"hits": self.hits, "misses": self.misses, "images": len(self.images), "bytes": self.used_bytes}
+
+def surface_bytes(surface):
+	return surface.get_pitch() * surface.get_height()
+
+image_cache = ImageCache()
+
+# load_png: Returns the shared copy of an image - callers must not draw onto it
 def load_png(folder, filename):
-	#print("Loading PNG @ sprites -", folder, "-", filename) #DBG!
-	image = pygame.image.load(os.path.join("graphics", folder, filename));
-	if image.get_alpha() is None:
-		image = image.convert()
-	else:
-		image = image.convert_alpha()
-	return image
+	return image_cache.get(folder, filename)
+
+# Camera: Holds the vertical scroll of the stage. Entities keep their positions in world space (map pixels),
+# so scrolling only moves the camera and positions are converted to screen space when drawn
+class Camera:
+	def __init__(self, scroll_position = 0):
+		self.scroll_position = scroll_position
 	
+	def scroll(self, y):
+		self.scroll_position -= y
+	
+	def get_screen_y(self, y):
+		return y - self.scroll_position
+
+# RandomStreams: Separate random number generators for each part of the game, all derived from one seed, so a run
+# can be played again exactly by giving the same seed (and the same input)
+class RandomStreams:
+	def __init__(self, seed = None):
+		if(seed is None):
+			seed = random.SystemRandom().randrange(1 << 32)
+		self.seed = seed
+		self.ai = random.Random(str(seed) + "-ai") # Enemy decisions
+		self.spread = random.Random(str(seed) + "-spread") # Weapon spread and knife damage
+		self.drops = random.Random(str(seed) + "-drops") # Item drops
+		self.scroll = random.Random(str(seed) + "-scroll") # Scroll speed dithering
+		self.cosmetic = random.Random(str(seed) + "-cosmetic") # Particles and sound variations
+
+# BulletSpriteTable: Holds a bullet sprite pre-rotated at every angle_step degrees, with the matching unit vectors
+class BulletSpriteTable:
+	def __init__(self, spritefile, angle_step = 1):
+		sprite = load_png("sprites", spritefile)
+		self.angle_step = angle_step
+		self.count = int(round(360 / angle_step))
+		self.images = []
+		self.vectors = []
+		for i in range(self.count):
+			angle = i * 360 / self.count
+			self.images.append(pygame.transform.rotate(sprite, angle - 90))
+			self.vectors.append([math.cos(math.radians(angle)), -math.sin(math.radians(angle))])
+	
+	def get_index(self, direction):
+		# Picks the entry nearest to the direction (which can be any angle, including negative ones)
+		return int(math.floor(direction * self.count / 360 + 0.5)) % self.count
+
 class Bullet:
-	def __init__(self, spritefile, position, direction, speed, damage, is_enemy):
-		self.sprite = load_png("sprites", spritefile)
-		self.image = pygame.transform.rotate(self.sprite, direction - 90)
+	def __init__(self, sprite_table, position, direction, speed, damage, is_enemy, camera):
+		index = sprite_table.get_index(direction)
+		self.image = sprite_table.images[index]
 		self.position = [(position[0] - self.image.get_width() / 2), (position[1] - self.image.get_height() / 2)]
 		self.direction = direction
-		self.vector = [math.cos(math.radians(direction)), -math.sin(math.radians(direction))]
+		self.vector = sprite_table.vectors[index]
 		#print("bullet vector", self.vector)
 		self.speed = speed
 		self.damage = damage
 		self.is_enemy = is_enemy
+		self.camera = camera
 		self.hitboxes = []
 		for i in range(3):
 			hbox = pygame.Rect(int(self.position[0] - 1 - 3 * i * self.vector[0]), int(self.position[1] - 1 - 3 * i * self.vector[1]), 3, 3)
 			self.hitboxes.append(hbox)
 	
 	def draw(self, dest):
-		dest.blit(self.image, (self.position[0], self.position[1]))
+		dest.blit(self.image, (self.position[0], self.position[1] - self.camera.scroll_position))
 	
 	def update(self, delta_time):
 		motion_vector = [self.vector[0] * self.speed * delta_time, self.vector[1] * self.speed * delta_time]
@@ -54,26 +161,49 @@ class Bullet:
 			collided = collided or i.colliderect(rect)
 		return collided
 	
-	def is_outside_screen(self):
-		#print("outside screen:", self.position[0] < -8 or self.position[1] < -8 or self.position[0] > 264 or self.position[1] > 232)
-		return self.position[0] < -8 or self.position[1] < -8 or self.position[0] > 264 or self.position[1] > 232
+	# get_bounds: The area covered by all the hitboxes
+	def get_bounds(self):
+		return self.hitboxes[0].unionall(self.hitboxes[1:])
 	
-	def scroll(self, y):
-		self.position[1] += y
+	def is_outside_screen(self):
+		screen_y = self.position[1] - self.camera.scroll_position
+		#print("outside screen:", self.position[0] < -8 or screen_y < -8 or self.position[0] > 264 or screen_y > 232)
+		return self.position[0] < -8 or screen_y < -8 or self.position[0] > 264 or screen_y > 232
 		
 
-class Animation(pygame.sprite.Sprite):
-	def __init__(self, spritefile, frames, directions, name):
-		pygame.sprite.Sprite.__init__(self)
-		self.name = name
+# SpriteSheet: An animation sheet sliced into its frames - one column per frame, one row per direction. Sheets are
+# shared by every animation that uses them (see get_sprite_sheet), so their rects must not be changed
+class SpriteSheet:
+	def __init__(self, spritefile, frames, directions):
+		self.image = load_png("sprites", spritefile)
 		self.frames = frames
 		self.directions = directions
-		self.sprite = load_png("sprites", spritefile)
-		self.image = self.sprite
 		self.w = int(self.image.get_width() / frames)
 		self.h = int(self.image.get_height() / directions)
-		self.rect = pygame.Rect(0, 0, self.w, self.h);
-		self.spriterect = pygame.Rect(0, 0, self.w, self.h)
+		self.direction_step = 360 / directions
+		self.rects = []
+		for direction in range(directions):
+			self.rects.append([pygame.Rect(frame * self.w, direction * self.h, self.w, self.h) for frame in range(frames)])
+
+sprite_sheets = dict()
+
+# get_sprite_sheet: Returns the shared, already sliced copy of a sheet
+def get_sprite_sheet(spritefile, frames, directions):
+	key = (spritefile, frames, directions)
+	sheet = sprite_sheets.get(key)
+	if(sheet is None):
+		sheet = SpriteSheet(spritefile, frames, directions)
+		sprite_sheets[key] = sheet
+	return sheet
+
+# Animation: One entity's playback of a sprite sheet - the sheet itself is shared, this only keeps the frame,
+# direction and timing
+class Animation:
+	def __init__(self, spritefile, frames, directions, name):
+		self.name = name
+		self.sheet = get_sprite_sheet(spritefile, frames, directions)
+		self.image = self.sheet.image
+		self.spriterect = self.sheet.rects[0][0]
 		self.position = [0.0, 0.0]
 		self.playing = True
 		self.looping = True
@@ -81,8 +211,6 @@ class Animation(pygame.sprite.Sprite):
 		self.frame = 0
 		self.frametime = 5/36
 		self.framecounter = 0
-		screen = pygame.display.get_surface()
-		self.area = screen.get_rect()
 		self.offsetx = 0
 		self.returns = True
 	
@@ -102,7 +230,7 @@ class Animation(pygame.sprite.Sprite):
 			if(self.framecounter > self.frametime):
 				self.framecounter -= self.frametime
 				self.frame += 1
-				if self.frame >= self.frames:
+				if self.frame >= self.sheet.frames:
 					if(self.returns):
 						self.frame = 0
 					else:
@@ -113,17 +241,17 @@ class Animation(pygame.sprite.Sprite):
 			if(self.returns):
 				self.frame = 0
 			self.framecounter = 0
-		self.spriterect = pygame.Rect(self.frame * self.w, self.quantize_direction(self.direction) * self.h, self.w, self.h)
+		self.spriterect = self.sheet.rects[self.quantize_direction(self.direction)][self.frame]
 	
 	def quantize_direction(self, direction):
-		step = 360 / self.directions
-		return int((direction + step / 2) / step) % self.directions
+		step = self.sheet.direction_step
+		return int((direction + step / 2) / step) % self.sheet.directions
 	
 	def set_offsetx(self, offset):
 		self.offsetx = offset
 	
-	def draw(self, dest):
-		dest.blit(self.image, (int(self.position[0] + self.offsetx), int(self.position[1])), self.spriterect)
+	def draw(self, dest, scroll = 0):
+		dest.blit(self.image, (int(self.position[0] + self.offsetx), int(self.position[1] - scroll)), self.spriterect)
 
 class AnimationGroup:
 	def __init__(self):
@@ -193,8 +321,8 @@ class AnimationGroup:
 	def set_offsetx(self, offset):
 		self.animations[self.curr_animation].set_offsetx(offset)
 	
-	def draw(self, dest):
-		self.animations[self.curr_animation].draw(dest)
+	def draw(self, dest, scroll = 0):
+		self.animations[self.curr_animation].draw(dest, scroll)
 	
 	def update(self, delta_time):
 		for i in self.animations:
@@ -205,9 +333,10 @@ class AnimationGroup:
 		return self.animations[0].position
 
 class AimCursor:
-	def __init__(self, position):
+	def __init__(self, position, camera = None):
 		self.image = load_png("sprites", "aim-indicator.png")
 		self.position = position
+		self.camera = camera
 		self.direction = 90
 		self.vector = [1, 0]
 		self.update_vector()
@@ -229,7 +358,7 @@ class AimCursor:
 		if not self.showing:
 			return
 		#print("yay cursor draw!")
-		curr_position = [self.position[0], self.position[1]]
+		curr_position = [self.position[0], self.camera.get_screen_y(self.position[1])]
 		curr_position[0] += self.vector[0] * 12
 		curr_position[1] += self.vector[1] * 12
 		while(curr_position[0] > -8 and curr_position[1] > -8 and curr_position[0] < 264 and curr_position[1] < 232):
@@ -238,28 +367,85 @@ class AimCursor:
 			dest.blit(self.image, (int(curr_position[0]), int(curr_position[1])))
 			#print("blit!", curr_position)
 
+# TilemapHandler: One layer of a stage. Takes the map already loaded (see load_hex_map and load_stage_bundle)
 class TilemapHandler:
-	def __init__(self, tileset, tilemap, collision_map):
+	def __init__(self, tileset, tilemap, collision_map, camera = None, sparse = False):
 		self.tileset = load_png("tiles", tileset)
-		self.tilemap = load_hex_map(tilemap)
-		self.collision_map = load_hex_array(collision_map)
-		self.scroll_position = (len(self.tilemap) - 14) * 16
+		self.tilemap = tilemap
+		self.collision_map = collision_map
+		if(camera is None):
+			camera = Camera((len(self.tilemap) - 14) * 16) # Start at the bottom of the map
+		self.camera = camera
 		#print("map_len", len(self.tilemap))
-		#print("scroll at", self.scroll_position)
+		#print("scroll at", self.camera.scroll_position)
+		self.collision_grid = self.build_collision_grid()
+		self.sight_cache = dict() # Line of sight results for this frame, keyed by the start and end tiles
+		self.layer = self.render_layer()
+		self.view_rect = pygame.Rect(0, 0, 256, 224)
+		self.sparse = sparse # Sparse layers (like the upper layer) only draw the spans of non-empty tiles
+		if(sparse):
+			self.row_spans = self.build_row_spans()
+	
+	# render_layer: Draws the whole map once into a tall surface, so the viewport can be drawn with a single blit
+	def render_layer(self):
+		layer = pygame.Surface((256, len(self.tilemap) * 16), pygame.SRCALPHA).convert_alpha()
+		layer.fill(pygame.Color(0, 0, 0, 0))
+		for row in range(len(self.tilemap)):
+			for i in range(16):
+				tileset_x = (self.tilemap[row][i] % 16) * 16
+				tileset_y = (self.tilemap[row][i] // 16) * 16
+				layer.blit(self.tileset, (i * 16, row * 16), pygame.Rect(tileset_x, tileset_y, 16, 16))
+		return layer
+	
+	# build_collision_grid: The collision value of every tile of the map, so it doesn't have to be looked up through the tileset
+	def build_collision_grid(self):
+		grid = []
+		for row in self.tilemap:
+			grid.append([self.collision_map[tile] for tile in row])
+		return grid
+	
+	# build_row_spans: Indexes, for each row, the runs of horizontally adjacent tiles that have something to draw
+	def build_row_spans(self):
+		empty_tiles = []
+		for i in range((self.tileset.get_width() // 16) * (self.tileset.get_height() // 16)):
+			tile = self.tileset.subsurface(pygame.Rect((i % 16) * 16, (i // 16) * 16, 16, 16))
+			empty_tiles.append(tile.get_bounding_rect().width == 0)
+		row_spans = []
+		for row in range(len(self.tilemap)):
+			spans = []
+			start = -1
+			for i in range(17):
+				filled = i < 16 and not (self.tilemap[row][i] < len(empty_tiles) and empty_tiles[self.tilemap[row][i]])
+				if(filled and start == -1):
+					start = i
+				elif(not filled and not start == -1):
+					spans.append([start * 16, pygame.Rect(start * 16, row * 16, (i - start) * 16, 16)])
+					start = -1
+			row_spans.append(spans)
+		return row_spans
 	
 	def draw_ground(self, dest):
-		starting_pos = int(self.scroll_position / 16)
-		current_pos = starting_pos
-		while(current_pos < len(self.tilemap) and (current_pos - starting_pos) < 16):
-			for i in range(16):
-				tileset_x = (self.tilemap[current_pos][i] % 16) * 16
-				tileset_y = self.tilemap[current_pos][i] - tileset_x / 16
-				dest.blit(self.tileset, (i * 16, current_pos * 16 - self.scroll_position), pygame.Rect(tileset_x, tileset_y, 16, 16))
-			current_pos += 1
+		if(self.sparse):
+			self.draw_sparse(dest)
+			return
+		self.view_rect.top = int(self.camera.scroll_position)
+		self.view_rect.height = dest.get_height()
+		dest.blit(self.layer, (0, 0), self.view_rect)
+	
+	def draw_sparse(self, dest):
+		scroll = int(self.camera.scroll_position)
+		starting_pos = scroll // 16
+		ending_pos = min(len(self.row_spans), (scroll + dest.get_height() + 15) // 16)
+		blits = []
+		for row in range(starting_pos, ending_pos):
+			for span in self.row_spans[row]:
+				blits.append((self.layer, (span[0], row * 16 - scroll), span[1]))
+		if(blits):
+			dest.blits(blits, False)
 	
 	# collide_vecproj: Checks collision on the map and returns a correction vector
 	def collide_vecproj(self, hitbox, motion_vector):
-		map_pos = [int(hitbox.centerx / 16), int((hitbox.centery + self.scroll_position) / 16)]
+		map_pos = [int(hitbox.centerx / 16), int(hitbox.centery / 16)]
 		correction_vector = [0, 0]
 		collided = False
 		
@@ -278,11 +464,11 @@ class TilemapHandler:
 		if(self.collide_to_tile(hitbox, [map_pos[0], map_pos[1] - 1])):
 			# Collision on the top
 			collided = True
-			correction_vector[1] -= hitbox.top - ((map_pos[1] - 1) * 16 + 16 - int(self.scroll_position))
+			correction_vector[1] -= hitbox.top - ((map_pos[1] - 1) * 16 + 16)
 		elif(self.collide_to_tile(hitbox, [map_pos[0], map_pos[1] + 1])):
 			# Collision on the bottom
 			collided = True
-			correction_vector[1] -= hitbox.bottom - ((map_pos[1] + 1) * 16 - int(self.scroll_position))
+			correction_vector[1] -= hitbox.bottom - ((map_pos[1] + 1) * 16)
 		if(collided):
 			#print(correction_vector)
 			return correction_vector
@@ -290,7 +476,7 @@ class TilemapHandler:
 		# We have not collided yet, so check diagonals
 		if(self.collide_to_tile(hitbox, [map_pos[0] + 1, map_pos[1] + 1])):
 			# Collision on bottom-right
-			tile_top = (map_pos[1] + 1) * 16 - self.scroll_position
+			tile_top = (map_pos[1] + 1) * 16
 			tile_left = (map_pos[0] + 1) * 16
 			#print("collided bottom-right - tiletop", tile_top, "tileleft", tile_left, "hitboxbottom", hitbox.bottom, "hitboxright", hitbox.right)
 			if((hitbox.bottom - motion_vector[1]) < tile_top):
@@ -317,7 +503,7 @@ class TilemapHandler:
 				
 		elif(self.collide_to_tile(hitbox, [map_pos[0] - 1, map_pos[1] + 1])):
 			# Collision on bottom-left
-			tile_top = (map_pos[1] + 1) * 16 - self.scroll_position
+			tile_top = (map_pos[1] + 1) * 16
 			tile_right = (map_pos[0] - 1) * 16 + 16
 			#print("collided bottom-left - tiletop", tile_top, "tileright", tile_right, "hitboxbottom", hitbox.bottom, "hitboxleft", hitbox.left)
 			if((hitbox.bottom - motion_vector[1]) < tile_top):
@@ -347,7 +533,7 @@ class TilemapHandler:
 				
 		elif(self.collide_to_tile(hitbox, [map_pos[0] - 1, map_pos[1] - 1])):
 			# Collision on top-left
-			tile_bottom = (map_pos[1] - 1) * 16 - self.scroll_position + 15
+			tile_bottom = (map_pos[1] - 1) * 16 + 15
 			tile_right = (map_pos[0] - 1) * 16 + 16
 			#print("collided top-left - tilebottom", tile_bottom, "tileright", tile_right, "hitboxtop", hitbox.top, "hitboxleft", hitbox.left)
 			if((hitbox.top - motion_vector[1]) > tile_bottom):
@@ -373,7 +559,7 @@ class TilemapHandler:
 				
 		elif(self.collide_to_tile(hitbox, [map_pos[0] + 1, map_pos[1] - 1])):
 			# Collision on top-right
-			tile_bottom = (map_pos[1] - 1) * 16 - self.scroll_position + 15
+			tile_bottom = (map_pos[1] - 1) * 16 + 15
 			tile_left = (map_pos[0] + 1) * 16
 			#print("collided top-right - tilebottom", tile_bottom, "tileleft", tile_left, "hitboxtop", hitbox.top, "hitboxright", hitbox.right)
 			if((hitbox.top - motion_vector[1]) > tile_bottom):
@@ -402,7 +588,7 @@ class TilemapHandler:
 		# Ufa!
 		
 	def collide_check(self, hitbox):
-		map_pos = [int(hitbox.centerx / 16), int((hitbox.centery + self.scroll_position) / 16)]
+		map_pos = [int(hitbox.centerx / 16), int(hitbox.centery / 16)]
 		collided = False
 		for i in range(3):
 			for j in range(3):
@@ -413,7 +599,7 @@ class TilemapHandler:
 		return collided
 		
 	def collide_check_high(self, hitbox):
-		map_pos = [int(hitbox.centerx / 16), int((hitbox.centery + self.scroll_position) / 16)]
+		map_pos = [int(hitbox.centerx / 16), int(hitbox.centery / 16)]
 		collided = False
 		for i in range(3):
 			for j in range(3):
@@ -426,101 +612,394 @@ class TilemapHandler:
 	def collide_to_tile(self, hitbox, tile):
 		#print("tile", tile)
 		if(tile[0] < 0 or tile[0] > 15 or tile[1] < 0 or tile[1] >= len(self.tilemap)):
-			return hitbox.colliderect(pygame.Rect(tile[0] * 16, tile[1] * 16 - self.scroll_position, 16, 16))
-		if(self.collision_map[self.tilemap[tile[1]][tile[0]]] == 0):
+			return hitbox.colliderect(pygame.Rect(tile[0] * 16, tile[1] * 16, 16, 16))
+		if(self.collision_grid[tile[1]][tile[0]] == 0):
 			#print("0")
 			return False
-		#print(self.collision_map[self.tilemap[tile[1]][tile[0]]])
-		return hitbox.colliderect(pygame.Rect(tile[0] * 16, tile[1] * 16 - self.scroll_position, 16, 16))
+		#print(self.collision_grid[tile[1]][tile[0]])
+		return hitbox.colliderect(pygame.Rect(tile[0] * 16, tile[1] * 16, 16, 16))
 		
 	def collide_to_tile_high(self, hitbox, tile):
 		#print("tile", tile)
 		if(tile[0] < 0 or tile[0] > 15 or tile[1] < 0 or tile[1] >= len(self.tilemap)):
 			return False
-		if(self.collision_map[self.tilemap[tile[1]][tile[0]]] == 2):
+		if(self.collision_grid[tile[1]][tile[0]] == 2):
 			#print("0")
-			return hitbox.colliderect(pygame.Rect(tile[0] * 16, tile[1] * 16 - self.scroll_position, 16, 16))
-		#print(self.collision_map[self.tilemap[tile[1]][tile[0]]])
+			return hitbox.colliderect(pygame.Rect(tile[0] * 16, tile[1] * 16, 16, 16))
+		#print(self.collision_grid[tile[1]][tile[0]])
 		return False
 	
 	def get_obstacle_value(self, hitbox):
-		tile = [int(hitbox.centerx / 16), int((hitbox.centery + self.scroll_position) / 16) - 1]
+		tile = [int(hitbox.centerx / 16), int(hitbox.centery / 16) - 1]
 		if(tile[0] > 0):
-			ltile = self.collision_map[self.tilemap[tile[1]][tile[0] - 1]]
+			ltile = self.collision_grid[tile[1]][tile[0] - 1]
 		else:
 			ltile = 0
 		if(tile[0] < 15):
-			rtile = self.collision_map[self.tilemap[tile[1]][tile[0] + 1]]
+			rtile = self.collision_grid[tile[1]][tile[0] + 1]
 		else:
 			rtile = 0
-		close_enough = (hitbox.top - (tile[1] * 16 + 16 - self.scroll_position)) < 2 and ((hitbox.left - tile[0] * 16) > -2 or ltile == 1) and ((hitbox.right - tile[0] * 16 - 16) < 2 or rtile == 1)
-		#print("close enough?", close_enough, (hitbox.top - (tile[1] * 16 + 16 - self.scroll_position)), hitbox.left - tile[0] * 16, hitbox.right - tile[0] * 16 - 16)
+		close_enough = (hitbox.top - (tile[1] * 16 + 16)) < 2 and ((hitbox.left - tile[0] * 16) > -2 or ltile == 1) and ((hitbox.right - tile[0] * 16 - 16) < 2 or rtile == 1)
+		#print("close enough?", close_enough, (hitbox.top - (tile[1] * 16 + 16)), hitbox.left - tile[0] * 16, hitbox.right - tile[0] * 16 - 16)
 		if(tile[0] < 0 or tile[0] > 15 or tile[1] < 0 or tile[1] >= len(self.tilemap)):
 			return -1, False
-		return (self.collision_map[self.tilemap[tile[1]][tile[0]]], close_enough)
+		return (self.collision_grid[tile[1]][tile[0]], close_enough)
 	
 	def get_map_obstacle_value(self, tile):
 		#print("close enough?", close_enough, hitbox.top - tile[1] * 16 + 16, hitbox.left - tile[0] * 16, hitbox.right - tile[0] * 16 + 16)
 		if(tile[0] < 0 or tile[0] > 15 or tile[1] < 0 or tile[1] >= len(self.tilemap)):
 			return -1
-		return self.collision_map[self.tilemap[tile[1]][tile[0]]]
-	
-	def scroll(self, y):
-		self.scroll_position -= y
-	
+		return self.collision_grid[tile[1]][tile[0]]
+	
+	# get_line_obstacle_value: Highest obstacle value (3s don't count) of the tiles crossed by the line between the centers
+	# of two tiles. Walks the grid one tile at a time (Amanatides-Woo), with exact integer comparisons - when the line goes
+	# exactly through a corner, both tiles beside the corner are counted.
+	def get_line_obstacle_value(self, start, end):
+		key = (start[0], start[1], end[0], end[1])
+		if key in self.sight_cache:
+			return self.sight_cache[key]
+		grid = self.collision_grid
+		rows = len(grid)
+		x = start[0]
+		y = start[1]
+		nx = abs(end[0] - x)
+		ny = abs(end[1] - y)
+		sx = 1 if end[0] > x else -1
+		sy = 1 if end[1] > y else -1
+		ix = 0
+		iy = 0
+		tiles = [(x, y)]
+		while(ix < nx or iy < ny):
+			decision = (1 + 2 * ix) * ny - (1 + 2 * iy) * nx
+			if(decision == 0):
+				tiles.append((x + sx, y))
+				tiles.append((x, y + sy))
+				x += sx
+				y += sy
+				ix += 1
+				iy += 1
+			elif(decision < 0):
+				x += sx
+				ix += 1
+			else:
+				y += sy
+				iy += 1
+			tiles.append((x, y))
+		obst = 0
+		for tile in tiles:
+			if(tile[0] >= 0 and tile[0] < 16 and tile[1] >= 0 and tile[1] < rows):
+				value = grid[tile[1]][tile[0]]
+				if(value > obst and not value == 3):
+					obst = value
+		self.sight_cache[key] = obst
+		return obst
+	
+	def clear_sight_cache(self):
+		self.sight_cache.clear()
+	
+# Compiled maps: the .hmf files are hex text, so the parsed values are kept in cache/ as little-endian uint16, behind
+# a header with the size and modification time of the source - an edited map is simply parsed and compiled again
+MAP_CACHE_DIR = "cache"
+MAP_CACHE_MAGIC = b"AHMF"
+MAP_CACHE_VERSION = 1
+MAP_CACHE_HEADER = "<4sHqqHI" # magic, version, source mtime (ns), source size, values per line (0 if they differ), value count
+
 def load_hex_map(filename):
-	path = os.path.join("data", filename)
-	with open(path, "r") as mapfile:
-		mapstrs = mapfile.readlines()
-		strmap = []
-		for i in mapstrs:
-			strmap.append(i.split())
-		maparray = []
-		for line in strmap:
-			tileline = []
-			#print(line)
-			for tile in line:
-				tileline.append(int(tile, 16)) # converts the hex value to an integer
-			if(not len(tileline) == 16):
-				raise RuntimeError("The map file is invalid or has been corrupted. (line length should be 16)")
-			maparray.append(tileline)
-		return maparray
+	values, columns = load_hex_values(filename)
+	if(values and not columns == 16):
+		raise RuntimeError("The map file is invalid or has been corrupted. (line length should be 16)")
+	return [values[i:i + 16].tolist() for i in range(0, len(values), 16)]
 
 def load_hex_array(filename):
+	return load_hex_values(filename)[0].tolist()
+
+# load_hex_values: The values of a .hmf file in data/ as an array, and how many there are per line. Comes from the
+# compiled copy when it is up to date, otherwise the text is parsed and compiled for the next time
+def load_hex_values(filename):
 	path = os.path.join("data", filename)
+	stat = os.stat(path)
+	cache_path = os.path.join(MAP_CACHE_DIR, filename + ".bin")
+	compiled = read_compiled_map(cache_path, stat)
+	if(compiled is not None):
+		return compiled
+	values, columns = parse_hex_file(path)
+	try:
+		write_compiled_map(cache_path, stat, values, columns)
+	except OSError:
+		pass # A read-only install just keeps parsing the text
+	return values, columns
+
+def parse_hex_file(path):
+	values = array.array("H")
+	columns = None
 	with open(path, "r") as mapfile:
-		mapstrs = mapfile.readlines()
-		strmap = []
-		for i in mapstrs:
-			strmap.append(i.split())
-		maparray = []
-		for line in strmap:
-			for tile in line:
-				maparray.append(int(tile, 16)) # converts the hex value to an integer
-		return maparray
+		for line in mapfile.readlines():
+			tiles = line.split()
+			values.extend(int(tile, 16) for tile in tiles) # converts the hex values to integers
+			if(columns is None):
+				columns = len(tiles)
+			elif(not columns == len(tiles)):
+				columns = 0
+	return values, columns or 0
+
+def read_compiled_map(cache_path, stat):
+	try:
+		with open(cache_path, "rb") as cachefile:
+			data = cachefile.read()
+	except OSError:
+		return None
+	header_size = struct.calcsize(MAP_CACHE_HEADER)
+	if(len(data) < header_size):
+		return None
+	magic, version, mtime, size, columns, count = struct.unpack_from(MAP_CACHE_HEADER, data)
+	if(not magic == MAP_CACHE_MAGIC or not version == MAP_CACHE_VERSION or not mtime == stat.st_mtime_ns or not size == stat.st_size):
+		return None
+	if(not len(data) == header_size + count * 2):
+		return None
+	return unpack_uint16(data[header_size:]), columns
+
+def write_compiled_map(cache_path, stat, values, columns):
+	write_cache_file(cache_path, struct.pack(MAP_CACHE_HEADER, MAP_CACHE_MAGIC, MAP_CACHE_VERSION, stat.st_mtime_ns, stat.st_size, columns, len(values)) + pack_uint16(values))
+
+def pack_uint16(values):
+	values = array.array("H", values)
+	if(sys.byteorder == "big"):
+		values.byteswap()
+	return values.tobytes()
+
+def unpack_uint16(data):
+	values = array.array("H")
+	values.frombytes(data)
+	if(sys.byteorder == "big"):
+		values.byteswap()
+	return values
 
+# write_cache_file: Writes to a temporary file first, so a half-written file is never picked up
+def write_cache_file(path, data):
+	os.makedirs(MAP_CACHE_DIR, exist_ok=True)
+	with open(path + ".tmp", "wb") as cachefile:
+		cachefile.write(data)
+	os.replace(path + ".tmp", path)
+
+# Stage bundles: everything a stage reads from data/ (both map layers, the collision table, the enemy spawns and the
+# item placements) packed into one file in cache/, so starting a stage takes a single read. The bundle lists its
+# source files with their sizes and modification times, and is packed again when any of them changes
+STAGE_BUNDLE_MAGIC = b"ASTB"
+STAGE_BUNDLE_VERSION = 1
+STAGE_BUNDLE_HEADER = "<4sHH" # magic, version, section count - followed by the index of the sections
+STAGE_BUNDLE_SECTION = "<8sII" # section name, offset from the start of the file, length
+STAGE_BUNDLE_SOURCE = "<32sqq" # file name, modification time (ns), size
+STAGE_BUNDLE_SPAWN = "<16shhiB" # enemy type, xpos, ypos, health (-1 for the type's own), boss
+STAGE_BUNDLE_ITEM = "<16shhi" # item type, xpos, ypos, ammo
+
+# StageBundle: The data files of a stage, already parsed
+class StageBundle:
+	def __init__(self):
+		self.tilemap = []
+		self.uppermap = []
+		self.collision_map = []
+		self.enemies = [] # See load_enemy_file
+		self.items = [] # See load_item_file
+
+def get_stage_sources(stage_data, i):
+	return [stage_data["tilemap"][i], stage_data["uppermap"][i], "tileset_collision.hmf", stage_data["enemies"][i], stage_data["items"][i]]
+
+def get_stage_bundle_path(i):
+	return os.path.join(MAP_CACHE_DIR, "stage-" + str(i + 1) + ".bundle")
+
+# load_stage_bundle: The data of stage i, from its bundle when that is up to date - otherwise from the source files,
+# packing a new bundle for the next time
+def load_stage_bundle(stage_data, i):
+	sources = [[filename, os.stat(os.path.join("data", filename))] for filename in get_stage_sources(stage_data, i)]
+	bundle = read_stage_bundle(get_stage_bundle_path(i), sources)
+	if(bundle is not None):
+		return bundle
+	bundle = build_stage_bundle(stage_data, i)
+	try:
+		write_stage_bundle(get_stage_bundle_path(i), sources, bundle)
+	except OSError:
+		pass # A read-only install just keeps reading the source files
+	return bundle
+
+def build_stage_bundle(stage_data, i):
+	bundle = StageBundle()
+	bundle.tilemap = load_hex_map(stage_data["tilemap"][i])
+	bundle.uppermap = load_hex_map(stage_data["uppermap"][i])
+	bundle.collision_map = load_hex_array("tileset_collision.hmf")
+	bundle.enemies = load_enemy_file(stage_data["enemies"][i])
+	bundle.items = load_item_file(stage_data["items"][i])
+	return bundle
+
+def write_stage_bundle(path, sources, bundle):
+	sections = OrderedDict()
+	sections[b"sources"] = b"".join(struct.pack(STAGE_BUNDLE_SOURCE, filename.encode(), stat.st_mtime_ns, stat.st_size) for filename, stat in sources)
+	sections[b"tilemap"] = pack_uint16([tile for row in bundle.tilemap for tile in row])
+	sections[b"uppermap"] = pack_uint16([tile for row in bundle.uppermap for tile in row])
+	sections[b"collide"] = pack_uint16(bundle.collision_map)
+	sections[b"enemies"] = b"".join(struct.pack(STAGE_BUNDLE_SPAWN, spawn[0].encode(), spawn[1], spawn[2], -1 if spawn[3] is None else spawn[3], spawn[4]) for spawn in bundle.enemies)
+	sections[b"items"] = b"".join(struct.pack(STAGE_BUNDLE_ITEM, item[0].encode(), item[1], item[2], item[3]) for item in bundle.items)
+	offset = struct.calcsize(STAGE_BUNDLE_HEADER) + len(sections) * struct.calcsize(STAGE_BUNDLE_SECTION)
+	parts = [struct.pack(STAGE_BUNDLE_HEADER, STAGE_BUNDLE_MAGIC, STAGE_BUNDLE_VERSION, len(sections))]
+	for name, data in sections.items():
+		parts.append(struct.pack(STAGE_BUNDLE_SECTION, name, offset, len(data)))
+		offset += len(data)
+	write_cache_file(path, b"".join(parts + list(sections.values())))
+
+# read_stage_bundle: The bundle at path, or None if it is missing, damaged or older than the sources
+def read_stage_bundle(path, sources):
+	try:
+		with open(path, "rb") as bundlefile:
+			data = bundlefile.read()
+	except OSError:
+		return None
+	try:
+		magic, version, count = struct.unpack_from(STAGE_BUNDLE_HEADER, data)
+		if(not magic == STAGE_BUNDLE_MAGIC or not version == STAGE_BUNDLE_VERSION):
+			return None
+		view = memoryview(data)
+		sections = dict()
+		for n in range(count):
+			name, offset, length = struct.unpack_from(STAGE_BUNDLE_SECTION, data, struct.calcsize(STAGE_BUNDLE_HEADER) + n * struct.calcsize(STAGE_BUNDLE_SECTION))
+			if(offset + length > len(data)):
+				return None
+			sections[name.rstrip(b"\0")] = view[offset:offset + length]
+		stored_sources = [[name.rstrip(b"\0").decode(), mtime, size] for name, mtime, size in struct.iter_unpack(STAGE_BUNDLE_SOURCE, sections[b"sources"])]
+		if(not stored_sources == [[filename, stat.st_mtime_ns, stat.st_size] for filename, stat in sources]):
+			return None
+		bundle = StageBundle()
+		tilemap = unpack_uint16(sections[b"tilemap"])
+		bundle.tilemap = [tilemap[i:i + 16].tolist() for i in range(0, len(tilemap), 16)]
+		uppermap = unpack_uint16(sections[b"uppermap"])
+		bundle.uppermap = [uppermap[i:i + 16].tolist() for i in range(0, len(uppermap), 16)]
+		bundle.collision_map = unpack_uint16(sections[b"collide"]).tolist()
+		for enemytype, xpos, ypos, health, boss in struct.iter_unpack(STAGE_BUNDLE_SPAWN, sections[b"enemies"]):
+			bundle.enemies.append([enemytype.rstrip(b"\0").decode(), xpos, ypos, None if health < 0 else health, bool(boss)])
+		for itemtype, xpos, ypos, ammo in struct.iter_unpack(STAGE_BUNDLE_ITEM, sections[b"items"]):
+			bundle.items.append([itemtype.rstrip(b"\0").decode(), xpos, ypos, ammo])
+	except (struct.error, KeyError, UnicodeDecodeError):
+		return None
+	return bundle
+
+# compile_data: Compiles every .hmf file in data/ and packs every stage ahead of time (--compile-data)
+def compile_data():
+	for filename in sorted(os.listdir("data")):
+		if(filename.endswith(".hmf")):
+			path = os.path.join("data", filename)
+			values, columns = parse_hex_file(path)
+			write_compiled_map(os.path.join(MAP_CACHE_DIR, filename + ".bin"), os.stat(path), values, columns)
+			print("Compiled", filename, "-", len(values), "values")
+	stage_data = get_stage_data()
+	for i in range(len(stage_data["tilemap"])):
+		sources = [[filename, os.stat(os.path.join("data", filename))] for filename in get_stage_sources(stage_data, i)]
+		bundle = build_stage_bundle(stage_data, i)
+		write_stage_bundle(get_stage_bundle_path(i), sources, bundle)
+		print("Packed stage", i + 1, "-", len(bundle.enemies), "enemies,", len(bundle.items), "items")
+
+# shot_intersects_obstacle: Highest obstacle value along the line of fire. The line runs between the tiles of the
+# first and last 8px steps from p1 towards p2 (offset by 16px, like the enemies' guns)
 def shot_intersects_obstacle(p1, p2, tilemap):
 	deltap = [p2[0] - p1[0], p2[1] - p1[1]]
 	len_deltap = math.sqrt(deltap[0] * deltap[0] + deltap[1] * deltap[1])
-	stepp = [deltap[0] / (len_deltap / 8), deltap[1] / (len_deltap / 8)]
-	obst = 0
-	for i in range(int(len_deltap / 8)):
-		#print([int((p1[0] + 16 + (stepp[0] * i)) / 16), int((p1[1] + 16 + (stepp[1] * i) + tilemap.scroll_position) / 16)])
-		obst_get = tilemap.get_map_obstacle_value([int((p1[0] + 16 + (stepp[0] * i)) / 16), int((p1[1] + 16 + (stepp[1] * i) + tilemap.scroll_position) / 16)]) 
-		if obst_get > obst:
-			if not obst_get == 3:
-				obst = obst_get
-	return obst
+	steps = int(len_deltap / 8)
+	if(steps == 0):
+		return 0
+	last = (steps - 1) * 8 / len_deltap
+	start = [int(math.floor((p1[0] + 16) / 16)), int(math.floor((p1[1] + 16) / 16))]
+	end = [int(math.floor((p1[0] + 16 + deltap[0] * last) / 16)), int(math.floor((p1[1] + 16 + deltap[1] * last) / 16))]
+	return tilemap.get_line_obstacle_value(start, end)
 			
 
+# Defaults for the keys an enemy archetype leaves out (see data/enemytypes.dat)
+enemy_archetype_defaults = {
+	"health": 90,
+	"shot_interval": 0.4,
+	"gun_speed": 180,
+	"gun_damage": 20,
+	"shot_sound": "enemy-shoot-weak",
+	"walking_speed": 30,
+	"running_speed": 15,
+	"points": 0,
+	"xoffset": [], # [base, deviation] - how far to the side of the player it likes to stand, if it cares
+	"ai_timer": [180, 240], # The timer it starts with
+	"ai_cycle_timer": [180, 240], # The timer it gets each time it goes to the next cyclic AI state
+	"cyclic_ai_states": 1,
+	"player_dead_state": [1, 180, 45], # AI state (and its timer) to go to while the player is dead
+	"blind_fire": 0, # 1 to shoot without checking the line of sight while it advances
+	"static": 0, # 1 for enemies that never walk
+	"drops": []
+}
+
+# parse_archetype_value: "12" -> 12, "0.4" -> 0.4, "180,240" -> [180, 240], "ammo9mm:0.14,syringe:0.1" -> [["ammo9mm", 0.14], ["syringe", 0.1]]
+def parse_archetype_value(value):
+	def parse_number(text):
+		try:
+			return int(text)
+		except ValueError:
+			pass
+		try:
+			return float(text)
+		except ValueError:
+			return text
+	if(value == ""):
+		return []
+	if(":" in value):
+		pairs = []
+		for item in value.split(","):
+			name, number = item.split(":")
+			pairs.append([name, parse_number(number)])
+		return pairs
+	if("," in value):
+		return [parse_number(item) for item in value.split(",")]
+	return parse_number(value)
+
+# load_enemy_archetypes: Reads the enemy types from a file in data/ - blocks of key=value lines between "enemytype:" and ":end"
+def load_enemy_archetypes(filename):
+	archetypes = dict()
+	path = os.path.join("data", filename)
+	with open(path) as f:
+		archetype = None
+		for l in f.readlines():
+			l = l.strip()
+			if(l == "" or l.startswith("#")):
+				continue
+			if(l == "enemytype:"):
+				archetype = dict(enemy_archetype_defaults)
+			elif(l == ":end"):
+				if(archetype is None or not "name" in archetype):
+					raise ValueError("An enemy type in " + filename + " has no name")
+				if(not hasattr(Enemy, "think_" + archetype["ai"])):
+					raise ValueError("Unknown ai \"" + archetype["ai"] + "\" for enemy type " + archetype["name"])
+				archetypes[archetype["name"]] = archetype
+				archetype = None
+			elif(archetype is not None):
+				key, value = l.split("=", 1)
+				archetype[key] = parse_archetype_value(value)
+	return archetypes
+
+# Enemy: Every enemy in the game. What sets the types apart (sprites, health, weapon, speeds, timers, drops) comes
+# from their archetype, and the archetype's ai picks the think_ method that makes the decisions - movement,
+# pathfinding, shooting and damage are the same for all of them
 class Enemy:
-	def __init__(self):
+	def __init__(self, archetype, xpos, ypos, camera, rng, aitype = "normal"):
+		self.archetype = archetype
 		self.animations = AnimationGroup()
-		self.health = 90
+		self.camera = camera
+		self.rng = rng # RandomStreams
+		self.occupancy = None # The controller's TileOccupancy, once the enemy has been added to it
+		self.animations.add_animation(Animation(archetype["sprite"] + ".png", 4, 4, "walk"))
+		self.animations.add_animation(Animation(archetype["sprite"] + "-damage.png", 1, 1, "damage"))
+		anim = self.animations.add_animation(Animation(archetype["sprite"] + "-die.png", 3, 1, "dead"))
+		anim.looping = False
+		anim.returns = False
+		anim.frametime = 1/8
+		self.animations.moveto(xpos * 16, ypos * 16 - 8)
+		self.health = archetype["health"]
 		self.shot_timer = 0.0
-		self.shot_interval = 0.4
-		self.gun_speed = 180
-		self.gun_damage = 20
+		self.shot_interval = archetype["shot_interval"]
+		self.gun_speed = archetype["gun_speed"]
+		self.gun_damage = archetype["gun_damage"]
+		self.shot_sound = archetype["shot_sound"]
+		self.blind_fire = archetype["blind_fire"] == 1
 		self.dead = False
 		self.deadanim = False
 		self.deathtimer = 1.5
@@ -528,8 +1007,42 @@ class Enemy:
 		self.blink_rate = 1/24
 		self.blink_timer = 0.6
 		self.taking_damage = False
+		self.ticks = 1 # Length of the current update in ticks, for the frame-count timers
+		self.aitype = aitype
+		if not(aitype == "normal" or aitype == "camper"):
+			self.aitype = "normal"
+		self.current_tile = [xpos, ypos]
+		self.intended_path = [xpos, ypos]
+		self.static = archetype["static"] == 1
+		self.walk_speed = archetype["walking_speed"]
+		self.walking_speed = archetype["walking_speed"]
+		self.running_speed = archetype["running_speed"]
+		self.running = False
+		self.walk_frame_count = 0
+		self.movement_stack = []
+		self.moving = False
+		self.stuck_offscreen = False
+		self.points = archetype["points"]
+		self.xoffset = 0
+		if(archetype["xoffset"]):
+			if(self.rng.ai.random() > 0.5):
+				self.xoffset = int(archetype["xoffset"][0] + self.rng.ai.random() * archetype["xoffset"][1])
+			else:
+				self.xoffset = int(-archetype["xoffset"][0] - self.rng.ai.random() * archetype["xoffset"][1])
+		self.ai_state = 0
+		self.cyclic_ai_states = archetype["cyclic_ai_states"]
+		self.ai_timer = archetype["ai_timer"][0]
+		if(archetype["ai_timer"][1] > 0):
+			self.ai_timer += int(self.rng.ai.random() * archetype["ai_timer"][1])
+		self.aim_cursor = None
+		self.item_drops = [list(drop) for drop in archetype["drops"]]
+		self.think = getattr(self, "think_" + archetype["ai"])
+		setup = getattr(self, "setup_" + archetype["ai"], None)
+		if(setup is not None):
+			setup()
 	
-	def update(self, delta_time, bullet_controller, particle_controller, sound_controller):
+	def update(self, delta_time, bullet_controller, tilemap, enemy_controller, player, particle_controller, sound_controller):
+		self.ticks = delta_time * TICKS_PER_SECOND
 		if(self.dead):
 			if(not self.deadanim):
 				self.animations.set_animation("dead")
@@ -555,16 +1068,85 @@ class Enemy:
 		self.shot_timer -= delta_time
 		if(self.shot_timer <= 0):
 			self.shot_timer = 0
-		
+		if(self.dead):
+			return
+		if(not self.is_onscreen()):
+			return
+		# -- AI -- #
+		if(self.ai_timer > 0):
+			self.ai_timer -= self.ticks
+		else:
+			self.ai_timer = self.archetype["ai_cycle_timer"][0] + int(self.rng.ai.random() * self.archetype["ai_cycle_timer"][1])
+			self.ai_state += 1
+			if(self.ai_state >= self.cyclic_ai_states):
+				self.ai_state = 0
+		if(self.aitype == "normal"):
+			if(not self.moving):
+				if(self.stuck_offscreen):
+					self.stuck_offscreen = False
+				if(player.dead):
+					dead_state = self.archetype["player_dead_state"]
+					self.set_ai_state(dead_state[0], dead_state[1], dead_state[2])
+				self.think(player.animations.get_position(), player, tilemap, enemy_controller, bullet_controller, sound_controller)
+		if(self.static):
+			return
+		# -- Handle movement -- #
+		if(not self.intended_path == []):
+			if(not self.moving):
+				self.moving = True
+				if(self.running):
+					self.walk_speed = self.running_speed
+				else:
+					self.walk_speed = self.walking_speed
+				self.animations.animations[self.animations.curr_animation].frametime = self.walk_speed / 180
+				self.animations.play()
+				self.walk_frame_count = self.walk_speed
+			if(self.walk_frame_count > 0):
+				xpos = (((self.current_tile[0] * self.walk_frame_count) + (self.intended_path[0] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 
+				ypos = (((self.current_tile[1] * self.walk_frame_count) + (self.intended_path[1] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 - 8
+				self.animations.moveto(xpos, ypos)
+				self.walk_frame_count -= self.ticks
+			else:
+				self.moving = False
+				self.running = False
+				self.set_tiles(self.intended_path, [])
+		else:
+			self.animations.stop()
+		self.animations.update(delta_time)
+	
+	def set_ai_state(self, state, timer = 180, deviation = 240):
+		self.ai_timer = timer + int(self.rng.ai.random() * deviation)
+		self.ai_state = state
+	
+	def set_item_drops(self, dropslist):
+		self.item_drops = dropslist
+	
+	# shoot_at: Fires at the player, with up to spread / 2 degrees of error either way, unless the line of sight is blocked
+	# (cover only blocks it while the player is hiding without aiming). Returns whether it fired
+	def shoot_at(self, playerpos, player, tilemap, bullet_controller, sound_controller, spread, damage = None, interval = None, check_clear = True):
+		if(check_clear):
+			clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
+			if not(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
+				return False
+		if(damage is None):
+			damage = self.gun_damage
+		if(interval is None):
+			interval = self.shot_interval
+		shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
+		gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
+		bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + self.rng.ai.random() * spread - spread // 2, self.gun_speed, damage)
+		sound_controller.play_sound(self.shot_sound)
+		self.shot_timer = interval
+		return True
 	
 	def get_hitbox(self):
 		topleft = self.animations.get_position()
 		return pygame.Rect(topleft[0] + 1, topleft[1] + 1, 14, 22)
-		
+	
 	def get_coll_hitbox(self):
 		topleft = self.animations.get_position()
 		return pygame.Rect(topleft[0] + 15, topleft[1] + 1, 16, 9)
-		
+	
 	def take_damage(self, damage, particle_controller, sound_controller):
 		if(self.dead):
 			return
@@ -578,23 +1160,39 @@ class Enemy:
 			particle_controller.spawn_particle("blood-small", [self.animations.get_position()[0], self.animations.get_position()[1] + 4])
 		if(self.health <= 0):
 			self.die()
-			sound_controller.play_sound("".join(["enemy-die", str(int(random.random() * 2 + 1))]))
+			sound_controller.play_sound("".join(["enemy-die", str(int(self.rng.cosmetic.random() * 2 + 1))]))
 		else:
-			sound_controller.play_sound("".join(["enemy-damage", str(int(random.random() * 3 + 1))]))
+			sound_controller.play_sound("".join(["enemy-damage", str(int(self.rng.cosmetic.random() * 3 + 1))]))
 	
 	def die(self):
 		if(self.dead):
 			return
 		self.dead = True
-		
+	
+	# chance: A random check for AI decisions that passes with probability p once per tick, so the decisions come
+	# just as often with any length of update
+	def chance(self, p):
+		if(self.ticks != 1):
+			p = 1 - (1 - p) ** self.ticks
+		return self.rng.ai.random() < p
+	
+	# set_tiles: Changes the tile the enemy stands on and the one it is walking to, keeping its reservation in the occupancy grid up to date
+	def set_tiles(self, current_tile, intended_path):
+		if(self.occupancy is not None):
+			self.occupancy.release(self)
+		self.current_tile = current_tile
+		self.intended_path = intended_path
+		if(self.occupancy is not None):
+			self.occupancy.reserve(self)
+	
+	def get_screen_y(self):
+		return self.camera.get_screen_y(self.animations.get_position()[1])
+	
 	def is_onscreen(self):
-		#print("is_onscreen called, ypos =", self.animations.get_position()[1])
-		return self.animations.get_position()[1] > -24 and (not self.is_offscreen())
-		
+		return self.get_screen_y() > -24 and (not self.is_offscreen()) and (not self.stuck_offscreen)
 	
 	def is_offscreen(self):
-		return self.animations.get_position()[1] > 224
-	
+		return self.get_screen_y() > 224
 	
 	def check_for_damage(self, bullet_controller, particle_controller, sound_controller):
 		if(self.dead):
@@ -608,201 +1206,29 @@ class Enemy:
 			self.take_damage(m, particle_controller, sound_controller)
 		bullet_controller.destroy(bullets)
 	
-	def scroll(self, y):
-		self.animations.move_absolute([0, y])
-	
 	def draw(self, dest):
 		if self.is_onscreen() and not self.blink_state:
-			#print("roar")
-			self.animations.draw(dest)
-
-# -- Enemy classes - subclasses of Enemy -- #
-
-class Guard(Enemy):
-	def __init__(self, xpos, ypos, scroll_pos, aitype="normal"):
-		Enemy.__init__(self)
-		self.animations.add_animation(Animation("guard.png", 4, 4, "walk"))
-		self.animations.add_animation(Animation("guard-damage.png", 1, 1, "damage"))
-		anim = self.animations.add_animation(Animation("guard-die.png", 3, 1, "dead"))
-		anim.looping = False
-		anim.returns = False
-		anim.frametime = 1/8
-		#print("new guard at", xpos * 16, ypos * 16 - scroll_pos)
-		self.animations.moveto(xpos * 16, ypos * 16 - 8 - scroll_pos)
-		self.aitype = aitype
-		if not(aitype == "normal" or aitype == "camper"):
-			#print("Error: Invalid ai type", aitype, "for enemy type \"guard\", defaulting to \"normal\"")
-			self.aitype = "normal"
-		self.current_tile = [xpos, ypos]
-		self.intended_path = [xpos, ypos]
-		self.walk_speed = 30
-		self.walking_speed = 30
-		self.running_speed = 15
-		self.running = False
-		self.walk_frame_count = 0
-		self.velocity = [0, 0]
-		self.movement_stack = []
-		self.moving = False
-		self.stuck_offscreen = False
-		self.points = 300
-		
-		self.ai_state = 0
-		self.cyclic_ai_states = 1
-		self.ai_timer = 180 + int(random.random() * 240)
-		self.pathfind_range = 3
-		
-		self.item_drops = [["ammo9mm", 0.14]]
-	
-	def is_onscreen(self):
-		return self.animations.get_position()[1] > -24 and (not self.is_offscreen()) and (not self.stuck_offscreen)
-	
-	def set_ai_state(self, state, timer = 180, deviation = 240):
-		self.ai_timer = timer + int(random.random() * deviation)
-		self.ai_state = state
-	
-	def set_item_drops(self, dropslist):
-		self.item_drops = dropslist
-		
-	def update(self, delta_time, bullet_controller, tilemap, enemy_controller, player, particle_controller, sound_controller):
-		Enemy.update(self, delta_time, bullet_controller, particle_controller, sound_controller)
-		if(self.dead):
-			return
-		if(not self.is_onscreen()):
-			return
-		# -- AI -- #
-		if(self.ai_timer > 0):
-			self.ai_timer -= 1
-		else:
-			self.ai_timer = 180 + int(random.random() * 240)
-			self.ai_state += 1
-			if(self.ai_state >= self.cyclic_ai_states):
-				self.ai_state = 0
-		if(self.aitype == "normal"):
-			if(not self.moving):
-				if(self.stuck_offscreen):
-					self.stuck_offscreen = False
-				if(player.dead):
-					self.set_ai_state(1, 180, 45)
-				playerpos = player.animations.get_position()
-				if(self.ai_state == 0): # Attack
-					if(self.animations.get_position()[1] < 0): # Off-screen - get into the screen area
-						if not(self.try_movement([0, 1], tilemap, enemy_controller)):
-							self.stuck_offscreen = True
-					elif(playerpos[1] - self.animations.get_position()[1] > 96): # Too far away from player - try to get close
-						if(random.random() < 0.05 and playerpos[1] - self.animations.get_position()[1] < 144):
-							self.set_ai_state(2, 120, 90)
-						# Intent: move down
-						#print("{ai-move}", self, "Trying move down")
-						self.try_movement([0, 1], tilemap, enemy_controller)
-						#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							
-					elif(playerpos[1] - self.animations.get_position()[1] > 24): # Close enough
-						if(abs(playerpos[0] - self.animations.get_position()[0]) > 48): # Too far away in the X direction
-							if(playerpos[0] - self.animations.get_position()[0] > 0): # Player is to the right
-								# Intent: move right
-								#print("{ai-move}", self, "Trying move right")
-								self.try_movement([1, 0], tilemap, enemy_controller)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							else:
-								# Intent: move left
-								#print("{ai-move}", self, "Trying move left")
-								self.try_movement([-1, 0], tilemap, enemy_controller)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-								
-						else: # We are going to try to shoot.
-							if(random.random() < 0.08):
-								self.set_ai_state(1, 90, 60)
-							if(self.shot_timer == 0):
-								clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-								if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-									shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-									gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-									bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 30 - 15, self.gun_speed, self.gun_damage)
-									sound_controller.play_sound("enemy-shoot-weak")
-									self.shot_timer = self.shot_interval
-								
-					else: # Too close or below the player - we don't want that
-						# Intent: move up
-						self.try_movement([0, -1], tilemap, enemy_controller)
-						if(self.animations.get_position()[1] > 160):
-							self.running = True
-							
-						
-						
-				elif(self.ai_state == 1): # Retreat {non-cyclic}
-					if(playerpos[1] - self.animations.get_position()[1] > 80 or playerpos[1] - self.animations.get_position()[1] < 24):
-						self.set_ai_state(0)
-						
-					elif(abs(playerpos[0] - self.animations.get_position()[0]) < 80):
-						if(playerpos[0] - self.animations.get_position()[0] < 0): # Player is to the left
-							# Intent: move right
-							#print("{ai-move}", self, "Trying move right")
-							self.try_movement([1, 0], tilemap, enemy_controller)
-							#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							
-						else:
-							# Intent: move left
-							#print("{ai-move}", self, "Trying move left")
-							self.try_movement([-1, 0], tilemap, enemy_controller)
-							#print("{ai-moved}", self, "intended_path =", self.intended_path)
-				
-				
-				elif(self.ai_state == 2): # Shoot from far away {non-cyclic}
-					if(self.shot_timer == 0):
-						clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-						if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-							shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-							gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-							bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 12 - 6, self.gun_speed, self.gun_damage)
-							sound_controller.play_sound("enemy-shoot-weak")
-							self.shot_timer = self.shot_interval
-							
-		# -- Handle movement -- #
-		if(not self.intended_path == []):
-			if(not self.moving):
-				self.moving = True
-				if(self.running):
-					self.walk_speed = self.running_speed
-				else:
-					self.walk_speed = self.walking_speed
-				self.animations.animations[self.animations.curr_animation].frametime = self.walk_speed / 180
-				self.animations.play()
-				self.walk_frame_count = self.walk_speed
-			if(self.walk_frame_count > 0):
-				xpos = (((self.current_tile[0] * self.walk_frame_count) + (self.intended_path[0] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 
-				ypos = (((self.current_tile[1] * self.walk_frame_count) + (self.intended_path[1] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 - tilemap.scroll_position - 8
-				#print(self, xpos, ypos)
-				self.animations.moveto(xpos, ypos)
-				self.walk_frame_count -= 1
-			else:
-				self.moving = False
-				self.running = False
-				self.current_tile = self.intended_path
-				self.intended_path = []	
-		else:
-			self.animations.stop()
-		self.animations.update(delta_time)
+			self.animations.draw(dest, self.camera.scroll_position)
+		if(self.aim_cursor is not None and not self.dead):
+			self.aim_cursor.draw(dest)
 	
 	def lookat_tile(self, delta, tilemap, enemy_controller):
-		#print(self, "lookingat", self.current_tile[0] + delta[0], self.current_tile[1] + delta[1])
 		e = 0
 		if(enemy_controller.check_tile_for_enemy([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]])):
 			e = -1024
-		#print(tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e)
 		return tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e
 	
 	def try_movement(self, delta, tilemap, enemy_controller):
 		if(len(self.movement_stack) == 0):
-			if(delta == [0, -1] and self.animations.get_position()[1] < 0):
+			if(delta == [0, -1] and self.get_screen_y() < 0):
 				delta == [0, 1]
 			delta_temp = delta
 			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
 				self.movement_stack.append(delta_temp)
 				delta_temp = self.rotate_delta_cw(delta)
 				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
 					return False
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
+			self.set_tiles(self.current_tile, [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]])
 			if(not (tilemap.get_map_obstacle_value(self.intended_path) == 0)):
 				print("{try_movement} Oops! intended_path", self.intended_path, "is blocked but was chosen as unblocked (???)")
 			self.animations.set_direction(compute_direction(delta))
@@ -815,1324 +1241,390 @@ class Guard(Enemy):
 			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
 				delta_temp = self.rotate_delta_cw(delta)
 				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
 					return False
 				self.movement_stack.append(delta_temp)
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
+			self.set_tiles(self.current_tile, [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]])
 			self.movement_stack.pop()
 			self.animations.set_direction(compute_direction(delta))
 			return True
-				
-			
 	
 	def rotate_delta_cw(self, delta):
 		return [-delta[1], delta[0]]
-
-class Soldier(Enemy):
-	def __init__(self, xpos, ypos, scroll_pos, aitype="normal"):
-		Enemy.__init__(self)
-		self.animations.add_animation(Animation("soldier.png", 4, 4, "walk"))
-		self.animations.add_animation(Animation("soldier-damage.png", 1, 1, "damage"))
-		anim = self.animations.add_animation(Animation("soldier-die.png", 3, 1, "dead"))
-		self.health = 125
-		self.shot_timer = 0.0
-		self.shot_interval = 0.4
-		self.gun_speed = 195
-		self.gun_damage = 26
-		anim.looping = False
-		anim.returns = False
-		anim.frametime = 1/8
-		#print("new guard at", xpos * 16, ypos * 16 - scroll_pos)
-		self.animations.moveto(xpos * 16, ypos * 16 - 8 - scroll_pos)
-		self.aitype = aitype
-		if not(aitype == "normal" or aitype == "camper"):
-			#print("Error: Invalid ai type", aitype, "for enemy type \"soldier\", defaulting to \"normal\"")
-			self.aitype = "normal"
-		self.current_tile = [xpos, ypos]
-		self.intended_path = [xpos, ypos]
-		self.walk_speed = 25
-		self.walking_speed = 25
-		self.running_speed = 17
-		self.running = False
-		self.walk_frame_count = 0
-		self.velocity = [0, 0]
-		self.movement_stack = []
-		self.moving = False
-		self.stuck_offscreen = False
-		self.points = 450
-		if(random.random() > 0.5):
-			self.xoffset = int(24 + random.random() * 32)
-		else:
-			self.xoffset = int(-24 - random.random() * 32)
-		self.ai_state = 0
-		self.cyclic_ai_states = 2
-		self.ai_timer = 180 + int(random.random() * 240)
-		self.pathfind_range = 3
-		
-		self.item_drops = [["ammo9mm", 0.25], ["syringe", 0.1]]
 	
-	def is_onscreen(self):
-		return self.animations.get_position()[1] > -24 and (not self.is_offscreen()) and (not self.stuck_offscreen)
-	
-	def set_ai_state(self, state, timer = 180, deviation = 240):
-		self.ai_timer = timer + int(random.random() * deviation)
-		self.ai_state = state
-	
-	def set_item_drops(self, dropslist):
-		self.item_drops = dropslist
-		
-	def update(self, delta_time, bullet_controller, tilemap, enemy_controller, player, particle_controller, sound_controller):
-		Enemy.update(self, delta_time, bullet_controller, particle_controller, sound_controller)
-		if(self.dead):
-			return
-		if(not self.is_onscreen()):
-			return
-		# -- AI -- #
-		if(self.ai_timer > 0):
-			self.ai_timer -= 1
-		else:
-			self.ai_timer = 180 + int(random.random() * 240)
-			self.ai_state += 1
-			if(self.ai_state >= self.cyclic_ai_states):
-				self.ai_state = 0
-		if(self.aitype == "normal"):
-			if(not self.moving):
-				if(self.stuck_offscreen):
-					self.stuck_offscreen = False
-				if(player.dead):
-					self.set_ai_state(2, 180, 45)
-				playerpos = player.animations.get_position()
-				if(self.ai_state == 0 or self.ai_state == 1): # Attack
-					if(self.animations.get_position()[1] < 0): # Off-screen - get into the screen area
-						if not(self.try_movement([0, 1], tilemap, enemy_controller)):
-							self.stuck_offscreen = True
-					elif(playerpos[1] - self.animations.get_position()[1] > 96): # Too far away from player - try to get close
-						if(random.random() < 0.05 and playerpos[1] - self.animations.get_position()[1] < 144):
-							self.set_ai_state(3, 120, 90)
-						# Intent: move down
-						#print("{ai-move}", self, "Trying move down")
-						self.try_movement([0, 1], tilemap, enemy_controller)
-						#print("{ai-moved}", self, "intended_path =", self.intended_path)
-						if(self.ai_state == 1): # Shoot while going towards player
-							if(random.random() < 0.08):
-								self.set_ai_state(0, 135, 120)
-							if(self.shot_timer == 0):
-								shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-								gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-								bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 32 - 16, self.gun_speed, self.gun_damage)
-								sound_controller.play_sound("enemy-shoot-weak")
-								self.shot_timer = self.shot_interval
-							
-					elif(playerpos[1] - self.animations.get_position()[1] > 48): # Close enough
-						if(abs(playerpos[0] + self.xoffset - self.animations.get_position()[0] ) > 28): # Too far away in the X direction
-							if(playerpos[0] + self.xoffset - self.animations.get_position()[0] > 0): # Player is to the right
-								# Intent: move right
-								#print("{ai-move}", self, "Trying move right")
-								self.try_movement([1, 0], tilemap, enemy_controller)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							else:
-								# Intent: move left
-								#print("{ai-move}", self, "Trying move left")
-								self.try_movement([-1, 0], tilemap, enemy_controller)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-								
-						else: # Try to move up while shooting.
-							self.set_ai_state(4)
-								
-					else: # Too close or below the player - we don't want that
-						# Intent: move up (possibly shoot)
-						self.try_movement([0, -1], tilemap, enemy_controller)
-						if(self.animations.get_position()[1] > 160):
-							self.running = True
-						if(self.ai_state == 1): # Shoot while going towards player
-							if(random.random() < 0.08):
-								self.set_ai_state(0, 135, 120)
-							if(self.shot_timer == 0):
-								clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-								if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-									shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-									gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-									bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 32 - 16, self.gun_speed, self.gun_damage)
-									sound_controller.play_sound("enemy-shoot-weak")
-									self.shot_timer = self.shot_interval
-				
-				elif(self.ai_state == 4): # Shoot and retreat {non-cyclic}
-					if(playerpos[1] - self.animations.get_position()[1] > 112):
-						self.set_ai_state(0)
+	# think_guard: Walks down towards the player and shoots when lined up with them, backing off now and then
+	def think_guard(self, playerpos, player, tilemap, enemy_controller, bullet_controller, sound_controller):
+		if(self.ai_state == 0): # Attack
+			if(self.get_screen_y() < 0): # Off-screen - get into the screen area
+				if not(self.try_movement([0, 1], tilemap, enemy_controller)):
+					self.stuck_offscreen = True
+			elif(playerpos[1] - self.animations.get_position()[1] > 96): # Too far away from player - try to get close
+				if(self.chance(0.05) and playerpos[1] - self.animations.get_position()[1] < 144):
+					self.set_ai_state(2, 120, 90)
+				# Intent: move down
+				self.try_movement([0, 1], tilemap, enemy_controller)
+
+			elif(playerpos[1] - self.animations.get_position()[1] > 24): # Close enough
+				if(abs(playerpos[0] - self.animations.get_position()[0]) > 48): # Too far away in the X direction
+					if(playerpos[0] - self.animations.get_position()[0] > 0): # Player is to the right
+						# Intent: move right
+						self.try_movement([1, 0], tilemap, enemy_controller)
 					else:
-						self.try_movement([0, -1], tilemap, enemy_controller)
-						if(random.random() < 0.08):
-							self.set_ai_state(2, 90, 60)
-						if(self.shot_timer == 0):
-							clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-							if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-								shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-								gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-								bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 24 - 12, self.gun_speed, self.gun_damage)
-								sound_controller.play_sound("enemy-shoot-weak")
-								self.shot_timer = self.shot_interval
-						
-				elif(self.ai_state == 2): # Retreat {non-cyclic}
-					if(playerpos[1] - self.animations.get_position()[1] > 112 or playerpos[1] - self.animations.get_position()[1] < 24):
-						self.set_ai_state(0)
-						
-					elif(abs(playerpos[0] - self.animations.get_position()[0]) < 80):
-						if(playerpos[0] - self.animations.get_position()[0] < 0): # Player is to the left
-							# Intent: move right
-							#print("{ai-move}", self, "Trying move right")
-							self.try_movement([1, 0], tilemap, enemy_controller)
-							#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							
-						else:
-							# Intent: move left
-							#print("{ai-move}", self, "Trying move left")
-							self.try_movement([-1, 0], tilemap, enemy_controller)
-							#print("{ai-moved}", self, "intended_path =", self.intended_path)
-				
-				
-				elif(self.ai_state == 3): # Shoot from far away {non-cyclic}
-					if(random.random() < 0.2):
-						self.ai_state = 0
+						# Intent: move left
+						self.try_movement([-1, 0], tilemap, enemy_controller)
+
+				else: # We are going to try to shoot.
+					if(self.chance(0.08)):
+						self.set_ai_state(1, 90, 60)
 					if(self.shot_timer == 0):
-						clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-						if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-							shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-							gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-							bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 12 - 6, self.gun_speed, self.gun_damage)
-							sound_controller.play_sound("enemy-shoot-weak")
-							self.shot_timer = self.shot_interval
-							
-		# -- Handle movement -- #
-		if(not self.intended_path == []):
-			if(not self.moving):
-				self.moving = True
-				if(self.running):
-					self.walk_speed = self.running_speed
+						self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 30)
+
+			else: # Too close or below the player - we don't want that
+				# Intent: move up
+				self.try_movement([0, -1], tilemap, enemy_controller)
+				if(self.get_screen_y() > 160):
+					self.running = True
+
+		elif(self.ai_state == 1): # Retreat {non-cyclic}
+			if(playerpos[1] - self.animations.get_position()[1] > 80 or playerpos[1] - self.animations.get_position()[1] < 24):
+				self.set_ai_state(0)
+
+			elif(abs(playerpos[0] - self.animations.get_position()[0]) < 80):
+				if(playerpos[0] - self.animations.get_position()[0] < 0): # Player is to the left
+					# Intent: move right
+					self.try_movement([1, 0], tilemap, enemy_controller)
+
 				else:
-					self.walk_speed = self.walking_speed
-				self.animations.animations[self.animations.curr_animation].frametime = self.walk_speed / 180
-				self.animations.play()
-				self.walk_frame_count = self.walk_speed
-			if(self.walk_frame_count > 0):
-				xpos = (((self.current_tile[0] * self.walk_frame_count) + (self.intended_path[0] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 
-				ypos = (((self.current_tile[1] * self.walk_frame_count) + (self.intended_path[1] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 - tilemap.scroll_position - 8
-				#print(self, xpos, ypos)
-				self.animations.moveto(xpos, ypos)
-				self.walk_frame_count -= 1
+					# Intent: move left
+					self.try_movement([-1, 0], tilemap, enemy_controller)
+
+		elif(self.ai_state == 2): # Shoot from far away {non-cyclic}
+			if(self.shot_timer == 0):
+				self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 12)
+	
+	# think_soldier: Keeps to one side of the player, shooting while it advances and retreating up the screen after a while
+	def think_soldier(self, playerpos, player, tilemap, enemy_controller, bullet_controller, sound_controller):
+		if(self.ai_state == 0 or self.ai_state == 1): # Attack
+			if(self.get_screen_y() < 0): # Off-screen - get into the screen area
+				if not(self.try_movement([0, 1], tilemap, enemy_controller)):
+					self.stuck_offscreen = True
+			elif(playerpos[1] - self.animations.get_position()[1] > 96): # Too far away from player - try to get close
+				if(self.chance(0.05) and playerpos[1] - self.animations.get_position()[1] < 144):
+					self.set_ai_state(3, 120, 90)
+				# Intent: move down
+				self.try_movement([0, 1], tilemap, enemy_controller)
+				if(self.ai_state == 1): # Shoot while going towards player
+					if(self.chance(0.08)):
+						self.set_ai_state(0, 135, 120)
+					if(self.shot_timer == 0):
+						self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 32, check_clear = not self.blind_fire)
+
+			elif(playerpos[1] - self.animations.get_position()[1] > 48): # Close enough
+				if(abs(playerpos[0] + self.xoffset - self.animations.get_position()[0] ) > 28): # Too far away in the X direction
+					if(playerpos[0] + self.xoffset - self.animations.get_position()[0] > 0): # Player is to the right
+						# Intent: move right
+						self.try_movement([1, 0], tilemap, enemy_controller)
+					else:
+						# Intent: move left
+						self.try_movement([-1, 0], tilemap, enemy_controller)
+
+				else: # Try to move up while shooting.
+					self.set_ai_state(4)
+
+			else: # Too close or below the player - we don't want that
+				# Intent: move up (possibly shoot)
+				self.try_movement([0, -1], tilemap, enemy_controller)
+				if(self.get_screen_y() > 160):
+					self.running = True
+				if(self.ai_state == 1): # Shoot while going towards player
+					if(self.chance(0.08)):
+						self.set_ai_state(0, 135, 120)
+					if(self.shot_timer == 0):
+						self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 32)
+
+		elif(self.ai_state == 4): # Shoot and retreat {non-cyclic}
+			if(playerpos[1] - self.animations.get_position()[1] > 112):
+				self.set_ai_state(0)
 			else:
-				self.moving = False
-				self.running = False
-				self.current_tile = self.intended_path
-				self.intended_path = []
-		else:
-			self.animations.stop()
-		self.animations.update(delta_time)
-	
-	def lookat_tile(self, delta, tilemap, enemy_controller):
-		#print(self, "lookingat", self.current_tile[0] + delta[0], self.current_tile[1] + delta[1])
-		e = 0
-		if(enemy_controller.check_tile_for_enemy([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]])):
-			e = -1024
-		#print(tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e)
-		return tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e
-	
-	def try_movement(self, delta, tilemap, enemy_controller):
-		if(len(self.movement_stack) == 0):
-			if(delta == [0, -1] and self.animations.get_position()[1] < 0):
-				delta == [0, 1]
-			delta_temp = delta
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				self.movement_stack.append(delta_temp)
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			if(not (tilemap.get_map_obstacle_value(self.intended_path) == 0)):
-				print("{try_movement} Oops! intended_path", self.intended_path, "is blocked but was chosen as unblocked (???)")
-			self.animations.set_direction(compute_direction(delta))
-			return True
-		else:
-			if(not delta == self.movement_stack[0]):
-				self.movement_stack = []
-				return self.try_movement(delta, tilemap, enemy_controller)
-			delta_temp = self.movement_stack[len(self.movement_stack) - 1]
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-				self.movement_stack.append(delta_temp)
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			self.movement_stack.pop()
-			self.animations.set_direction(compute_direction(delta))
-			return True
-				
-			
-	
-	def rotate_delta_cw(self, delta):
-		return [-delta[1], delta[0]]
+				self.try_movement([0, -1], tilemap, enemy_controller)
+				if(self.chance(0.08)):
+					self.set_ai_state(2, 90, 60)
+				if(self.shot_timer == 0):
+					self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 24)
 
+		elif(self.ai_state == 2): # Retreat {non-cyclic}
+			if(playerpos[1] - self.animations.get_position()[1] > 112 or playerpos[1] - self.animations.get_position()[1] < 24):
+				self.set_ai_state(0)
 
-		
+			elif(abs(playerpos[0] - self.animations.get_position()[0]) < 80):
+				if(playerpos[0] - self.animations.get_position()[0] < 0): # Player is to the left
+					# Intent: move right
+					self.try_movement([1, 0], tilemap, enemy_controller)
 
-class Gunner(Enemy):
-	def __init__(self, xpos, ypos, scroll_pos, aitype="normal"):
-		Enemy.__init__(self)
-		self.animations.add_animation(Animation("gunner.png", 4, 4, "walk"))
-		self.animations.add_animation(Animation("gunner-damage.png", 1, 1, "damage"))
-		anim = self.animations.add_animation(Animation("gunner-die.png", 3, 1, "dead"))
-		self.health = 80
-		self.shot_timer = 0.0
-		self.shot_interval = 0.2
-		self.gun_speed = 165
-		self.gun_damage = 35
-		anim.looping = False
-		anim.returns = False
-		anim.frametime = 1/8
-		#print("new guard at", xpos * 16, ypos * 16 - scroll_pos)
-		self.animations.moveto(xpos * 16, ypos * 16 - 8 - scroll_pos)
-		self.aitype = aitype
-		if not(aitype == "normal" or aitype == "camper"):
-			#print("Error: Invalid ai type", aitype, "for enemy type \"gunner\", defaulting to \"normal\"")
-			self.aitype = "normal"
-		self.current_tile = [xpos, ypos]
-		self.intended_path = [xpos, ypos]
-		self.walk_speed = 36
-		self.walking_speed = 27
-		self.running_speed = 21
-		self.running = False
-		self.walk_frame_count = 0
-		self.velocity = [0, 0]
-		self.movement_stack = []
-		self.moving = False
-		self.stuck_offscreen = False
-		self.points = 600
-		if(random.random() > 0.5):
-			self.xoffset = int(24 + random.random() * 32)
-		else:
-			self.xoffset = int(-24 - random.random() * 32)
-		self.ai_state = 0
-		self.cyclic_ai_states = 1
-		self.ai_timer = 180 + int(random.random() * 240)
-		self.pathfind_range = 3
-		
-		self.item_drops = [["ammo762", 0.35]]
-	
-	def is_onscreen(self):
-		return self.animations.get_position()[1] > -24 and (not self.is_offscreen()) and (not self.stuck_offscreen)
-	
-	def set_ai_state(self, state, timer = 180, deviation = 240):
-		self.ai_timer = timer + int(random.random() * deviation)
-		self.ai_state = state
-	
-	def set_item_drops(self, dropslist):
-		self.item_drops = dropslist
-		
-	def update(self, delta_time, bullet_controller, tilemap, enemy_controller, player, particle_controller, sound_controller):
-		Enemy.update(self, delta_time, bullet_controller, particle_controller, sound_controller)
-		if(self.dead):
-			return
-		if(not self.is_onscreen()):
-			return
-		# -- AI -- #
-		if(self.ai_timer > 0):
-			self.ai_timer -= 1
-		else:
-			self.ai_timer = 180 + int(random.random() * 240)
-			self.ai_state += 1
-			if(self.ai_state >= self.cyclic_ai_states):
+				else:
+					# Intent: move left
+					self.try_movement([-1, 0], tilemap, enemy_controller)
+
+		elif(self.ai_state == 3): # Shoot from far away {non-cyclic}
+			if(self.chance(0.2)):
 				self.ai_state = 0
-		if(self.aitype == "normal"):
-			if(not self.moving):
-				if(self.stuck_offscreen):
-					self.stuck_offscreen = False
-				if(player.dead):
-					self.set_ai_state(2, 180, 45)
-				playerpos = player.animations.get_position()
-				if(self.ai_state == 0 or self.ai_state == 1): # Attack
-					if(self.ai_state == 1 and random.random() < 0.08):
-						self.set_ai_state(0, 135, 120)
-					if(self.animations.get_position()[1] < 0): # Off-screen - get into the screen area
-						if not(self.try_movement([0, 1], tilemap, enemy_controller)):
-							self.stuck_offscreen = True
-					elif(playerpos[1] - self.animations.get_position()[1] > 96): # Too far away from player - try to get close
-						if(random.random() < 0.05 and playerpos[1] - self.animations.get_position()[1] < 144):
-							self.set_ai_state(3, 120, 90)
-						if(abs(playerpos[0] - self.animations.get_position()[0]) < 20): # Player is in line of fire
-							self.set_ai_state(1, 60, 20)
-						# Intent: move down
-						#print("{ai-move}", self, "Trying move down")
-						if not self.try_movement([0, 1], tilemap, enemy_controller):
-							if self.animations.get_position()[1] > 24:
+			if(self.shot_timer == 0):
+				self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 12)
+	
+	# think_gunner: Like the soldier, but stops to fire from afar whenever it can't get closer, and sprays when the player is in its line of fire
+	def think_gunner(self, playerpos, player, tilemap, enemy_controller, bullet_controller, sound_controller):
+		if(self.ai_state == 0 or self.ai_state == 1): # Attack
+			if(self.ai_state == 1 and self.chance(0.08)):
+				self.set_ai_state(0, 135, 120)
+			if(self.get_screen_y() < 0): # Off-screen - get into the screen area
+				if not(self.try_movement([0, 1], tilemap, enemy_controller)):
+					self.stuck_offscreen = True
+			elif(playerpos[1] - self.animations.get_position()[1] > 96): # Too far away from player - try to get close
+				if(self.chance(0.05) and playerpos[1] - self.animations.get_position()[1] < 144):
+					self.set_ai_state(3, 120, 90)
+				if(abs(playerpos[0] - self.animations.get_position()[0]) < 20): # Player is in line of fire
+					self.set_ai_state(1, 60, 20)
+				# Intent: move down
+				if not self.try_movement([0, 1], tilemap, enemy_controller):
+					if self.get_screen_y() > 24:
+						self.set_ai_state(3, 90, 60)
+				if(self.ai_state == 1): # Shoot while going towards player
+					if(self.shot_timer == 0):
+						self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 32)
+
+			elif(playerpos[1] - self.animations.get_position()[1] > 48): # Close enough
+				if(abs(playerpos[0] + self.xoffset - self.animations.get_position()[0] ) > 56): # Too far away in the X direction
+					if(playerpos[0] + self.xoffset - self.animations.get_position()[0] > 0): # Player is to the right
+						# Intent: move right
+						if not self.try_movement([1, 0], tilemap, enemy_controller):
+							if self.get_screen_y() > 24:
 								self.set_ai_state(3, 90, 60)
-						#print("{ai-moved}", self, "intended_path =", self.intended_path)
-						if(self.ai_state == 1): # Shoot while going towards player
-							if(self.shot_timer == 0):
-								clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-								if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-									shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-									gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-									bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 32 - 16, self.gun_speed, self.gun_damage)
-									sound_controller.play_sound("enemy-shoot-weak")
-									self.shot_timer = self.shot_interval
-							
-					elif(playerpos[1] - self.animations.get_position()[1] > 48): # Close enough
-						if(abs(playerpos[0] + self.xoffset - self.animations.get_position()[0] ) > 56): # Too far away in the X direction
-							if(playerpos[0] + self.xoffset - self.animations.get_position()[0] > 0): # Player is to the right
-								# Intent: move right
-								#print("{ai-move}", self, "Trying move right")
-								if not self.try_movement([1, 0], tilemap, enemy_controller):
-									if self.animations.get_position()[1] > 24:
-										self.set_ai_state(3, 90, 60)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							else:
-								# Intent: move left
-								#print("{ai-move}", self, "Trying move left")
-								if not self.try_movement([-1, 0], tilemap, enemy_controller):
-									if self.animations.get_position()[1] > 24:
-										self.set_ai_state(3, 90, 60)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-								
-						else: # Shoot, or possibly retreat
-							if(random.random() < 0.04):
-								self.set_ai_state(2, 60, 40)
-							if(self.shot_timer == 0):
-								clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-								if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-									shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-									gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-									bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 32 - 16, self.gun_speed, self.gun_damage)
-									sound_controller.play_sound("enemy-shoot-weak")
-									self.shot_timer = self.shot_interval
-								
-					else: # Too close or below the player - we don't want that
-						# Intent: move up (possibly shoot)
-						self.try_movement([0, -1], tilemap, enemy_controller)
-						if(self.animations.get_position()[1] > 160):
-							self.running = True
-						if(self.ai_state == 1): # Shoot while going towards player
-							if(random.random() < 0.05):
-								self.set_ai_state(0, 135, 120)
-							if(self.shot_timer == 0):
-								clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-								if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-									shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-									gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-									bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 32 - 16, self.gun_speed, self.gun_damage)
-									sound_controller.play_sound("enemy-shoot-weak")
-									self.shot_timer = self.shot_interval
-				
-				elif(self.ai_state == 4): # Shoot and retreat {non-cyclic}
-					if(playerpos[1] - self.animations.get_position()[1] > 112):
-						self.set_ai_state(0)
 					else:
-						self.try_movement([0, -1], tilemap, enemy_controller)
-						if(random.random() < 0.27):
-							self.set_ai_state(2, 90, 60)
-						if(self.shot_timer == 0):
-							clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-							if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-								shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-								gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-								bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 24 - 12, self.gun_speed, self.gun_damage)
-								sound_controller.play_sound("enemy-shoot-weak")
-								self.shot_timer = self.shot_interval
-						
-				elif(self.ai_state == 2): # Retreat {non-cyclic}
-					if(playerpos[1] - self.animations.get_position()[1] > 112 or playerpos[1] - self.animations.get_position()[1] < 24):
-						self.set_ai_state(0)
-						
-					elif(abs(playerpos[0] - self.animations.get_position()[0]) < 80):
-						if(playerpos[0] - self.animations.get_position()[0] < 0): # Player is to the left
-							# Intent: move right
-							#print("{ai-move}", self, "Trying move right")
-							self.try_movement([1, 0], tilemap, enemy_controller)
-							#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							
-						else:
-							# Intent: move left
-							#print("{ai-move}", self, "Trying move left")
-							self.try_movement([-1, 0], tilemap, enemy_controller)
-							#print("{ai-moved}", self, "intended_path =", self.intended_path)
-				
-				
-				elif(self.ai_state == 3): # Shoot from far away {non-cyclic}
-					if(random.random() < 0.1):
-						self.ai_state = 0
+						# Intent: move left
+						if not self.try_movement([-1, 0], tilemap, enemy_controller):
+							if self.get_screen_y() > 24:
+								self.set_ai_state(3, 90, 60)
+
+				else: # Shoot, or possibly retreat
+					if(self.chance(0.04)):
+						self.set_ai_state(2, 60, 40)
 					if(self.shot_timer == 0):
-						clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-						if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-							shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-							gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-							bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 12 - 6, self.gun_speed, self.gun_damage)
-							sound_controller.play_sound("enemy-shoot-weak")
-							self.shot_timer = self.shot_interval
-							
-		# -- Handle movement -- #
-		if(not self.intended_path == []):
-			if(not self.moving):
-				self.moving = True
-				if(self.running):
-					self.walk_speed = self.running_speed
-				else:
-					self.walk_speed = self.walking_speed
-				self.animations.animations[self.animations.curr_animation].frametime = self.walk_speed / 180
-				self.animations.play()
-				self.walk_frame_count = self.walk_speed
-			if(self.walk_frame_count > 0):
-				xpos = (((self.current_tile[0] * self.walk_frame_count) + (self.intended_path[0] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 
-				ypos = (((self.current_tile[1] * self.walk_frame_count) + (self.intended_path[1] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 - tilemap.scroll_position - 8
-				#print(self, xpos, ypos)
-				self.animations.moveto(xpos, ypos)
-				self.walk_frame_count -= 1
+						self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 32)
+
+			else: # Too close or below the player - we don't want that
+				# Intent: move up (possibly shoot)
+				self.try_movement([0, -1], tilemap, enemy_controller)
+				if(self.get_screen_y() > 160):
+					self.running = True
+				if(self.ai_state == 1): # Shoot while going towards player
+					if(self.chance(0.05)):
+						self.set_ai_state(0, 135, 120)
+					if(self.shot_timer == 0):
+						self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 32)
+
+		elif(self.ai_state == 4): # Shoot and retreat {non-cyclic}
+			if(playerpos[1] - self.animations.get_position()[1] > 112):
+				self.set_ai_state(0)
 			else:
-				self.moving = False
-				self.running = False
-				self.current_tile = self.intended_path
-				self.intended_path = []
-		else:
-			self.animations.stop()
-		self.animations.update(delta_time)
-	
-	def lookat_tile(self, delta, tilemap, enemy_controller):
-		#print(self, "lookingat", self.current_tile[0] + delta[0], self.current_tile[1] + delta[1])
-		e = 0
-		if(enemy_controller.check_tile_for_enemy([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]])):
-			e = -1024
-		#print(tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e)
-		return tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e
-	
-	def try_movement(self, delta, tilemap, enemy_controller):
-		if(len(self.movement_stack) == 0):
-			if(delta == [0, -1] and self.animations.get_position()[1] < 0):
-				delta == [0, 1]
-			delta_temp = delta
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				self.movement_stack.append(delta_temp)
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			if(not (tilemap.get_map_obstacle_value(self.intended_path) == 0)):
-				print("{try_movement} Oops! intended_path", self.intended_path, "is blocked but was chosen as unblocked (???)")
-			self.animations.set_direction(compute_direction(delta))
-			return True
-		else:
-			if(not delta == self.movement_stack[0]):
-				self.movement_stack = []
-				return self.try_movement(delta, tilemap, enemy_controller)
-			delta_temp = self.movement_stack[len(self.movement_stack) - 1]
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-				self.movement_stack.append(delta_temp)
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			self.movement_stack.pop()
-			self.animations.set_direction(compute_direction(delta))
-			return True
-				
-			
-	
-	def rotate_delta_cw(self, delta):
-		return [-delta[1], delta[0]]
+				self.try_movement([0, -1], tilemap, enemy_controller)
+				if(self.chance(0.27)):
+					self.set_ai_state(2, 90, 60)
+				if(self.shot_timer == 0):
+					self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 24)
 
-class Marcos(Gunner):
-	def __init__(self, xpos, ypos, scroll_pos, aitype="normal"):
-		Gunner.__init__(self, xpos, ypos, scroll_pos, aitype="normal")
-		self.animations = AnimationGroup()
-		self.animations.add_animation(Animation("marcos.png", 4, 4, "walk"))
-		self.animations.add_animation(Animation("marcos-damage.png", 1, 1, "damage"))
-		anim = self.animations.add_animation(Animation("marcos-die.png", 3, 1, "dead"))
-		self.health = 1000
-		self.shot_timer = 0.0
-		self.shot_interval = 0.2
-		self.gun_speed = 135
-		self.gun_damage = 24
-		anim.looping = False
-		anim.returns = False
-		anim.frametime = 1/8
-		self.animations.moveto(xpos * 16, ypos * 16 - 8 - scroll_pos)
+		elif(self.ai_state == 2): # Retreat {non-cyclic}
+			if(playerpos[1] - self.animations.get_position()[1] > 112 or playerpos[1] - self.animations.get_position()[1] < 24):
+				self.set_ai_state(0)
 
+			elif(abs(playerpos[0] - self.animations.get_position()[0]) < 80):
+				if(playerpos[0] - self.animations.get_position()[0] < 0): # Player is to the left
+					# Intent: move right
+					self.try_movement([1, 0], tilemap, enemy_controller)
 
-class Marksman(Enemy):
-	def __init__(self, xpos, ypos, scroll_pos, aitype="normal"):
-		Enemy.__init__(self)
-		self.animations.add_animation(Animation("marksman.png", 4, 4, "walk"))
-		self.animations.add_animation(Animation("marksman-damage.png", 1, 1, "damage"))
-		anim = self.animations.add_animation(Animation("marksman-die.png", 3, 1, "dead"))
-		self.health = 112
-		self.shot_timer = 0.0
-		self.shot_interval = 0.6
-		self.gun_speed = 210
-		self.gun_damage = 51
-		anim.looping = False
-		anim.returns = False
-		anim.frametime = 1/8
-		#print("new guard at", xpos * 16, ypos * 16 - scroll_pos)
-		self.animations.moveto(xpos * 16, ypos * 16 - 8 - scroll_pos)
-		self.aitype = aitype
-		if not(aitype == "normal" or aitype == "camper"):
-			#print("Error: Invalid ai type", aitype, "for enemy type \"marksman\", defaulting to \"normal\"")
-			self.aitype = "normal"
-		self.current_tile = [xpos, ypos]
-		self.intended_path = [xpos, ypos]
-		self.walk_speed = 35
-		self.walking_speed = 35
-		self.running_speed = 20
-		self.running = False
-		self.walk_frame_count = 0
-		self.velocity = [0, 0]
-		self.movement_stack = []
-		self.moving = False
-		self.stuck_offscreen = False
-		self.points = 500
-		
-		if(random.random() > 0.5):
-			self.xoffset = int(40 + random.random() * 32)
-		else:
-			self.xoffset = int(-40 - random.random() * 32)
-		
-		self.ai_state = 0
-		self.cyclic_ai_states = 1
-		self.ai_timer = 180 + int(random.random() * 240)
-		self.pathfind_range = 3
-		
-		self.item_drops = [["ammo762", 0.40], ["syringe", 0.16]]
-	
-	def is_onscreen(self):
-		return self.animations.get_position()[1] > -24 and (not self.is_offscreen()) and (not self.stuck_offscreen)
-	
-	def set_ai_state(self, state, timer = 180, deviation = 240):
-		self.ai_timer = timer + int(random.random() * deviation)
-		self.ai_state = state
-	
-	def set_item_drops(self, dropslist):
-		self.item_drops = dropslist
-		
-	def update(self, delta_time, bullet_controller, tilemap, enemy_controller, player, particle_controller, sound_controller):
-		Enemy.update(self, delta_time, bullet_controller, particle_controller, sound_controller)
-		if(self.dead):
-			return
-		if(not self.is_onscreen()):
-			return
-		# -- AI -- #
-		if(self.ai_timer > 0):
-			self.ai_timer -= 1
-		else:
-			self.ai_timer = 150 + int(random.random() * 120)
-			self.ai_state += 1
-			if(self.ai_state >= self.cyclic_ai_states):
-				self.ai_state = 0
-		if(self.aitype == "normal"):
-			if(not self.moving):
-				if(self.stuck_offscreen):
-					self.stuck_offscreen = False
-				if(player.dead):
-					self.set_ai_state(1, 180, 45)
-				playerpos = player.animations.get_position()
-				if(self.ai_state == 0): # Attack
-					if(self.animations.get_position()[1] < 0): # Off-screen - get into the screen area
-						if not(self.try_movement([0, 1], tilemap, enemy_controller)):
-							self.stuck_offscreen = True
-					elif(playerpos[1] - self.animations.get_position()[1] > 176 or self.animations.get_position()[1] < 24): # Too far away from player - try to get close
-						#if(random.random() < 0.05 and playerpos[1] - self.animations.get_position()[1] < 144):
-						#	self.set_ai_state(2, 120, 90)
-						# Intent: move down
-						#print("{ai-move}", self, "Trying move down")
-						self.try_movement([0, 1], tilemap, enemy_controller)
-						#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							
-					elif(playerpos[1] - self.animations.get_position()[1] > 128 or (playerpos[1] - self.animations.get_position()[1] < 128 and self.animations.get_position()[1] < 64)): # Close enough
-						if(abs(playerpos[0] + self.xoffset - self.animations.get_position()[0]) > 48): # Too far away in the X direction
-							if(playerpos[0] + self.xoffset - self.animations.get_position()[0] > 0): # Player is to the right
-								# Intent: move right
-								#print("{ai-move}", self, "Trying move right")
-								self.try_movement([1, 0], tilemap, enemy_controller)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							else:
-								# Intent: move left
-								#print("{ai-move}", self, "Trying move left")
-								self.try_movement([-1, 0], tilemap, enemy_controller)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-						if(random.random() > 0.5 and self.shot_timer == 0):
-							clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-							if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-								shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-								gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-								bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 30 - 15, self.gun_speed, self.gun_damage)
-								sound_controller.play_sound("enemy-shoot-strong")
-								self.shot_timer = self.shot_interval
-								
-						else: # We are going to try to shoot.
-							if(self.shot_timer == 0):
-								clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-								if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-									shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-									gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-									bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 30 - 15, self.gun_speed, self.gun_damage)
-									sound_controller.play_sound("enemy-shoot-strong")
-									self.shot_timer = self.shot_interval
-								
-					else: # Too close or below the player - we don't want that
-						# Intent: move up
-						self.try_movement([0, -1], tilemap, enemy_controller)
-						if(self.animations.get_position()[1] > 160):
-							self.running = True
-													
-		# -- Handle movement -- #
-		if(not self.intended_path == []):
-			if(not self.moving):
-				self.moving = True
-				if(self.running):
-					self.walk_speed = self.running_speed
 				else:
-					self.walk_speed = self.walking_speed
-				self.animations.animations[self.animations.curr_animation].frametime = self.walk_speed / 180
-				self.animations.play()
-				self.walk_frame_count = self.walk_speed
-			if(self.walk_frame_count > 0):
-				xpos = (((self.current_tile[0] * self.walk_frame_count) + (self.intended_path[0] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 
-				ypos = (((self.current_tile[1] * self.walk_frame_count) + (self.intended_path[1] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 - tilemap.scroll_position - 8
-				#print(self, xpos, ypos)
-				self.animations.moveto(xpos, ypos)
-				self.walk_frame_count -= 1
-			else:
-				self.moving = False
-				self.running = False
-				self.current_tile = self.intended_path
-				self.intended_path = []	
-		else:
-			self.animations.stop()
-		self.animations.update(delta_time)
-	
-	def lookat_tile(self, delta, tilemap, enemy_controller):
-		#print(self, "lookingat", self.current_tile[0] + delta[0], self.current_tile[1] + delta[1])
-		e = 0
-		if(enemy_controller.check_tile_for_enemy([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]])):
-			e = -1024
-		#print(tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e)
-		return tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e
-	
-	def try_movement(self, delta, tilemap, enemy_controller):
-		if(len(self.movement_stack) == 0):
-			if(delta == [0, -1] and self.animations.get_position()[1] < 0):
-				delta == [0, 1]
-			delta_temp = delta
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				self.movement_stack.append(delta_temp)
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			if(not (tilemap.get_map_obstacle_value(self.intended_path) == 0)):
-				print("{try_movement} Oops! intended_path", self.intended_path, "is blocked but was chosen as unblocked (???)")
-			self.animations.set_direction(compute_direction(delta))
-			return True
-		else:
-			if(not delta == self.movement_stack[0]):
-				self.movement_stack = []
-				return self.try_movement(delta, tilemap, enemy_controller)
-			delta_temp = self.movement_stack[len(self.movement_stack) - 1]
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-				self.movement_stack.append(delta_temp)
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			self.movement_stack.pop()
-			self.animations.set_direction(compute_direction(delta))
-			return True
-				
-			
-	
-	def rotate_delta_cw(self, delta):
-		return [-delta[1], delta[0]]
+					# Intent: move left
+					self.try_movement([-1, 0], tilemap, enemy_controller)
 
-
-class Stalker(Enemy):
-	def __init__(self, xpos, ypos, scroll_pos, aitype="normal"):
-		Enemy.__init__(self)
-		self.animations.add_animation(Animation("stalker.png", 4, 4, "walk"))
-		self.animations.add_animation(Animation("stalker-damage.png", 1, 1, "damage"))
-		anim = self.animations.add_animation(Animation("stalker-die.png", 3, 1, "dead"))
-		self.health = 60
-		self.shot_timer = 0.0
-		self.shot_interval = 0.3
-		self.shot_interval_behind = 0.8
-		self.gun_speed = 210
-		self.gun_damage = 20
-		self.gun_damage_behind = 70
-		anim.looping = False
-		anim.returns = False
-		anim.frametime = 1/8
-		#print("new guard at", xpos * 16, ypos * 16 - scroll_pos)
-		self.animations.moveto(xpos * 16, ypos * 16 - 8 - scroll_pos)
-		self.aitype = aitype
-		if not(aitype == "normal" or aitype == "camper"):
-			#print("Error: Invalid ai type", aitype, "for enemy type \"marksman\", defaulting to \"normal\"")
-			self.aitype = "normal"
-		self.current_tile = [xpos, ypos]
-		self.intended_path = [xpos, ypos]
-		self.walk_speed = 22
-		self.walking_speed = 22
-		self.running_speed = 14
-		self.running = False
-		self.walk_frame_count = 0
-		self.velocity = [0, 0]
-		self.movement_stack = []
-		self.moving = False
-		self.stuck_offscreen = False
-		self.points = 500
-		
-		#if(random.random() > 0.5):
-		#	self.xoffset = int(40 + random.random() * 32)
-		#else:
-		#	self.xoffset = int(-40 - random.random() * 32)
-		
-		self.ai_state = 0
-		self.cyclic_ai_states = 1
-		self.ai_timer = 180 + int(random.random() * 240)
-		self.pathfind_range = 3
-		
-		self.item_drops = [["ammo9mm", 0.60], ["syringe", 0.2]]
-	
-	def is_onscreen(self):
-		return self.animations.get_position()[1] > -24 and (not self.is_offscreen()) and (not self.stuck_offscreen)
-	
-	def set_ai_state(self, state, timer = 180, deviation = 240):
-		self.ai_timer = timer + int(random.random() * deviation)
-		self.ai_state = state
-	
-	def set_item_drops(self, dropslist):
-		self.item_drops = dropslist
-		
-	def update(self, delta_time, bullet_controller, tilemap, enemy_controller, player, particle_controller, sound_controller):
-		Enemy.update(self, delta_time, bullet_controller, particle_controller, sound_controller)
-		if(self.dead):
-			return
-		if(not self.is_onscreen()):
-			return
-		# -- AI -- #
-		if(self.ai_timer > 0):
-			self.ai_timer -= 1
-		else:
-			self.ai_timer = 150 + int(random.random() * 120)
-			self.ai_state += 1
-			if(self.ai_state >= self.cyclic_ai_states):
+		elif(self.ai_state == 3): # Shoot from far away {non-cyclic}
+			if(self.chance(0.1)):
 				self.ai_state = 0
-		if(self.aitype == "normal"):
-			if(not self.moving):
-				if(self.stuck_offscreen):
-					self.stuck_offscreen = False
-				if(player.dead):
-					self.set_ai_state(1, 30, 45)
-				playerpos = player.animations.get_position()
-				if(self.ai_state == 0): # Attack
-					if(self.animations.get_position()[1] < 0): # Off-screen - get into the screen area
-						if not(self.try_movement([0, 1], tilemap, enemy_controller)):
-							self.stuck_offscreen = True
-					elif(playerpos[1] - self.animations.get_position()[1] > -24): # Too far away from player - try to get close
-						if abs(self.animations.get_position()[0] - 128) < 80: # Too far away in the X direction
-							if(self.animations.get_position()[0] > 128): # Is to the right
-								self.try_movement([1, 0], tilemap, enemy_controller)
-							else:
-								self.try_movement([-1, 0], tilemap, enemy_controller)
-						else:
-						#if(random.random() < 0.05 and playerpos[1] - self.animations.get_position()[1] < 144):
-						#	self.set_ai_state(2, 120, 90)
-						# Intent: move down
-						#print("{ai-move}", self, "Trying move down")
-							self.try_movement([0, 1], tilemap, enemy_controller)
-							self.running = True
-						if(random.random() > 0.5 and self.shot_timer == 0):
-							clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-							if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-								shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-								gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-								bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 36 - 18, self.gun_speed, self.gun_damage)
-								sound_controller.play_sound("enemy-shoot-weak")
-								self.shot_timer = self.shot_interval
-						#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							
-							
-					elif(self.animations.get_position()[1] < 176): # Close enough
-						self.animations.set_direction(90)
-						if(self.shot_timer == 0):
-							clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-							if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-								shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-								gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-								bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 12 - 6, self.gun_speed, self.gun_damage_behind)
-								sound_controller.play_sound("enemy-shoot-weak")
-								self.shot_timer = self.shot_interval_behind
-								
-					else: # Too close or below the player - we don't want that
-						# Intent: move up
-						self.try_movement([0, -1], tilemap, enemy_controller)
-						self.running = True
-						if(self.shot_timer == 0):
-							clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-							if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-								shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-								gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-								bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 40 - 20, self.gun_speed, self.gun_damage_behind)
-								sound_controller.play_sound("enemy-shoot-weak")
-								self.shot_timer = self.shot_interval_behind
-				elif(self.ai_state == 1): # Retreat
-					if(self.animations.get_position()[1] > 48):
-						self.try_movement([0, -1], tilemap, enemy_controller)
-													
-		# -- Handle movement -- #
-		if(not self.intended_path == []):
-			if(not self.moving):
-				self.moving = True
-				if(self.running):
-					self.walk_speed = self.running_speed
-				else:
-					self.walk_speed = self.walking_speed
-				self.animations.animations[self.animations.curr_animation].frametime = self.walk_speed / 180
-				self.animations.play()
-				self.walk_frame_count = self.walk_speed
-			if(self.walk_frame_count > 0):
-				xpos = (((self.current_tile[0] * self.walk_frame_count) + (self.intended_path[0] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 
-				ypos = (((self.current_tile[1] * self.walk_frame_count) + (self.intended_path[1] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 - tilemap.scroll_position - 8
-				#print(self, xpos, ypos)
-				self.animations.moveto(xpos, ypos)
-				self.walk_frame_count -= 1
-			else:
-				self.moving = False
-				self.running = False
-				self.current_tile = self.intended_path
-				self.intended_path = []	
-		else:
-			self.animations.stop()
-		self.animations.update(delta_time)
-	
-	def lookat_tile(self, delta, tilemap, enemy_controller):
-		#print(self, "lookingat", self.current_tile[0] + delta[0], self.current_tile[1] + delta[1])
-		e = 0
-		if(enemy_controller.check_tile_for_enemy([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]])):
-			e = -1024
-		#print(tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e)
-		return tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e
-	
-	def try_movement(self, delta, tilemap, enemy_controller):
-		if(len(self.movement_stack) == 0):
-			if(delta == [0, -1] and self.animations.get_position()[1] < 0):
-				delta == [0, 1]
-			delta_temp = delta
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				self.movement_stack.append(delta_temp)
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			if(not (tilemap.get_map_obstacle_value(self.intended_path) == 0)):
-				print("{try_movement} Oops! intended_path", self.intended_path, "is blocked but was chosen as unblocked (???)")
-			self.animations.set_direction(compute_direction(delta))
-			return True
-		else:
-			if(not delta == self.movement_stack[0]):
-				self.movement_stack = []
-				return self.try_movement(delta, tilemap, enemy_controller)
-			delta_temp = self.movement_stack[len(self.movement_stack) - 1]
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-				self.movement_stack.append(delta_temp)
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			self.movement_stack.pop()
-			self.animations.set_direction(compute_direction(delta))
-			return True
-				
-			
-	
-	def rotate_delta_cw(self, delta):
-		return [-delta[1], delta[0]]
-		
+			if(self.shot_timer == 0):
+				self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 12)
+	
+	# think_marksman: Keeps its distance and takes careful shots from far up the screen
+	def think_marksman(self, playerpos, player, tilemap, enemy_controller, bullet_controller, sound_controller):
+		if(self.ai_state == 0): # Attack
+			if(self.get_screen_y() < 0): # Off-screen - get into the screen area
+				if not(self.try_movement([0, 1], tilemap, enemy_controller)):
+					self.stuck_offscreen = True
+			elif(playerpos[1] - self.animations.get_position()[1] > 176 or self.get_screen_y() < 24): # Too far away from player - try to get close
+				#if(self.rng.ai.random() < 0.05 and playerpos[1] - self.animations.get_position()[1] < 144):
+				#	self.set_ai_state(2, 120, 90)
+				# Intent: move down
+				self.try_movement([0, 1], tilemap, enemy_controller)
 
-class HeavyGuard(Enemy):
-	def __init__(self, xpos, ypos, scroll_pos, aitype="normal"):
-		Enemy.__init__(self)
-		self.animations.add_animation(Animation("heavyguard.png", 4, 4, "walk"))
-		self.animations.add_animation(Animation("heavyguard-damage.png", 1, 1, "damage"))
-		anim = self.animations.add_animation(Animation("heavyguard-die.png", 3, 1, "dead"))
-		self.health = 140
-		self.shot_timer = 0.0
-		self.shot_interval = 0.3
-		self.gun_speed = 195
-		self.gun_damage = 36
-		anim.looping = False
-		anim.returns = False
-		anim.frametime = 1/8
-		#print("new guard at", xpos * 16, ypos * 16 - scroll_pos)
-		self.animations.moveto(xpos * 16, ypos * 16 - 8 - scroll_pos)
-		self.aitype = aitype
-		if not(aitype == "normal" or aitype == "camper"):
-			#print("Error: Invalid ai type", aitype, "for enemy type \"heavyguard\", defaulting to \"normal\"")
-			self.aitype = "normal"
-		self.current_tile = [xpos, ypos]
-		self.intended_path = [xpos, ypos]
-		self.walk_speed = 25
-		self.walking_speed = 25
-		self.running_speed = 17
-		self.running = False
-		self.walk_frame_count = 0
-		self.velocity = [0, 0]
-		self.movement_stack = []
-		self.moving = False
-		self.stuck_offscreen = False
-		self.points = 650
-		if(random.random() > 0.5):
-			self.xoffset = int(24 + random.random() * 32)
-		else:
-			self.xoffset = int(-24 - random.random() * 32)
-		self.ai_state = 0
-		self.cyclic_ai_states = 2
-		self.ai_timer = 180 + int(random.random() * 240)
-		self.pathfind_range = 3
-		
-		self.item_drops = [["ammo762", 0.25], ["syringe", 0.1]]
-	
-	def is_onscreen(self):
-		return self.animations.get_position()[1] > -24 and (not self.is_offscreen()) and (not self.stuck_offscreen)
-	
-	def set_ai_state(self, state, timer = 180, deviation = 240):
-		self.ai_timer = timer + int(random.random() * deviation)
-		self.ai_state = state
-	
-	def set_item_drops(self, dropslist):
-		self.item_drops = dropslist
-		
-	def update(self, delta_time, bullet_controller, tilemap, enemy_controller, player, particle_controller, sound_controller):
-		Enemy.update(self, delta_time, bullet_controller, particle_controller, sound_controller)
-		if(self.dead):
-			return
-		if(not self.is_onscreen()):
-			return
-		# -- AI -- #
-		if(self.ai_timer > 0):
-			self.ai_timer -= 1
-		else:
-			self.ai_timer = 180 + int(random.random() * 240)
-			self.ai_state += 1
-			if(self.ai_state >= self.cyclic_ai_states):
-				self.ai_state = 0
-		if(self.aitype == "normal"):
-			if(not self.moving):
-				if(self.stuck_offscreen):
-					self.stuck_offscreen = False
-				if(player.dead):
-					self.set_ai_state(2, 180, 45)
-				playerpos = player.animations.get_position()
-				if(self.ai_state == 0 or self.ai_state == 1): # Attack
-					if(self.animations.get_position()[1] < 0): # Off-screen - get into the screen area
-						if not(self.try_movement([0, 1], tilemap, enemy_controller)):
-							self.stuck_offscreen = True
-					elif(playerpos[1] - self.animations.get_position()[1] > 96): # Too far away from player - try to get close
-						if(random.random() < 0.05 and playerpos[1] - self.animations.get_position()[1] < 144):
-							self.set_ai_state(3, 120, 90)
-						# Intent: move down
-						#print("{ai-move}", self, "Trying move down")
-						self.try_movement([0, 1], tilemap, enemy_controller)
-						#print("{ai-moved}", self, "intended_path =", self.intended_path)
-						if(self.ai_state == 1): # Shoot while going towards player
-							if(random.random() < 0.08):
-								self.set_ai_state(0, 135, 120)
-							if(self.shot_timer == 0):
-								clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-								if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-									shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-									gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-									bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 32 - 16, self.gun_speed, self.gun_damage)
-									sound_controller.play_sound("enemy-shoot-weak")
-									self.shot_timer = self.shot_interval
-							
-					elif(playerpos[1] - self.animations.get_position()[1] > 48): # Close enough
-						if(abs(playerpos[0] + self.xoffset - self.animations.get_position()[0] ) > 28): # Too far away in the X direction
-							if(playerpos[0] + self.xoffset - self.animations.get_position()[0] > 0): # Player is to the right
-								# Intent: move right
-								#print("{ai-move}", self, "Trying move right")
-								self.try_movement([1, 0], tilemap, enemy_controller)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							else:
-								# Intent: move left
-								#print("{ai-move}", self, "Trying move left")
-								self.try_movement([-1, 0], tilemap, enemy_controller)
-								#print("{ai-moved}", self, "intended_path =", self.intended_path)
-								
-						else: # Try to move up while shooting.
-							self.set_ai_state(4)
-								
-					else: # Too close or below the player - we don't want that
-						# Intent: move up (possibly shoot)
-						self.try_movement([0, -1], tilemap, enemy_controller)
-						if(self.animations.get_position()[1] > 160):
-							self.running = True
-						if(self.ai_state == 1): # Shoot while going towards player
-							if(random.random() < 0.08):
-								self.set_ai_state(0, 135, 120)
-							if(self.shot_timer == 0):
-								clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-								if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-									shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-									gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-									bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 32 - 16, self.gun_speed, self.gun_damage)
-									sound_controller.play_sound("enemy-shoot-weak")
-									self.shot_timer = self.shot_interval
-				
-				elif(self.ai_state == 4): # Shoot and retreat {non-cyclic}
-					if(playerpos[1] - self.animations.get_position()[1] > 112):
-						self.set_ai_state(0)
+			elif(playerpos[1] - self.animations.get_position()[1] > 128 or (playerpos[1] - self.animations.get_position()[1] < 128 and self.get_screen_y() < 64)): # Close enough
+				if(abs(playerpos[0] + self.xoffset - self.animations.get_position()[0]) > 48): # Too far away in the X direction
+					if(playerpos[0] + self.xoffset - self.animations.get_position()[0] > 0): # Player is to the right
+						# Intent: move right
+						self.try_movement([1, 0], tilemap, enemy_controller)
 					else:
-						self.try_movement([0, -1], tilemap, enemy_controller)
-						if(random.random() < 0.08):
-							self.set_ai_state(2, 90, 60)
-						if(self.shot_timer == 0):
-							clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-							if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-								shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-								gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-								bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 24 - 12, self.gun_speed, self.gun_damage)
-								sound_controller.play_sound("enemy-shoot-weak")
-								self.shot_timer = self.shot_interval
-						
-				elif(self.ai_state == 2): # Retreat {non-cyclic}
-					if(playerpos[1] - self.animations.get_position()[1] > 112 or playerpos[1] - self.animations.get_position()[1] < 24):
-						self.set_ai_state(0)
-						
-					elif(abs(playerpos[0] - self.animations.get_position()[0]) < 80):
-						if(playerpos[0] - self.animations.get_position()[0] < 0): # Player is to the left
-							# Intent: move right
-							#print("{ai-move}", self, "Trying move right")
-							self.try_movement([1, 0], tilemap, enemy_controller)
-							#print("{ai-moved}", self, "intended_path =", self.intended_path)
-							
-						else:
-							# Intent: move left
-							#print("{ai-move}", self, "Trying move left")
-							self.try_movement([-1, 0], tilemap, enemy_controller)
-							#print("{ai-moved}", self, "intended_path =", self.intended_path)
-				
-				
-				elif(self.ai_state == 3): # Shoot from far away {non-cyclic}
-					if(random.random() < 0.2):
-						self.ai_state = 0
-					if(self.shot_timer == 0):
-						clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-						if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-							shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-							gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-							bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 12 - 6, self.gun_speed, self.gun_damage)
-							sound_controller.play_sound("enemy-shoot-weak")
-							self.shot_timer = self.shot_interval
-							
-		# -- Handle movement -- #
-		if(not self.intended_path == []):
-			if(not self.moving):
-				self.moving = True
-				if(self.running):
-					self.walk_speed = self.running_speed
-				else:
-					self.walk_speed = self.walking_speed
-				self.animations.animations[self.animations.curr_animation].frametime = self.walk_speed / 180
-				self.animations.play()
-				self.walk_frame_count = self.walk_speed
-			if(self.walk_frame_count > 0):
-				xpos = (((self.current_tile[0] * self.walk_frame_count) + (self.intended_path[0] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 
-				ypos = (((self.current_tile[1] * self.walk_frame_count) + (self.intended_path[1] * (self.walk_speed - self.walk_frame_count))) / self.walk_speed) * 16 - tilemap.scroll_position - 8
-				#print(self, xpos, ypos)
-				self.animations.moveto(xpos, ypos)
-				self.walk_frame_count -= 1
-			else:
-				self.moving = False
-				self.running = False
-				self.current_tile = self.intended_path
-				self.intended_path = []
-		else:
-			self.animations.stop()
-		self.animations.update(delta_time)
-	
-	def lookat_tile(self, delta, tilemap, enemy_controller):
-		#print(self, "lookingat", self.current_tile[0] + delta[0], self.current_tile[1] + delta[1])
-		e = 0
-		if(enemy_controller.check_tile_for_enemy([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]])):
-			e = -1024
-		#print(tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e)
-		return tilemap.get_map_obstacle_value([self.current_tile[0] + delta[0], self.current_tile[1] + delta[1]]) + e
-	
-	def try_movement(self, delta, tilemap, enemy_controller):
-		if(len(self.movement_stack) == 0):
-			if(delta == [0, -1] and self.animations.get_position()[1] < 0):
-				delta == [0, 1]
-			delta_temp = delta
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				self.movement_stack.append(delta_temp)
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			if(not (tilemap.get_map_obstacle_value(self.intended_path) == 0)):
-				print("{try_movement} Oops! intended_path", self.intended_path, "is blocked but was chosen as unblocked (???)")
-			self.animations.set_direction(compute_direction(delta))
-			return True
-		else:
-			if(not delta == self.movement_stack[0]):
-				self.movement_stack = []
-				return self.try_movement(delta, tilemap, enemy_controller)
-			delta_temp = self.movement_stack[len(self.movement_stack) - 1]
-			while(not self.lookat_tile(delta_temp, tilemap, enemy_controller) == 0):
-				delta_temp = self.rotate_delta_cw(delta)
-				if(len(self.movement_stack) > 4):
-					#print(self, "stuck")
-					return False
-				self.movement_stack.append(delta_temp)
-			self.intended_path = [self.current_tile[0] + delta_temp[0], self.current_tile[1] + delta_temp[1]]
-			self.movement_stack.pop()
-			self.animations.set_direction(compute_direction(delta))
-			return True
-				
-			
-	
-	def rotate_delta_cw(self, delta):
-		return [-delta[1], delta[0]]
+						# Intent: move left
+						self.try_movement([-1, 0], tilemap, enemy_controller)
+				if(self.rng.ai.random() > 0.5 and self.shot_timer == 0):
+					self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 30)
 
+				else: # We are going to try to shoot.
+					if(self.shot_timer == 0):
+						self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 30)
 
-class Sniper(Enemy):
-	def __init__(self, xpos, ypos, scroll_pos, aitype="normal"):
-		Enemy.__init__(self)
-		self.animations.add_animation(Animation("sniper.png", 4, 4, "walk"))
-		self.animations.add_animation(Animation("sniper-damage.png", 1, 1, "damage"))
-		anim = self.animations.add_animation(Animation("sniper-die.png", 3, 1, "dead"))
-		self.health = 115
-		self.shot_timer = 0.0
-		self.shot_interval = 1.5
-		self.gun_speed = 360
-		self.gun_damage = 85
-		anim.looping = False
-		anim.returns = False
-		anim.frametime = 1/8
-		#print("new guard at", xpos * 16, ypos * 16 - scroll_pos)
-		self.animations.moveto(xpos * 16, ypos * 16 - 8 - scroll_pos)
-		self.aitype = aitype
-		if not(aitype == "normal" or aitype == "camper"):
-			#print("Error: Invalid ai type", aitype, "for enemy type \"sniper\", defaulting to \"normal\"")
-			self.aitype = "normal"
-		self.current_tile = [xpos, ypos]
-		self.intended_path = self.current_tile
-		self.moving = False
-		self.stuck_offscreen = False
-		self.points = 500
-		
-		if(random.random() > 0.5):
-			self.xoffset = int(40 + random.random() * 32)
-		else:
-			self.xoffset = int(-40 - random.random() * 32)
-		
-		self.ai_state = 0
-		self.cyclic_ai_states = 2
-		self.ai_timer = 60
-		self.aim_timer = 120 + int(random.random() * 90)
-		self.aim_time = 180
-		self.aim_time_deviation = 120
+			else: # Too close or below the player - we don't want that
+				# Intent: move up
+				self.try_movement([0, -1], tilemap, enemy_controller)
+				if(self.get_screen_y() > 160):
+					self.running = True
+	
+	# think_stalker: Goes down the sides of the screen past the player, then shoots at them from behind
+	def think_stalker(self, playerpos, player, tilemap, enemy_controller, bullet_controller, sound_controller):
+		if(self.ai_state == 0): # Attack
+			if(self.get_screen_y() < 0): # Off-screen - get into the screen area
+				if not(self.try_movement([0, 1], tilemap, enemy_controller)):
+					self.stuck_offscreen = True
+			elif(playerpos[1] - self.animations.get_position()[1] > -24): # Too far away from player - try to get close
+				if abs(self.animations.get_position()[0] - 128) < 80: # Too far away in the X direction
+					if(self.animations.get_position()[0] > 128): # Is to the right
+						self.try_movement([1, 0], tilemap, enemy_controller)
+					else:
+						self.try_movement([-1, 0], tilemap, enemy_controller)
+				else:
+				#if(self.rng.ai.random() < 0.05 and playerpos[1] - self.animations.get_position()[1] < 144):
+				#	self.set_ai_state(2, 120, 90)
+				# Intent: move down
+					self.try_movement([0, 1], tilemap, enemy_controller)
+					self.running = True
+				if(self.rng.ai.random() > 0.5 and self.shot_timer == 0):
+					self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 36)
+
+			elif(self.get_screen_y() < 176): # Close enough
+				self.animations.set_direction(90)
+				if(self.shot_timer == 0):
+					self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 12, self.gun_damage_behind, self.shot_interval_behind)
+
+			else: # Too close or below the player - we don't want that
+				# Intent: move up
+				self.try_movement([0, -1], tilemap, enemy_controller)
+				self.running = True
+				if(self.shot_timer == 0):
+					self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 40, self.gun_damage_behind, self.shot_interval_behind)
+		elif(self.ai_state == 1): # Retreat
+			if(self.get_screen_y() > 48):
+				self.try_movement([0, -1], tilemap, enemy_controller)
+	
+	# think_sniper: Stands still, aims a laser that slowly follows the player and fires once the aim time is up
+	def think_sniper(self, playerpos, player, tilemap, enemy_controller, bullet_controller, sound_controller):
+		if(self.get_screen_y() < 0):
+			return
+		elif(self.ai_state == 1): # Aim preparation {non-cyclic}
+			self.aim_timer = self.aim_time + int(self.rng.ai.random() * self.aim_time_deviation)
+			self.aim_angle = compute_direction([playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]) + int(self.rng.ai.random() * 60 - 30)
+			self.aim_cursor.set_direction(self.aim_angle)
+			self.set_ai_state(2, 65535, 0)
+		elif(self.ai_state == 2): # Aiming {non-cyclic}
+			self.aim_timer -= self.ticks
+			if(self.aim_timer > 0):
+				self.aim_cursor.showing = True
+				player_direction = compute_direction([playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]])
+				if(self.aim_angle < player_direction):
+					self.aim_angle += self.aim_speed * self.ticks
+				else:
+					self.aim_angle -= self.aim_speed * self.ticks
+				self.aim_cursor.set_direction(self.aim_angle)
+			else:
+				if(self.shoot_at(playerpos, player, tilemap, bullet_controller, sound_controller, 4)):
+					self.aim_cursor.showing = False
+					self.set_ai_state(0, 120, 90)
+				elif(self.chance(0.04)):
+					self.set_ai_state(0, 120, 90)
+	
+	def setup_stalker(self):
+		self.shot_interval_behind = self.archetype["shot_interval_behind"] # Used when shooting the player from behind
+		self.gun_damage_behind = self.archetype["gun_damage_behind"]
+	
+	def setup_sniper(self):
+		self.aim_timer = self.archetype["aim_timer"][0] + int(self.rng.ai.random() * self.archetype["aim_timer"][1])
+		self.aim_time = self.archetype["aim_time"][0]
+		self.aim_time_deviation = self.archetype["aim_time"][1]
 		self.aim_angle = 270
-		self.aim_speed = 0.7
-		self.aim_cursor = AimCursor([xpos * 16 + 8, ypos * 16 + 20])
+		self.aim_speed = self.archetype["aim_speed"]
+		position = self.animations.get_position()
+		self.aim_cursor = AimCursor([position[0] + 8, position[1] + 20], self.camera)
 		self.aim_cursor.showing = False
 		self.aim_cursor.image = load_png("sprites", "aim-laser.png")
-		
-		self.item_drops = []
-	
-	def scroll(self, y):
-		Enemy.scroll(self, y)
-		self.aim_cursor.position = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-		
-	def draw(self, dest):
-		Enemy.draw(self, dest)
-		if not(self.dead):
-			self.aim_cursor.draw(dest)
-	
-	def is_onscreen(self):
-		return self.animations.get_position()[1] > -24 and (not self.is_offscreen()) and (not self.stuck_offscreen)
-	
-	def set_ai_state(self, state, timer = 180, deviation = 240):
-		self.ai_timer = timer + int(random.random() * deviation)
-		self.ai_state = state
-	
-	def set_item_drops(self, dropslist):
-		self.item_drops = dropslist
-		
-	def update(self, delta_time, bullet_controller, tilemap, enemy_controller, player, particle_controller, sound_controller):
-		Enemy.update(self, delta_time, bullet_controller, particle_controller, sound_controller)
-		if(self.dead):
-			return
-		if(not self.is_onscreen()):
-			return
-		# -- AI -- #
-		if(self.ai_timer > 0):
-			self.ai_timer -= 1
+
+# load_enemy_file: The spawn records of an enemy file in data/ - [type, xpos, ypos, health (None for the type's own), is boss]
+def load_enemy_file(enemyfile):
+	spawns = []
+	enemydict = dict()
+	path = os.path.join("data", enemyfile)
+	f = open(path)
+	l = f.readline()
+	while(not l == ""):
+		if(l == "enemy:\n"):
+			l = f.readline()
+			while(not l == ":end\n"):
+				if not l:
+					raise ValueError("The enemy file is invalid.")
+				l_keyvalue = l.split("=")
+				enemydict[l_keyvalue[0]] = l_keyvalue[1]
+				l = f.readline()
+			health = None
+			if("health" in enemydict):
+				health = int(enemydict["health"])
+			spawns.append([enemydict["type"].strip(), int(enemydict["xpos"]), int(enemydict["ypos"]), health, enemydict["group"] == "boss\n"])
+			
+			l = f.readline()
 		else:
-			self.ai_timer = 120 + int(random.random() * 90)
-			self.ai_state += 1
-			if(self.ai_state >= self.cyclic_ai_states):
-				self.ai_state = 0
-		if(self.aitype == "normal"):
-			if(not self.moving):
-				if(self.stuck_offscreen):
-					self.stuck_offscreen = False
-				if(player.dead):
-					self.set_ai_state(0, 60, 30)
-				playerpos = player.animations.get_position()
-				if(self.animations.get_position()[1] < 0):
-					return
-				elif(self.ai_state == 1): # Aim preparation {non-cyclic}
-					self.aim_timer = self.aim_time + int(random.random() * self.aim_time_deviation)
-					self.aim_angle = compute_direction([playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]) + int(random.random() * 60 - 30)
-					self.aim_cursor.set_direction(self.aim_angle)
-					self.set_ai_state(2, 65535, 0)
-				elif(self.ai_state == 2): # Aiming {non-cyclic}
-					self.aim_timer -= 1
-					if(self.aim_timer > 0):
-						self.aim_cursor.showing = True
-						player_direction = compute_direction([playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]])
-						if(self.aim_angle < player_direction):
-							self.aim_angle += self.aim_speed
-						else:
-							self.aim_angle -= self.aim_speed
-						self.aim_cursor.set_direction(self.aim_angle)
-					else:
-						clear_shot = shot_intersects_obstacle(self.animations.get_position(), playerpos, tilemap)
-						if(clear_shot == 0 or (clear_shot == 1 and (player.state == 0 or player.state == 1 or player.state == 2 or player.state == 5 or player.state == 7))):
-							shoot_vector = [playerpos[0] - self.animations.get_position()[0], playerpos[1] - self.animations.get_position()[1]]
-							gun_pos = [self.animations.get_position()[0] + 8, self.animations.get_position()[1] + 20]
-							bullet_controller.enemy_shoot(gun_pos, compute_direction(shoot_vector) + random.random() * 4 - 2, self.gun_speed, self.gun_damage)
-							sound_controller.play_sound("enemy-shoot-strong")
-							self.shot_timer = self.shot_interval
-							self.aim_cursor.showing = False
-							self.set_ai_state(0, 120, 90)
-						elif(random.random() < 0.04):
-							self.set_ai_state(0, 120, 90)
-								
-
-# -- End -- #
+			l = f.readline()
+	f.close()
+	return spawns
 
-				
+# TileOccupancy: Counts how many enemies stand on or are walking to each tile, so checking a tile doesn't need to go through every enemy
+class TileOccupancy:
+	def __init__(self):
+		self.tiles = dict()
+	
+	def get_tiles(self, enemy):
+		tiles = [(enemy.current_tile[0], enemy.current_tile[1])]
+		if(enemy.intended_path and not enemy.intended_path == enemy.current_tile):
+			tiles.append((enemy.intended_path[0], enemy.intended_path[1]))
+		return tiles
+	
+	def reserve(self, enemy):
+		for tile in self.get_tiles(enemy):
+			self.tiles[tile] = self.tiles.get(tile, 0) + 1
+	
+	def release(self, enemy):
+		for tile in self.get_tiles(enemy):
+			if(self.tiles[tile] > 1):
+				self.tiles[tile] -= 1
+			else:
+				del self.tiles[tile]
+	
+	def is_occupied(self, tile):
+		return (tile[0], tile[1]) in self.tiles
 
 class EnemyController:
-	def __init__(self, enemyfile, map_scroll):
+	def __init__(self, spawns, camera, rng, spawn_distance = 128):
 		self.enemies = []
 		self.bosses = []
-		self.load_enemy_file(enemyfile, map_scroll)
+		self.camera = camera
+		self.rng = rng
+		self.occupancy = TileOccupancy()
+		self.archetypes = load_enemy_archetypes("enemytypes.dat")
+		self.spawn_distance = spawn_distance # How far above the screen (in pixels) the enemies are created
+		self.spawns = [] # Enemies from the file that haven't been created yet, sorted by y
+		self.spawn_keys = [] # The y of each of those, for bisect
+		self.pending_spawns = 0 # spawns[0:pending_spawns] are still waiting for the camera
+		self.add_spawns(spawns)
 		self.itemdict = dict()
 		self.itemdict["ammo9mm"] = AmmoBox9mm
 		self.itemdict["ammo762"] = AmmoBox762
@@ -2142,77 +1634,72 @@ class EnemyController:
 		self.boss_battle = False
 		
 	
-	def load_enemy_file(self, enemyfile, map_scroll):
-		enemydict = dict()
-		path = os.path.join("data", enemyfile)
-		f = open(path)
-		l = f.readline()
-		while(not l == ""):
-			#print(l)
-			if(l == "enemy:\n"):
-				l = f.readline()
-				while(not l == ":end\n"):
-					if not l:
-						raise ValueError("The enemy file is invalid.")
-					l_keyvalue = l.split("=")
-					#print(l_keyvalue)
-					enemydict[l_keyvalue[0]] = l_keyvalue[1]
-					l = f.readline()
-				if(enemydict["type"] == "guard\n"):
-					enemy = Guard(int(enemydict["xpos"]), int(enemydict["ypos"]), map_scroll)
-				elif(enemydict["type"] == "soldier\n"):
-					enemy = Soldier(int(enemydict["xpos"]), int(enemydict["ypos"]), map_scroll)
-				elif(enemydict["type"] == "gunner\n"):
-					enemy = Gunner(int(enemydict["xpos"]), int(enemydict["ypos"]), map_scroll)
-				elif(enemydict["type"] == "marksman\n"):
-					enemy = Marksman(int(enemydict["xpos"]), int(enemydict["ypos"]), map_scroll)
-				elif(enemydict["type"] == "stalker\n"):
-					enemy = Stalker(int(enemydict["xpos"]), int(enemydict["ypos"]), map_scroll)
-				elif(enemydict["type"] == "heavyguard\n"):
-					enemy = HeavyGuard(int(enemydict["xpos"]), int(enemydict["ypos"]), map_scroll)
-				elif(enemydict["type"] == "sniper\n"):
-					enemy = Sniper(int(enemydict["xpos"]), int(enemydict["ypos"]), map_scroll)
-				elif(enemydict["type"] == "marcos\n"):
-					enemy = Marcos(int(enemydict["xpos"]), int(enemydict["ypos"]), map_scroll)
-				if("health" in enemydict):
-					enemy.health = int(enemydict["health"])
-				if(enemydict["group"] == "boss\n"):
-					self.bosses.append(enemy)
-				else:
-					self.enemies.append(enemy)
-				
-				l = f.readline()
+	# add_spawns: Queues spawn records (see load_enemy_file) - the enemies themselves are only created by spawn_nearby,
+	# once the camera gets close to them
+	def add_spawns(self, spawns):
+		for spawn in spawns:
+			if(not spawn[0] in self.archetypes):
+				raise ValueError("Unknown enemy type \"" + spawn[0] + "\"")
+			self.spawns.append([spawn[2] * 16 - 8, len(self.spawns), spawn[0], spawn[1], spawn[2], spawn[3], spawn[4]])
+		self.spawns.sort() # By y, then by order in the file
+		self.spawn_keys = [spawn[0] for spawn in self.spawns]
+		self.pending_spawns = len(self.spawns)
+	
+	# spawn_nearby: Creates the enemies that are now within spawn_distance of the top of the screen. The camera only
+	# goes up, so they are always at the end of the pending part of the list
+	def spawn_nearby(self):
+		first = bisect.bisect_left(self.spawn_keys, self.camera.scroll_position - self.spawn_distance, 0, self.pending_spawns)
+		for spawn in self.spawns[first:self.pending_spawns]:
+			enemy = self.create_enemy(spawn[2], spawn[3], spawn[4])
+			if(spawn[5] is not None):
+				enemy.health = spawn[5]
+			if(spawn[6]):
+				self.add_enemy(enemy, self.bosses)
 			else:
-				l = f.readline()
-			
+				self.add_enemy(enemy, self.enemies)
+		self.pending_spawns = first
+	
+	def create_enemy(self, enemytype, xpos, ypos):
+		return Enemy(self.archetypes[enemytype], xpos, ypos, self.camera, self.rng)
+	
+	def add_enemy(self, enemy, enemies):
+		enemies.append(enemy)
+		self.occupancy.reserve(enemy)
+		enemy.occupancy = self.occupancy
+	
+	def remove_enemy(self, enemy, enemies):
+		enemies.remove(enemy)
+		self.occupancy.release(enemy)
+		enemy.occupancy = None
 	
 	def update_all(self, delta_time, bullet_controller, tilemap, player, item_controller, particle_controller, sound_controller):
+		self.spawn_nearby()
 		for enemy in self.enemies:
 			if enemy.is_offscreen():
-				self.enemies.remove(enemy)
+				self.remove_enemy(enemy, self.enemies)
 				#print("enemy disposed")
 			else:
 				if(enemy.dead and enemy.deathtimer == 0):
 					for i in enemy.item_drops:
-						if(random.random() < i[1]):
-							item_controller.add_item(self.itemdict[i[0]](enemy.current_tile, tilemap.scroll_position))
-					self.enemies.remove(enemy)
+						if(self.rng.drops.random() < i[1]):
+							item_controller.add_item(self.itemdict[i[0]](enemy.current_tile, self.camera))
+					self.remove_enemy(enemy, self.enemies)
 				elif enemy.is_onscreen():
 					#print("updating enemy onscreen @ y =", enemy.animations.get_position()[1])
 					enemy.update(delta_time, bullet_controller, tilemap, self, player, particle_controller, sound_controller)
-		if(tilemap.scroll_position <= 0):
+		if(self.camera.scroll_position <= 0):
 			self.boss_battle = True
 		if(self.boss_battle):
 			for boss in self.bosses:
 				if boss.is_offscreen():
-					self.bosses.remove(enemy)
+					self.remove_enemy(boss, self.bosses)
 					#print("enemy disposed")
 				else:
 					if(boss.dead and boss.deathtimer == 0):
 						for i in boss.item_drops:
-							if(random.random() < i[1]):
-								item_controller.add_item(self.itemdict[i[0]](boss.current_tile, tilemap.scroll_position))
-						self.bosses.remove(boss)
+							if(self.rng.drops.random() < i[1]):
+								item_controller.add_item(self.itemdict[i[0]](boss.current_tile, self.camera))
+						self.remove_enemy(boss, self.bosses)
 					elif boss.is_onscreen():
 						#print("updating enemy onscreen @ y =", enemy.animations.get_position()[1])
 						boss.update(delta_time, bullet_controller, tilemap, self, player, particle_controller, sound_controller)
@@ -2231,20 +1718,8 @@ class EnemyController:
 		for boss in self.bosses:
 			boss.draw(dest)
 	
-	def scroll_all(self, amount):
-		for enemy in self.enemies:
-			enemy.scroll(amount)
-		for boss in self.bosses:
-			boss.scroll(amount)
-	
 	def check_tile_for_enemy(self, tile):
-		for enemy in self.enemies:
-			if(enemy.current_tile == tile or enemy.intended_path == tile):
-				return True
-		for boss in self.bosses:
-			if(boss.current_tile == tile or boss.intended_path == tile):
-				return True
-		return False
+		return self.occupancy.is_occupied(tile)
 		
 	
 	def collide_all(self, hitbox):
@@ -2259,7 +1734,7 @@ class EnemyController:
 		return False
 	
 	def check_boss_killed(self):
-		return len(self.bosses) == 0 and len(self.enemies) == 0
+		return len(self.bosses) == 0 and len(self.enemies) == 0 and self.pending_spawns == 0
 			
 class Weapon:
 	def __init__(self):
@@ -2458,8 +1933,191 @@ class WeaponController:
 	
 	
 	
-class Player:
+# InputController: Takes one snapshot of the keyboard per frame, which everything reads that frame
+class InputController:
 	def __init__(self):
+		self.keys = KeySnapshot()
+	
+	def update(self):
+		self.keys = pygame.key.get_pressed()
+	
+	def get_pressed(self):
+		return self.keys
+
+# KeySnapshot: A set of pressed keys that can be indexed like the result of pygame.key.get_pressed()
+class KeySnapshot:
+	def __init__(self, pressed = ()):
+		self.pressed = frozenset(pressed)
+	
+	def __getitem__(self, key):
+		return key in self.pressed
+
+# ScriptedInputController: Plays back a list of [frames, [keys]] steps instead of reading the keyboard, looping at the end
+class ScriptedInputController(InputController):
+	def __init__(self, script, looping = True):
+		InputController.__init__(self)
+		self.script = script
+		self.looping = looping
+		self.step = 0
+		self.frames_left = 0
+	
+	def update(self):
+		while(self.frames_left <= 0):
+			if(self.step >= len(self.script)):
+				if(not self.looping or len(self.script) == 0):
+					self.keys = KeySnapshot()
+					return
+				self.step = 0
+			self.frames_left = self.script[self.step][0]
+			self.keys = KeySnapshot(self.script[self.step][1])
+			self.step += 1
+		self.frames_left -= 1
+
+# load_input_script: Reads a script for ScriptedInputController - each line has a frame count followed by the
+# names of the keys held during those frames, as in pygame (UP, LEFT, x, z...). Lines starting with # are skipped
+def load_input_script(filename):
+	script = []
+	with open(filename, "r") as scriptfile:
+		for line in scriptfile.readlines():
+			words = line.split()
+			if(not words or words[0].startswith("#")):
+				continue
+			keys = []
+			for name in words[1:]:
+				if(not hasattr(pygame, "K_" + name)):
+					raise ValueError("Unknown key \"" + name + "\" in input script " + filename)
+				keys.append(getattr(pygame, "K_" + name))
+			script.append([int(words[0]), keys])
+	return script
+
+# Walks up the stage shooting, strafing now and then - used by the headless mode when no script is given
+default_input_script = [
+	[40, [pygame.K_UP, pygame.K_x]],
+	[20, [pygame.K_UP]],
+	[15, [pygame.K_LEFT, pygame.K_x]],
+	[30, [pygame.K_UP, pygame.K_x]],
+	[15, [pygame.K_RIGHT, pygame.K_x]],
+	[10, [pygame.K_z, pygame.K_x]],
+	[5, [pygame.K_d]],
+	[20, [pygame.K_UP, pygame.K_c]],
+	[5, [pygame.K_s]]
+]
+
+# Every key the game reacts to during a stage - replays store one bit for each, in this order
+RECORDED_KEYS = [pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_x, pygame.K_z, pygame.K_c, pygame.K_d,
+	pygame.K_s, pygame.K_1, pygame.K_2, pygame.K_3, pygame.K_4, pygame.K_ESCAPE, pygame.K_RETURN, pygame.K_p]
+
+REPLAY_MAGIC = b"ALRP"
+REPLAY_VERSION = 2
+REPLAY_HEADER = "<4sHqBBH" # magic, version, seed, first stage, flags, simulation rate
+REPLAY_RUN = "<IdH" # frame count, delta_time, key mask
+REPLAY_IDDQD = 1
+REPLAY_ARRAY_BULLETS = 2
+
+def get_key_mask(keys):
+	mask = 0
+	for i in range(len(RECORDED_KEYS)):
+		if(keys[RECORDED_KEYS[i]]):
+			mask |= 1 << i
+	return mask
+
+def get_mask_keys(mask):
+	keys = []
+	for i in range(len(RECORDED_KEYS)):
+		if(mask & (1 << i)):
+			keys.append(RECORDED_KEYS[i])
+	return keys
+
+# ReplayWriter: Records a run to a file - the seed and options it started with, then the delta_time and keys
+# of every frame. Frames that repeat the previous one are stored as a single run, so idle stretches cost nothing
+class ReplayWriter:
+	def __init__(self, filename, seed, first_stage, flags, sim_rate):
+		self.filename = filename
+		self.file = open(filename, "wb")
+		self.file.write(struct.pack(REPLAY_HEADER, REPLAY_MAGIC, REPLAY_VERSION, seed, first_stage, flags, sim_rate))
+		self.run = None
+		self.frames = 0
+
+	def write_frame(self, delta_time, keys):
+		mask = get_key_mask(keys)
+		self.frames += 1
+		if(self.run is not None and self.run[1] == delta_time and self.run[2] == mask):
+			self.run[0] += 1
+			return
+		self.flush()
+		self.run = [1, delta_time, mask]
+
+	def flush(self):
+		if(self.run is not None):
+			self.file.write(struct.pack(REPLAY_RUN, self.run[0], self.run[1], self.run[2]))
+			self.run = None
+
+	def close(self):
+		if(self.file is None):
+			return
+		self.flush()
+		self.file.close()
+		self.file = None
+		print("Recorded", self.frames, "frames to", self.filename)
+
+# Replay: A run read back from a file made by ReplayWriter
+class Replay:
+	def __init__(self, filename):
+		with open(filename, "rb") as replayfile:
+			data = replayfile.read()
+		header_size = struct.calcsize(REPLAY_HEADER)
+		if(len(data) < header_size):
+			raise ValueError("Replay file " + filename + " is too short")
+		magic = data[:len(REPLAY_MAGIC)]
+		version = struct.unpack_from("<H", data, len(REPLAY_MAGIC))[0]
+		if(magic != REPLAY_MAGIC):
+			raise ValueError(filename + " is not a replay file")
+		if(version != REPLAY_VERSION):
+			raise ValueError("Replay file " + filename + " has version " + str(version) + ", expected " + str(REPLAY_VERSION))
+		magic, version, self.seed, self.first_stage, flags, self.sim_rate = struct.unpack_from(REPLAY_HEADER, data)
+		self.iddqd = bool(flags & REPLAY_IDDQD)
+		self.array_bullets = bool(flags & REPLAY_ARRAY_BULLETS)
+		self.runs = []
+		self.frames = 0
+		run_size = struct.calcsize(REPLAY_RUN)
+		for offset in range(header_size, len(data) - run_size + 1, run_size):
+			run = struct.unpack_from(REPLAY_RUN, data, offset)
+			self.runs.append(run)
+			self.frames += run[0]
+
+# ReplayInputController: Plays back the keys of a Replay, one frame per update. delta_time holds the recorded
+# delta_time of the current frame, and finished becomes True once every frame has been played
+class ReplayInputController(InputController):
+	def __init__(self, replay):
+		InputController.__init__(self)
+		self.replay = replay
+		self.step = 0
+		self.frames_left = 0
+		self.delta_time = 0
+		self.finished = False
+
+	def update(self):
+		while(self.frames_left <= 0):
+			if(self.step >= len(self.replay.runs)):
+				self.keys = KeySnapshot()
+				self.finished = True
+				return
+			run = self.replay.runs[self.step]
+			self.frames_left = run[0]
+			self.delta_time = run[1]
+			self.keys = KeySnapshot(get_mask_keys(run[2]))
+			self.step += 1
+		self.frames_left -= 1
+
+class Player:
+	def __init__(self, rng = None):
+		self.reset(rng)
+	
+	# reset: Puts the player back as it is at the start of a game. The sprite sheets are shared, so this is cheap
+	def reset(self, rng = None):
+		if(rng is None):
+			rng = RandomStreams()
+		self.rng = rng # RandomStreams for the whole game - the stages take theirs from the player
 		self.animations = AnimationGroup()
 		self.animations.add_animation(Animation("alice-9mm.png", 6, 8, "9mm"))
 		anim = self.animations.add_animation(Animation("alice-9mm-shoot.png", 3, 1, "9mm-shoot"))
@@ -2510,7 +2168,9 @@ class Player:
 		self.gun_speed = 360
 		self.gun_damage = 35
 		self.state = 0 # States: 0 = idle, 1 = moving, 2 = running, 3 = aiming, 4 = hiding low, 5 = hiding and aiming low, 6 = hiding high, 7 = hiding and aiming high, 8 = reloading, 9 = automatic reload, 10 = shooting while standing
-		self.aim_cursor = AimCursor(self.animations.get_position())
+		self.camera = Camera()
+		self.input_con = InputController()
+		self.aim_cursor = AimCursor(self.animations.get_position(), self.camera)
 		self.aim_tick_count = 0
 		self.health = 100
 		self.max_health = 100
@@ -2532,11 +2192,12 @@ class Player:
 		self.state_before_reload = 0
 		
 	def update(self, delta_time, tilemap, bullet_controller, particle_controller, enemy_controller, sound_controller):
+		ticks = delta_time * TICKS_PER_SECOND
 		if(self.dead):
 			if(self.lives == 0):
 				return
 			if(self.death_counter > 0):	
-				self.death_counter -= 1
+				self.death_counter -= ticks
 			else:
 				self.death_counter = 0
 				self.revive()
@@ -2544,7 +2205,7 @@ class Player:
 				
 		if(self.invincible):
 			if(self.invincible_timer > 0):
-				self.invincible_timer -= 1
+				self.invincible_timer -= ticks
 			else:
 				self.invincible = False
 			if(self.blink_timer > 0):
@@ -2569,7 +2230,7 @@ class Player:
 					
 		#print("state", self.state)
 		# Get keyboard presses for movement and compute acceleration
-		keys = pygame.key.get_pressed()
+		keys = self.input_con.get_pressed()
 		if(self.state == 0 or self.state == 10):
 			if not (self.velocity[0] == 0 and self.velocity[1] == 0):
 				self.state = 1
@@ -2645,8 +2306,12 @@ class Player:
 				self.acceleration[0] = 0
 		# Now, compute velocity
 		for i in range(2):
-			self.velocity[i] += self.acceleration[i]
-			self.velocity[i] /= self.drag_coef
+			if(ticks == 1):
+				self.velocity[i] += self.acceleration[i]
+				self.velocity[i] /= self.drag_coef
+			else: # The same thing over any number of ticks - the velocity closes in on acceleration / (drag_coef - 1)
+				terminal = self.acceleration[i] / (self.drag_coef - 1)
+				self.velocity[i] = terminal + (self.velocity[i] - terminal) * self.drag_coef ** -ticks
 			if(self.velocity[i] < 0.1 and self.velocity[i] > -0.1):
 				self.velocity[i] = 0
 		#print(self.velocity)
@@ -2670,11 +2335,12 @@ class Player:
 		if(enemy_controller.collide_all(self.get_hitbox())):
 			self.animations.move([-self.velocity[0], -self.velocity[1]], delta_time)
 		# Avoid character from going below the screen
-		if(self.animations.get_position()[1] > 200):
-			self.animations.move_absolute([0, -(self.animations.get_position()[1] - 200)])
+		screen_y = self.camera.get_screen_y(self.animations.get_position()[1])
+		if(screen_y > 200):
+			self.animations.move_absolute([0, -(screen_y - 200)])
 		# Avoid character from going above the screen
-		if(self.animations.get_position()[1] < -8):
-			self.animations.move_absolute([0, -(self.animations.get_position()[1] + 8)])
+		if(screen_y < -8):
+			self.animations.move_absolute([0, -(screen_y + 8)])
 		# Check and correct for collision on the map
 		motion_vector = [self.velocity[0] * delta_time, self.velocity[1] * delta_time]
 		hitbox = pygame.Rect(self.animations.get_position()[0], self.animations.get_position()[1] + 15, 16, 9)
@@ -2699,7 +2365,7 @@ class Player:
 						self.aim_tick_count = 0
 					self.aim_cursor.change_direction((40 - self.aim_tick_count * 15) * delta_time)
 					if(self.aim_tick_count >= -30):
-						self.aim_tick_count -= 1
+						self.aim_tick_count -= ticks
 				else:
 					self.aim_tick_count = 0
 			elif keys[pygame.K_RIGHT]:
@@ -2707,7 +2373,7 @@ class Player:
 					self.aim_tick_count = 0
 				self.aim_cursor.change_direction((-40 - self.aim_tick_count * 15) * delta_time)
 				if(self.aim_tick_count <= 30):
-					self.aim_tick_count += 1
+					self.aim_tick_count += ticks
 			else:
 				self.aim_tick_count = 0
 			self.animations.set_direction(self.aim_cursor.direction % 360)
@@ -2779,10 +2445,11 @@ class Player:
 	
 	def draw(self, dest):
 		if(not self.blink_state):
-			self.animations.draw(dest)
+			self.animations.draw(dest, self.camera.scroll_position)
 		if(not self.dead):
 			self.aim_cursor.draw(dest)
-			pygame.draw.line(dest, pygame.Color(240, 0, 0, 0), (self.animations.get_position()[0], self.animations.get_position()[1] - 2), (self.animations.get_position()[0] + int(16 * (self.health / 100)), self.animations.get_position()[1] - 2))
+			screen_y = self.camera.get_screen_y(self.animations.get_position()[1])
+			pygame.draw.line(dest, pygame.Color(240, 0, 0, 0), (self.animations.get_position()[0], screen_y - 2), (self.animations.get_position()[0] + int(16 * (self.health / 100)), screen_y - 2))
 	
 	def get_hitbox(self):
 		topleft = self.animations.get_position()
@@ -2853,12 +2520,16 @@ class Player:
 		self.animations.moveto(x, y)
 		self.aim_cursor.position = [self.animations.get_position()[0] + 12, self.animations.get_position()[1] + 8]
 	
-	def scroll(self, y):
-		self.animations.move_absolute([0, y])
+	def set_camera(self, camera):
+		self.camera = camera
+		self.aim_cursor.camera = camera
+	
+	def set_input(self, input_con):
+		self.input_con = input_con
 	
 	def shoot_ifbuttonpressed(self, bullet_controller, particle_controller, sound_controller):
 		if(self.weapons.no_bullets):
-			keys = pygame.key.get_pressed()
+			keys = self.input_con.get_pressed()
 			button_state = keys[pygame.K_x]
 			if(self.shot_timer > 0):
 				if(button_state and not self.shoot_button_state):
@@ -2867,7 +2538,7 @@ class Player:
 				return
 			else:
 				if(button_state and not self.shoot_button_state) or (self.shoot_buffer):
-					bullet_controller.player_melee_attack(pygame.Rect(self.animations.get_position()[0] - 5, self.animations.get_position()[1] - 6, 29, 24), int(35 + (random.random() * 20)))
+					bullet_controller.player_melee_attack(pygame.Rect(self.animations.get_position()[0] - 5, self.animations.get_position()[1] - 6, 29, 24), int(35 + (self.rng.spread.random() * 20)))
 					particle_controller.spawn_particle("knife-slash", (self.animations.get_position()[0] - 8, self.animations.get_position()[1] - 8))
 					sound_controller.play_sound("melee")
 					self.shot_timer = self.knife_slash_interval
@@ -2878,7 +2549,7 @@ class Player:
 			if(self.state == 2 or self.state == 4 or self.state == 6 or self.state == 8 or self.state == 9):
 				return
 			weapon = self.weapons.get_current_weapon()
-			keys = pygame.key.get_pressed()
+			keys = self.input_con.get_pressed()
 			button_state = keys[pygame.K_x]
 			if(self.shot_timer > 0):
 				if(button_state and (not weapon.rapid_fire and not self.shoot_button_state)):
@@ -2896,7 +2567,7 @@ class Player:
 				else:
 					spread_coeff = (self.spread_timer / weapon.spread_interval)
 				spread_range = ((weapon.spread_angle_min * (1 - spread_coeff)) + (weapon.spread_angle_max * spread_coeff))
-				angle += (random.random() - 0.5) * spread_range
+				angle += (self.rng.spread.random() - 0.5) * spread_range
 		
 			
 				if(button_state and (weapon.rapid_fire or not self.shoot_button_state)) or (self.shoot_buffer):
@@ -2918,7 +2589,7 @@ class Player:
 		self.shoot_button_state = button_state
 	
 	def reload_ifbuttonpressed(self, sound_controller):
-		keys = pygame.key.get_pressed()
+		keys = self.input_con.get_pressed()
 		button_state = keys[pygame.K_d]
 		if(button_state):
 			reload_result = self.weapons.reload_gun()
@@ -2939,7 +2610,7 @@ class Player:
 	def change_weapon_ifbuttonpressed(self):
 		if(self.reload_timer > 0):
 			return
-		keys = pygame.key.get_pressed()
+		keys = self.input_con.get_pressed()
 		if(keys[pygame.K_4]):
 			self.weapons.switch_to(3)			
 		elif(keys[pygame.K_3]):
@@ -2950,7 +2621,7 @@ class Player:
 			self.weapons.switch_to(0)
 	
 	def use_syringe_ifbuttonpressed(self, sound_controller):
-		keys = pygame.key.get_pressed()
+		keys = self.input_con.get_pressed()
 		if(keys[pygame.K_s]):
 			if(self.syringe_count > 0 and self.syringe_timer == 0):
 				if(self.heal(40)):
@@ -2977,9 +2648,10 @@ class Player:
 		self.syringe_count += 1
 
 class Item:
-	def __init__(self, spritefile, tile, map_scroll, destroy_timer = 10):
+	def __init__(self, spritefile, tile, camera, destroy_timer = 10):
 		self.image = load_png("sprites", spritefile)
-		self.position = [tile[0] * 16, (tile[1] * 16) - map_scroll]
+		self.position = [tile[0] * 16, tile[1] * 16]
+		self.camera = camera
 		self.w = 16
 		self.h = 16
 		self.destroy_timer = destroy_timer
@@ -3006,13 +2678,14 @@ class Item:
 	
 	def draw(self, dest):
 		if not(self.blink_state or self.destroy_timer <= 0):
-			dest.blit(self.image, (self.position[0], self.position[1]))
+			dest.blit(self.image, (self.position[0], self.camera.get_screen_y(self.position[1])))
 	
 	def is_onscreen(self):
-		return (self.position[1] > -16 and self.position[1] < 240)
+		screen_y = self.camera.get_screen_y(self.position[1])
+		return (screen_y > -16 and screen_y < 240)
 	
 	def is_offscreen(self):
-		return self.position[1] >= 240
+		return self.camera.get_screen_y(self.position[1]) >= 240
 	
 	def get_hitbox(self):
 		return pygame.Rect(self.position[0] - 1, self.position[1] - 1, self.w + 2, self.h + 2)
@@ -3020,14 +2693,10 @@ class Item:
 	def pickup_action(self, player, sound_controller):
 		#print("An undefined item has been picked up at", self.position)
 		return True
-	
-	def scroll(self, y):
-		self.position[1] += y
-		#print(self, "position:", self.position)
 
 class AmmoBox9mm(Item):
-	def __init__(self, tile, map_scroll, ammo = 26, destroy_timer = 10):
-		Item.__init__(self, "item-ammo9mm.png", tile, map_scroll, destroy_timer)
+	def __init__(self, tile, camera, ammo = 26, destroy_timer = 10):
+		Item.__init__(self, "item-ammo9mm.png", tile, camera, destroy_timer)
 		self.ammo = ammo
 	
 	def pickup_action(self, player, sound_controller):
@@ -3038,8 +2707,8 @@ class AmmoBox9mm(Item):
 		return True
 
 class AmmoBox762(Item):
-	def __init__(self, tile, map_scroll, ammo = 45, destroy_timer = 10):
-		Item.__init__(self, "item-ammo762.png", tile, map_scroll, destroy_timer)
+	def __init__(self, tile, camera, ammo = 45, destroy_timer = 10):
+		Item.__init__(self, "item-ammo762.png", tile, camera, destroy_timer)
 		self.ammo = ammo
 	
 	def pickup_action(self, player, sound_controller):
@@ -3050,8 +2719,8 @@ class AmmoBox762(Item):
 		return True
 
 class Medkit(Item):
-	def __init__(self, tile, map_scroll, health = 33, destroy_timer = 15):
-		Item.__init__(self, "item-medkit_small.png", tile, map_scroll, destroy_timer)
+	def __init__(self, tile, camera, health = 33, destroy_timer = 15):
+		Item.__init__(self, "item-medkit_small.png", tile, camera, destroy_timer)
 		self.health = health
 	
 	def pickup_action(self, player, sound_controller):
@@ -3064,8 +2733,8 @@ class Medkit(Item):
 			return False
 
 class Medpack(Item):
-	def __init__(self, tile, map_scroll, health = 100, destroy_timer = 15):
-		Item.__init__(self, "item-medkit_large.png", tile, map_scroll, destroy_timer)
+	def __init__(self, tile, camera, health = 100, destroy_timer = 15):
+		Item.__init__(self, "item-medkit_large.png", tile, camera, destroy_timer)
 		self.health = health
 	
 	def pickup_action(self, player, sound_controller):
@@ -3078,8 +2747,8 @@ class Medpack(Item):
 			return False
 
 class Syringe(Item):
-	def __init__(self, tile, map_scroll, destroy_timer = 8):
-		Item.__init__(self, "item-syringe.png", tile, map_scroll, destroy_timer)
+	def __init__(self, tile, camera, destroy_timer = 8):
+		Item.__init__(self, "item-syringe.png", tile, camera, destroy_timer)
 	
 	def pickup_action(self, player, sound_controller):	
 		player.add_syringe()
@@ -3090,47 +2759,54 @@ class Syringe(Item):
 
 
 
+# load_item_file: The item placements of an item file in data/ - [type, xpos, ypos, ammo]
+def load_item_file(itemfile):
+	placements = []
+	itemdict = dict()
+	path = os.path.join("data", itemfile)
+	f = open(path)
+	l = f.readline()
+	while(not l == ""):
+		if(l == "item:\n"):
+			l = f.readline()
+			while(not l == ":end\n"):
+				if not l:
+					raise ValueError("The item file is invalid.")
+				l_keyvalue = l.split("=")
+				itemdict[l_keyvalue[0]] = l_keyvalue[1]
+				l = f.readline()
+			placements.append([itemdict["type"].strip(), int(itemdict["xpos"]), int(itemdict["ypos"]), int(itemdict.get("ammo", 0))])
+			l = f.readline()
+		else:
+			l = f.readline()
+	f.close()
+	return placements
+
 class ItemController:
-	def __init__(self, itemfile = "", map_scroll = 0):
+	def __init__(self, camera, placements = None):
 		self.items = []
-		if(itemfile):
-			self.load_item_file(itemfile, map_scroll)
-			#print(self.items)
+		self.camera = camera
+		if(placements):
+			self.add_placed_items(placements)
 	
 	def add_item(self, item):
 		self.items.append(item)
 	
-	def load_item_file(self, itemfile, map_scroll):
-		itemdict = dict()
-		path = os.path.join("data", itemfile)
-		f = open(path)
-		l = f.readline()
-		while(not l == ""):
-			#print(l)
-			if(l == "item:\n"):
-				l = f.readline()
-				while(not l == ":end\n"):
-					if not l:
-						raise ValueError("The item file is invalid.")
-					l_keyvalue = l.split("=")
-					#print(l_keyvalue)
-					itemdict[l_keyvalue[0]] = l_keyvalue[1]
-					l = f.readline()
-				if(itemdict["type"] == "dummy\n"):
-					self.items.append(Item("item-dummy.png", [int(itemdict["xpos"]), int(itemdict["ypos"])], map_scroll, 3600))
-				elif(itemdict["type"] == "ammo9mm\n"):
-					self.items.append(AmmoBox9mm([int(itemdict["xpos"]), int(itemdict["ypos"])], map_scroll, int(itemdict["ammo"]), 3600))
-				elif(itemdict["type"] == "ammo762\n"):
-					self.items.append(AmmoBox762([int(itemdict["xpos"]), int(itemdict["ypos"])], map_scroll, int(itemdict["ammo"]), 3600))
-				elif(itemdict["type"] == "medkit\n"):
-					self.items.append(Medkit([int(itemdict["xpos"]), int(itemdict["ypos"])], map_scroll, 33, 3600))
-				elif(itemdict["type"] == "medpack\n"):
-					self.items.append(Medpack([int(itemdict["xpos"]), int(itemdict["ypos"])], map_scroll, 100, 3600))
-				elif(itemdict["type"] == "syringe\n"):
-					self.items.append(Syringe([int(itemdict["xpos"]), int(itemdict["ypos"])], map_scroll, 3600))
-				l = f.readline()
-			else:
-				l = f.readline()
+	# add_placed_items: Creates the items of the stage from their placements (see load_item_file)
+	def add_placed_items(self, placements):
+		for itemtype, xpos, ypos, ammo in placements:
+			if(itemtype == "dummy"):
+				self.items.append(Item("item-dummy.png", [xpos, ypos], self.camera, 3600))
+			elif(itemtype == "ammo9mm"):
+				self.items.append(AmmoBox9mm([xpos, ypos], self.camera, ammo, 3600))
+			elif(itemtype == "ammo762"):
+				self.items.append(AmmoBox762([xpos, ypos], self.camera, ammo, 3600))
+			elif(itemtype == "medkit"):
+				self.items.append(Medkit([xpos, ypos], self.camera, 33, 3600))
+			elif(itemtype == "medpack"):
+				self.items.append(Medpack([xpos, ypos], self.camera, 100, 3600))
+			elif(itemtype == "syringe"):
+				self.items.append(Syringe([xpos, ypos], self.camera, 3600))
 	
 	
 	def draw_all(self, dest):
@@ -3147,10 +2823,6 @@ class ItemController:
 				if item.is_onscreen():
 					item.update(delta_time)
 	
-	def scroll_all(self, y):
-		for item in self.items:
-			item.scroll(y)
-	
 	def check_collision(self, hitbox, player, sound_controller):
 		for item in self.items:
 			if item.is_onscreen():
@@ -3159,20 +2831,85 @@ class ItemController:
 						self.items.remove(item)
 	
 
+# SpatialHash: Buckets things by the grid cells (in world pixels) their rect touches, so a rect only
+# needs to be tested against what shares a cell with it
+class SpatialHash:
+	def __init__(self, cell_size = 32):
+		self.cell_size = cell_size
+		self.cells = dict()
+	
+	def clear(self):
+		self.cells.clear()
+	
+	def get_keys(self, rect):
+		keys = []
+		for x in range(rect.left // self.cell_size, (rect.right - 1) // self.cell_size + 1):
+			for y in range(rect.top // self.cell_size, (rect.bottom - 1) // self.cell_size + 1):
+				keys.append((x, y))
+		return keys
+	
+	def insert(self, item, rect):
+		keys = self.get_keys(rect)
+		for key in keys:
+			if key in self.cells:
+				self.cells[key].append(item)
+			else:
+				self.cells[key] = [item]
+		return keys
+	
+	def remove(self, item, keys):
+		for key in keys:
+			cell = self.cells.get(key)
+			if cell and item in cell:
+				cell.remove(item)
+	
+	# query: Everything sharing a cell with rect, each item once
+	def query(self, rect):
+		found = dict()
+		for key in self.get_keys(rect):
+			for item in self.cells.get(key, ()):
+				found[id(item)] = item
+		return list(found.values())
+
 class BulletController:
-	def __init__(self):
+	def __init__(self, camera, angle_step = 1, cell_size = 32):
+		self.camera = camera
 		self.player_bullets = []
 		self.enemy_bullets = []
 		self.player_melee = []
+		self.sprite_table = BulletSpriteTable("shot.png", angle_step)
+		self.player_hash = SpatialHash(cell_size)
+		self.enemy_hash = SpatialHash(cell_size)
+		self.melee_hash = SpatialHash(cell_size)
+		self.serial = 0 # Spawn order, so the collision queries return bullets in the same order as the lists
+	
+	def add_bullet(self, bullet, bullets, spatial_hash):
+		bullet.serial = self.serial
+		self.serial += 1
+		bullets.append(bullet)
+		bullet.cells = spatial_hash.insert(bullet, bullet.get_bounds())
 	
 	def player_shoot(self, position, direction, speed, damage):
-		self.player_bullets.append(Bullet("shot.png", position, direction, speed, damage, False))
+		self.add_bullet(Bullet(self.sprite_table, position, direction, speed, damage, False, self.camera), self.player_bullets, self.player_hash)
 	
 	def player_melee_attack(self, rect, damage, timeout = 1):
-		self.player_melee.append([rect, damage, timeout])
+		melee = [rect, damage, timeout, self.serial]
+		self.serial += 1
+		self.player_melee.append(melee)
+		self.melee_hash.insert(melee, rect)
 	
 	def enemy_shoot(self, position, direction, speed, damage):
-		self.enemy_bullets.append(Bullet("shot.png", position, direction, speed, damage, True))
+		self.add_bullet(Bullet(self.sprite_table, position, direction, speed, damage, True, self.camera), self.enemy_bullets, self.enemy_hash)
+	
+	# rebuild_hashes: Re-buckets everything after it has moved - called once per frame from update_all
+	def rebuild_hashes(self):
+		for bullets, spatial_hash in ((self.player_bullets, self.player_hash), (self.enemy_bullets, self.enemy_hash)):
+			spatial_hash.clear()
+			for i in bullets:
+				i.cells = spatial_hash.insert(i, i.get_bounds())
+		self.melee_hash.clear()
+		for i in self.player_melee:
+			self.melee_hash.insert(i, i[0])
 	
 	def update_all(self, delta_time, tilemap, sound_controller):
 		#print(len(self.player_bullets), len(self.enemy_bullets))
@@ -3200,24 +2937,24 @@ class BulletController:
 			i[2] -= 1
 			if not(i[2]) > 0:
 				self.player_melee.remove(i)
+		self.rebuild_hashes()
 	
-	def collide_enemy(self, rect):
+	def collide_bullets(self, rect, spatial_hash):
 		bullets = []
-		for i in self.enemy_bullets:
+		for i in sorted(spatial_hash.query(rect), key=lambda bullet: bullet.serial):
 			if i.check_collision(rect):
 				bullets.append(i)
 		return bullets
 	
+	def collide_enemy(self, rect):
+		return self.collide_bullets(rect, self.enemy_hash)
+	
 	def collide_player(self, rect):
-		bullets = []
-		for i in self.player_bullets:
-			if i.check_collision(rect):
-				bullets.append(i)
-		return bullets
+		return self.collide_bullets(rect, self.player_hash)
 	
 	def collide_melee_player(self, rect):
 		damage = []
-		for i in self.player_melee:
+		for i in sorted(self.melee_hash.query(rect), key=lambda melee: melee[3]):
 			if rect.colliderect(i[0]):
 				damage.append(i[1])
 		return damage
@@ -3226,24 +2963,185 @@ class BulletController:
 		for i in bullets:
 			if i.is_enemy:
 				self.enemy_bullets.remove(i)
+				self.enemy_hash.remove(i, i.cells)
 			else:
 				self.player_bullets.remove(i)
+				self.player_hash.remove(i, i.cells)
 	
 	def draw_all(self, dest):
 		for i in self.enemy_bullets:
 			i.draw(dest)
 		for i in self.player_bullets:
 			i.draw(dest)
+
+# BulletHandle: What ArrayBulletController hands out from its collision queries, so destroy() can find the slot again
+class BulletHandle:
+	def __init__(self, slot, damage, is_enemy, direction):
+		self.slot = slot
+		self.damage = damage
+		self.is_enemy = is_enemy
+		self.direction = direction
+
+# ArrayBulletController: Same interface as BulletController, but the bullets are kept in NumPy arrays
+# (one entry per bullet) and moved, culled and tested against the map all at once. Dead bullets are only
+# flagged, and the arrays are compacted at the start of update_all, so slots stay valid during a frame.
+class ArrayBulletController:
+	def __init__(self, camera, angle_step = 1, capacity = 256):
+		self.camera = camera
+		self.sprite_table = BulletSpriteTable("shot.png", angle_step)
+		self.player_melee = []
+		self.count = 0
+		self.position = numpy.zeros((capacity, 2))
+		self.vector = numpy.zeros((capacity, 2))
+		self.direction = numpy.zeros(capacity) # The exact angle each bullet was fired at (the sprite and vector are rounded)
+		self.speed = numpy.zeros(capacity)
+		self.damage = numpy.zeros(capacity, dtype=numpy.int64)
+		self.sprite = numpy.zeros(capacity, dtype=numpy.int64)
+		self.is_enemy = numpy.zeros(capacity, dtype=bool)
+		self.alive = numpy.zeros(capacity, dtype=bool)
+		self.hitbox_x = numpy.zeros((capacity, 3), dtype=numpy.int64)
+		self.hitbox_y = numpy.zeros((capacity, 3), dtype=numpy.int64)
+		self.hitbox_steps = numpy.arange(3) * 3
+		self.high_tiles = None # Boolean grid of the tiles bullets can't go through, built from the tilemap on first use
+		self.high_tiles_source = None
+	
+	def grow(self):
+		capacity = len(self.alive) * 2
+		for name in ("position", "vector", "direction", "speed", "damage", "sprite", "is_enemy", "alive", "hitbox_x", "hitbox_y"):
+			old = getattr(self, name)
+			new = numpy.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+			new[:len(old)] = old
+			setattr(self, name, new)
+	
+	def add_bullet(self, position, direction, speed, damage, is_enemy):
+		if(self.count == len(self.alive)):
+			self.grow()
+		i = self.count
+		index = self.sprite_table.get_index(direction)
+		image = self.sprite_table.images[index]
+		self.position[i] = [position[0] - image.get_width() / 2, position[1] - image.get_height() / 2]
+		self.vector[i] = self.sprite_table.vectors[index]
+		self.direction[i] = direction
+		self.speed[i] = speed
+		self.damage[i] = damage
+		self.sprite[i] = index
+		self.is_enemy[i] = is_enemy
+		self.alive[i] = True
+		self.update_hitboxes(slice(i, i + 1))
+		self.count += 1
 	
-	def scroll(self, y):
-		for i in self.player_bullets:
-			i.scroll(y)
-		for i in self.enemy_bullets:
-			i.scroll(y)
+	def player_shoot(self, position, direction, speed, damage):
+		self.add_bullet(position, direction, speed, damage, False)
+	
+	def player_melee_attack(self, rect, damage, timeout = 1):
+		self.player_melee.append([rect, damage, timeout])
+	
+	def enemy_shoot(self, position, direction, speed, damage):
+		self.add_bullet(position, direction, speed, damage, True)
+	
+	# update_hitboxes: Places the three 3x3 hitboxes trailing behind each bullet, like Bullet.update does
+	def update_hitboxes(self, view):
+		self.hitbox_x[view] = (self.position[view, 0:1] - 1 - self.hitbox_steps * self.vector[view, 0:1]).astype(numpy.int64)
+		self.hitbox_y[view] = (self.position[view, 1:2] - 1 - self.hitbox_steps * self.vector[view, 1:2]).astype(numpy.int64)
+	
+	def compact(self):
+		keep = numpy.flatnonzero(self.alive[:self.count])
+		if(len(keep) == self.count):
+			return
+		n = len(keep)
+		for name in ("position", "vector", "direction", "speed", "damage", "sprite", "is_enemy", "hitbox_x", "hitbox_y"):
+			array = getattr(self, name)
+			array[:n] = array[keep]
+		self.alive[:n] = True
+		self.alive[n:self.count] = False
+		self.count = n
+	
+	def get_high_tiles(self, tilemap):
+		if(self.high_tiles_source is not tilemap):
+			collision = numpy.array(tilemap.collision_map)
+			self.high_tiles = collision[numpy.array(tilemap.tilemap)] == 2
+			self.high_tiles_source = tilemap
+		return self.high_tiles
+	
+	# collide_high: Vectorized TilemapHandler.collide_check_high over every hitbox of every bullet
+	def collide_high(self, view, tilemap):
+		high_tiles = self.get_high_tiles(tilemap)
+		hx = self.hitbox_x[view]
+		hy = self.hitbox_y[view]
+		map_x = numpy.trunc((hx + 1) / 16).astype(numpy.int64)
+		map_y = numpy.trunc((hy + 1) / 16).astype(numpy.int64)
+		collided = numpy.zeros(hx.shape, dtype=bool)
+		for d in (-1, 0, 1):
+			tile_x = map_x + d
+			tile_y = map_y + d
+			inside = (tile_x >= 0) & (tile_x < 16) & (tile_y >= 0) & (tile_y < len(high_tiles))
+			solid = numpy.zeros(hx.shape, dtype=bool)
+			solid[inside] = high_tiles[tile_y[inside], tile_x[inside]]
+			overlap = (hx < tile_x * 16 + 16) & (tile_x * 16 < hx + 3) & (hy < tile_y * 16 + 16) & (tile_y * 16 < hy + 3)
+			collided |= solid & overlap
+		return collided.any(axis=1)
+	
+	def update_all(self, delta_time, tilemap, sound_controller):
+		self.compact()
+		view = slice(0, self.count)
+		self.position[view] += self.vector[view] * self.speed[view, None] * delta_time
+		self.update_hitboxes(view)
+		screen_y = self.position[view, 1] - self.camera.scroll_position
+		outside = (self.position[view, 0] < -8) | (screen_y < -8) | (self.position[view, 0] > 264) | (screen_y > 232)
+		ricochet = self.collide_high(view, tilemap) & ~outside
+		self.alive[view] &= ~(outside | ricochet)
+		for i in range(int(numpy.count_nonzero(ricochet))):
+			sound_controller.play_sound("shot-ricochet")
+		for i in self.player_melee:
+			i[2] -= 1
+			if not(i[2]) > 0:
+				self.player_melee.remove(i)
+	
+	def collide(self, rect, is_enemy):
+		view = slice(0, self.count)
+		hx = self.hitbox_x[view]
+		hy = self.hitbox_y[view]
+		hit = ((hx < rect.right) & (rect.left < hx + 3) & (hy < rect.bottom) & (rect.top < hy + 3)).any(axis=1)
+		hit &= self.alive[view] & (self.is_enemy[view] == is_enemy)
+		bullets = []
+		for i in numpy.flatnonzero(hit).tolist():
+			bullets.append(BulletHandle(i, int(self.damage[i]), is_enemy, float(self.direction[i])))
+		return bullets
+	
+	def collide_enemy(self, rect):
+		return self.collide(rect, True)
+	
+	def collide_player(self, rect):
+		return self.collide(rect, False)
+	
+	def collide_melee_player(self, rect):
+		damage = []
+		for i in self.player_melee:
+			if rect.colliderect(i[0]):
+				damage.append(i[1])
+		return damage
+	
+	def destroy(self, bullets):
+		for i in bullets:
+			self.alive[i.slot] = False
+	
+	def draw_all(self, dest):
+		view = slice(0, self.count)
+		images = self.sprite_table.images
+		scroll = self.camera.scroll_position
+		blits = []
+		# Enemy bullets go below the player's ones, like in BulletController
+		for is_enemy in (True, False):
+			slots = numpy.flatnonzero(self.alive[view] & (self.is_enemy[view] == is_enemy))
+			for i, x, y in zip(self.sprite[slots].tolist(), self.position[slots, 0].tolist(), self.position[slots, 1].tolist()):
+				blits.append((images[i], (x, y - scroll)))
+		if(blits):
+			dest.blits(blits, False)
 
 class Particle:
-	def __init__(self, animation, position, lifetime, speed = [0, 0]):
+	def __init__(self, animation, position, camera, lifetime, speed = [0, 0]):
 		self.animation = animation
+		self.camera = camera
 		self.name = animation.name
 		self.animation.moveto(position[0], position[1])
 		self.life_timer = lifetime
@@ -3259,10 +3157,7 @@ class Particle:
 	
 	def draw(self, dest):
 		if(self.life_timer > 0):
-			self.animation.draw(dest)
-	
-	def scroll(self, y):
-		self.animation.move(0, y)
+			self.animation.draw(dest, self.camera.scroll_position)
 	
 	def name_is(self, name):
 		return self.name == name
@@ -3271,8 +3166,8 @@ class Particle:
 		self.animations.move(motion_vector[0], motion_vector[1])
 
 class Particle_KnifeSlash(Particle):
-	def __init__(self, position, direction = 90):
-		Particle.__init__(self, Animation("knife-slash.png", 3, 8, "knife-slash"), position, 6/60)
+	def __init__(self, position, camera, rng, direction = 90):
+		Particle.__init__(self, Animation("knife-slash.png", 3, 8, "knife-slash"), position, camera, 6/60)
 		self.animation.looping = False
 		self.animation.returns = False
 		self.animation.frametime = 2/60
@@ -3280,18 +3175,20 @@ class Particle_KnifeSlash(Particle):
 		self.animation.update_anim(0)
 
 class Particle_BloodSmall(Particle):
-	def __init__(self, position, speed = [0, 0]):
-		Particle.__init__(self, Animation("blood-small.png", 4, 3, "blood-small"), position, 10/60, speed)
+	def __init__(self, position, camera, rng, speed = [0, 0]):
+		Particle.__init__(self, Animation("blood-small.png", 4, 3, "blood-small"), position, camera, 10/60, speed)
 		self.animation.looping = False
 		self.animation.returns = False
 		self.animation.frametime = 10/180
-		self.animation.direction = int(random.random() * 360)
+		self.animation.direction = int(rng.cosmetic.random() * 360)
 		self.animation.update_anim(0)
 	
 
 class ParticleController:
-	def __init__(self):
+	def __init__(self, camera, rng):
 		self.particles = []
+		self.camera = camera
+		self.rng = rng
 		self.particle_dict = dict()
 		self.particle_dict["knife-slash"] = Particle_KnifeSlash
 		self.particle_dict["blood-small"] = Particle_BloodSmall
@@ -3308,11 +3205,7 @@ class ParticleController:
 			p.draw(dest)
 	
 	def spawn_particle(self, name, position, *args):
-		self.particles.append(self.particle_dict[name](position, *args))
-
-	def scroll_all(self, y):
-		for p in self.particles:
-			p.scroll(y)
+		self.particles.append(self.particle_dict[name](position, self.camera, self.rng, *args))
 	
 	def move_particles_by_name(self, name, motion_vector):
 		for p in self.particles:
@@ -3320,6 +3213,7 @@ class ParticleController:
 				p.move(motion_vector)
 
 
+# SoundController: Plays the sound effects through a fixed pool of mixer channels, split by category
 class SoundController:
 	def __init__(self):
 		self.sounddict = dict()
@@ -3346,8 +3240,83 @@ class SoundController:
 		self.sounddict["melee"] = pygame.mixer.Sound(os.path.join("sound", "sfx", "melee.ogg"))
 		self.sounddict["unpause"] = pygame.mixer.Sound(os.path.join("sound", "sfx", "unpause.ogg"))
 	
+		# Each category gets its own channels, so a burst of one kind of sound can't take the voices of the others
+		self.channel_counts = OrderedDict([["player", 4], ["enemy", 3], ["impact", 4], ["ui", 2]])
+		# sound: [category, priority] - when a category is out of channels, a sound takes the channel of the lowest priority
+		# sound playing there (the oldest one on a tie), if that isn't higher than its own
+		self.sound_categories = dict()
+		self.sound_categories["alice-damage"] = ["player", 2]
+		self.sound_categories["alice-die"] = ["player", 3]
+		self.sound_categories["melee"] = ["player", 1]
+		self.sound_categories["reload"] = ["player", 1]
+		self.sound_categories["shoot-ar"] = ["player", 1]
+		self.sound_categories["shoot-m1garand"] = ["player", 1]
+		self.sound_categories["shoot-pistol"] = ["player", 1]
+		self.sound_categories["shoot-smg"] = ["player", 1]
+		self.sound_categories["syringe"] = ["player", 1]
+		self.sound_categories["enemy-shoot-strong"] = ["enemy", 1]
+		self.sound_categories["enemy-shoot-weak"] = ["enemy", 0]
+		self.sound_categories["enemy-damage1"] = ["impact", 1]
+		self.sound_categories["enemy-damage2"] = ["impact", 1]
+		self.sound_categories["enemy-damage3"] = ["impact", 1]
+		self.sound_categories["enemy-die1"] = ["impact", 2]
+		self.sound_categories["enemy-die2"] = ["impact", 2]
+		self.sound_categories["shot-ricochet"] = ["impact", 0]
+		self.sound_categories["gun-pickup"] = ["ui", 1]
+		self.sound_categories["item-pickup-ammo"] = ["ui", 1]
+		self.sound_categories["item-pickup-health"] = ["ui", 1]
+		self.sound_categories["pause"] = ["ui", 2]
+		self.sound_categories["unpause"] = ["ui", 2]
+		total = sum(self.channel_counts.values())
+		pygame.mixer.set_num_channels(total)
+		pygame.mixer.set_reserved(total) # Keep Sound.play() from picking our channels on its own
+		self.pools = dict()
+		first = 0
+		for category, count in self.channel_counts.items():
+			# Each voice: [channel, priority, play count when it started]
+			self.pools[category] = [[pygame.mixer.Channel(i), 0, 0] for i in range(first, first + count)]
+			first += count
+		self.play_count = 0
+		self.frame_sounds = set() # Sounds already started this frame - playing the same one twice only makes it louder
+	
+	# reset: Stops every sound, for a new game
+	def reset(self):
+		for pool in self.pools.values():
+			for voice in pool:
+				voice[0].stop()
+				voice[1] = 0
+				voice[2] = 0
+		self.play_count = 0
+		self.frame_sounds.clear()
+	
+	# new_frame: Called once per drawn frame, so the same sound can be played again
+	def new_frame(self):
+		self.frame_sounds.clear()
+	
 	def play_sound(self, sound):
-		self.sounddict[sound].play()
+		if(sound in self.frame_sounds):
+			return
+		self.frame_sounds.add(sound)
+		category, priority = self.sound_categories[sound]
+		voice = self.get_voice(self.pools[category], priority)
+		if(voice is None):
+			return
+		self.play_count += 1
+		voice[0].play(self.sounddict[sound])
+		voice[1] = priority
+		voice[2] = self.play_count
+	
+	# get_voice: A free channel of the pool, or the one to steal - None if everything playing matters more
+	def get_voice(self, pool, priority):
+		stolen = None
+		for voice in pool:
+			if(not voice[0].get_busy()):
+				return voice
+			if(stolen is None or voice[1] < stolen[1] or (voice[1] == stolen[1] and voice[2] < stolen[2])):
+				stolen = voice
+		if(stolen[1] > priority):
+			return None
+		return stolen
 
 class HUDController:
 	def __init__(self):
@@ -3356,22 +3325,13 @@ class HUDController:
 		
 		self.hpbar = load_png("hud", "hp-bar.png")
 		self.hpbar_pos = [12, 12]
-		self.current_hp = 100
-		self.showing_hp = 100
 		self.hp_meter_easing = 0.12
 		self.hp_bar_color = pygame.Color(192, 32, 32, 255)
 		
-		self.lives = 3
 		self.lives_text = "Vidas"
 		self.heart = load_png("hud", "heart.png")
 		
 		self.weapon_icon_pos = [216, 8]
-		self.weapon_icon = load_png("hud", "icon-pistol.png")
-		self.weapon_name = "Pistola 9mm"
-		self.weapon_ammo = 13
-		self.reserve_ammo = 26
-		self.reloading = False
-		self.knife = False
 		self.knife_name = "Faca"
 		self.knife_ammostr = "--/--"
 		self.knife_icon = load_png("hud", "icon-knife.png")
@@ -3379,42 +3339,89 @@ class HUDController:
 		
 		self.syringe = load_png("hud", "syringe.png")
 		self.syringe_pos = [224, 200]
+		
+		self.glyph_rects = dict() # id of a font sheet -> the rect of each character
+		self.text_runs = OrderedDict() # (text, id of the font sheet, spacing) -> the text drawn on its own surface
+		self.max_text_runs = 128
+		# The HUD images only have fully opaque or fully transparent pixels, so the layer can use a color key (which blits
+		# much faster than per-pixel alpha) - a color none of them use
+		self.layer_key = pygame.Color(255, 0, 255)
+		self.layer = pygame.Surface((256, 224)).convert()
+		self.layer.set_colorkey(self.layer_key, pygame.RLEACCEL)
+		self.layer_state = None # See get_layer_state
+		self.reset()
+	
+	# reset: Puts the meters back as they are at the start of a game
+	def reset(self):
+		self.current_hp = 100
+		self.showing_hp = 100
+		self.lives = 3
+		self.weapon_icon = load_png("hud", "icon-pistol.png")
+		self.weapon_name = "Pistola 9mm"
+		self.weapon_ammo = 13
+		self.reserve_ammo = 26
+		self.reloading = False
+		self.knife = False
 		self.syringe_count = 0
+		self.layer_state = None
 	
+	# draw: The HUD is kept drawn on a layer of its own, which is only drawn again when something on it changes
 	def draw(self, dest):
+		state = self.get_layer_state()
+		if(not state == self.layer_state):
+			self.layer_state = state
+			self.redraw_layer()
+		dest.blit(self.layer, (0, 0))
+	
+	# get_layer_state: Everything the layer shows - the layer is up to date while this stays the same
+	def get_layer_state(self):
+		hp_width = -1
+		if(self.showing_hp > 0):
+			hp_width = int(self.showing_hp * 0.71)
+		if(self.knife):
+			icon = self.knife_icon
+			name = self.knife_name
+		else:
+			icon = self.weapon_icon
+			name = self.weapon_name
+		return (hp_width, self.lives, icon, name, self.get_ammo_text(), self.syringe_count)
+	
+	def get_ammo_text(self):
+		if(self.reloading):
+			return self.reload_text
+		elif(self.knife):
+			return self.knife_ammostr
+		return str(self.weapon_ammo) + "/" + str(self.reserve_ammo)
+	
+	def redraw_layer(self):
+		layer = self.layer
+		layer.fill(self.layer_key)
 		# -- Draw the HP meter -- #
-		dest.blit(self.hpbar, (self.hpbar_pos[0], self.hpbar_pos[1]))
+		layer.blit(self.hpbar, (self.hpbar_pos[0], self.hpbar_pos[1]))
 		if(self.showing_hp > 0):
-			pygame.draw.rect(dest, self.hp_bar_color, pygame.Rect(self.hpbar_pos[0] + 18, self.hpbar_pos[1] + 3, int(self.showing_hp * 0.71), 6))
+			pygame.draw.rect(layer, self.hp_bar_color, pygame.Rect(self.hpbar_pos[0] + 18, self.hpbar_pos[1] + 3, int(self.showing_hp * 0.71), 6))
 		
 		# -- Draw the life counter -- #
-		self.draw_text(dest, self.lives_text, self.hpbar_pos[0] + 1, self.hpbar_pos[1] + 13)
+		self.draw_text(layer, self.lives_text, self.hpbar_pos[0] + 1, self.hpbar_pos[1] + 13)
 		for i in range(min(self.lives, 10)):
-			dest.blit(self.heart, (self.hpbar_pos[0] + 5 + len(self.lives_text) * (self.font_2[1] - 1) + i * 9, self.hpbar_pos[1] + 13))
+			layer.blit(self.heart, (self.hpbar_pos[0] + 5 + len(self.lives_text) * (self.font_2[1] - 1) + i * 9, self.hpbar_pos[1] + 13))
 			
 		# -- Draw the weapon icon, name and ammo -- #
 		if(self.knife):
-			dest.blit(self.knife_icon, (self.weapon_icon_pos[0], self.weapon_icon_pos[1]))
-			self.draw_text(dest, self.knife_name, self.weapon_icon_pos[0] - 2 - len(self.knife_name) * (self.font_2[1] - 1), self.weapon_icon_pos[1] + 4)
-		else:
-			dest.blit(self.weapon_icon, (self.weapon_icon_pos[0], self.weapon_icon_pos[1]))
-			self.draw_text(dest, self.weapon_name, self.weapon_icon_pos[0] - 2 - len(self.weapon_name) * (self.font_2[1] - 1), self.weapon_icon_pos[1] + 4)
-		if(self.reloading):
-			ammostr = self.reload_text
-		elif(self.knife):
-			ammostr = self.knife_ammostr
+			layer.blit(self.knife_icon, (self.weapon_icon_pos[0], self.weapon_icon_pos[1]))
+			self.draw_text(layer, self.knife_name, self.weapon_icon_pos[0] - 2 - len(self.knife_name) * (self.font_2[1] - 1), self.weapon_icon_pos[1] + 4)
 		else:
-			ammostr = str(self.weapon_ammo)
-			ammostr += "/"
-			ammostr += str(self.reserve_ammo)
-		self.draw_text(dest, ammostr, self.weapon_icon_pos[0] - 2 - len(ammostr) * (self.font_2[1] - 1), self.weapon_icon_pos[1] + 18)
-		pygame.draw.line(dest, pygame.Color(0, 0, 0, 255), (self.weapon_icon_pos[0] - 2, self.weapon_icon_pos[1] + 14), (self.weapon_icon_pos[0] - 96, self.weapon_icon_pos[1] + 14))
-		pygame.draw.line(dest, pygame.Color(255, 255, 255, 255), (self.weapon_icon_pos[0] - 2, self.weapon_icon_pos[1] + 15), (self.weapon_icon_pos[0] - 96, self.weapon_icon_pos[1] + 15))
-		pygame.draw.line(dest, pygame.Color(0, 0, 0, 255), (self.weapon_icon_pos[0] - 2, self.weapon_icon_pos[1] + 16), (self.weapon_icon_pos[0] - 96, self.weapon_icon_pos[1] + 16))
+			layer.blit(self.weapon_icon, (self.weapon_icon_pos[0], self.weapon_icon_pos[1]))
+			self.draw_text(layer, self.weapon_name, self.weapon_icon_pos[0] - 2 - len(self.weapon_name) * (self.font_2[1] - 1), self.weapon_icon_pos[1] + 4)
+		ammostr = self.get_ammo_text()
+		self.draw_text(layer, ammostr, self.weapon_icon_pos[0] - 2 - len(ammostr) * (self.font_2[1] - 1), self.weapon_icon_pos[1] + 18)
+		pygame.draw.line(layer, pygame.Color(0, 0, 0, 255), (self.weapon_icon_pos[0] - 2, self.weapon_icon_pos[1] + 14), (self.weapon_icon_pos[0] - 96, self.weapon_icon_pos[1] + 14))
+		pygame.draw.line(layer, pygame.Color(255, 255, 255, 255), (self.weapon_icon_pos[0] - 2, self.weapon_icon_pos[1] + 15), (self.weapon_icon_pos[0] - 96, self.weapon_icon_pos[1] + 15))
+		pygame.draw.line(layer, pygame.Color(0, 0, 0, 255), (self.weapon_icon_pos[0] - 2, self.weapon_icon_pos[1] + 16), (self.weapon_icon_pos[0] - 96, self.weapon_icon_pos[1] + 16))
 		
 		# -- Draw the syringe count -- #
-		dest.blit(self.syringe, (self.syringe_pos[0], self.syringe_pos[1]))
-		self.draw_text(dest, str(self.syringe_count), self.syringe_pos[0] + 14, self.syringe_pos[1] + 7)
+		layer.blit(self.syringe, (self.syringe_pos[0], self.syringe_pos[1]))
+		self.draw_text(layer, str(self.syringe_count), self.syringe_pos[0] + 14, self.syringe_pos[1] + 7)
 		
 	
 	def draw_text(self, dest, text, x, y, font = -1, x_spacing = -1):
@@ -3422,12 +3429,41 @@ class HUDController:
 			font = self.font_2
 		if(x_spacing == -1):
 			x_spacing = font[1] - 1
+		dest.blit(self.get_text_run(text, font, x_spacing), (x, y))
+	
+	# get_text_run: The text drawn on a surface of its own, so text that doesn't change costs a single blit. The runs
+	# are kept until max_text_runs others have been used after them. (The fonts only have fully opaque or fully
+	# transparent pixels, so drawing a run looks the same as drawing its characters one by one)
+	def get_text_run(self, text, font, x_spacing):
+		key = (text, id(font[0]), x_spacing)
+		run = self.text_runs.get(key)
+		if(run is not None):
+			self.text_runs.move_to_end(key)
+			return run
+		glyphs = self.get_glyph_rects(font)
+		width = 0
+		if(text):
+			width = (len(text) - 1) * x_spacing + font[1]
+		run = pygame.Surface((width, font[2]), pygame.SRCALPHA).convert_alpha()
+		run.fill(pygame.Color(0, 0, 0, 0))
 		for i in range(len(text)):
 			char_index = ord(text[i])
-			char_x = char_index % 32
-			char_y = char_index // 32
-			char_rect = pygame.Rect(char_x * font[1], char_y * font[2], font[1], font[2])
-			dest.blit(font[0], (x + i * x_spacing, y), char_rect)
+			if(char_index < len(glyphs)): # Characters past the end of the font sheet are left blank
+				run.blit(font[0], (i * x_spacing, 0), glyphs[char_index])
+		self.text_runs[key] = run
+		if(len(self.text_runs) > self.max_text_runs):
+			self.text_runs.popitem(last=False)
+		return run
+	
+	# get_glyph_rects: Where each character is in the font sheet (32 per row)
+	def get_glyph_rects(self, font):
+		glyphs = self.glyph_rects.get(id(font[0]))
+		if(glyphs is None):
+			glyphs = []
+			for char_index in range(32 * (font[0].get_height() // font[2])):
+				glyphs.append(pygame.Rect((char_index % 32) * font[1], (char_index // 32) * font[2], font[1], font[2]))
+			self.glyph_rects[id(font[0])] = glyphs
+		return glyphs
 	
 	def update(self, player):
 		self.current_hp = max(0, player.health)
@@ -3520,6 +3556,7 @@ class AnimTextElement(HUDElement):
 		self.char_delay = 0
 		self.char_state = 0
 		self.triggered = False
+		self.drawn = None # The text and anim_state last drawn on the image, so it is only drawn again when they change
 	
 	def trigger(self):
 		self.triggered = True
@@ -3535,9 +3572,9 @@ class AnimTextElement(HUDElement):
 						self.char_state = self.char_delay
 					else:
 						self.char_state -= 1
-		if(self.anim_state > 0):
-			#print(self.anim_state)
+		if(self.anim_state > 0 and not self.drawn == (self.text, self.anim_state)):
 			hud_con.draw_text(self.image, self.text[0:self.anim_state], 0, 0)
+			self.drawn = (self.text, self.anim_state)
 
 class TextBox(AnimTextElement):
 	def __init__(self, columns):
@@ -3558,8 +3595,8 @@ class TextBox(AnimTextElement):
 						self.char_state = self.char_delay
 					else:
 						self.char_state -= 1
-		if(self.anim_state > 0):
-			#print(self.anim_state)
+		if(self.anim_state > 0 and not self.drawn == (self.text, self.anim_state)):
+			self.drawn = (self.text, self.anim_state)
 			chars = self.anim_state
 			pos = 0
 			line = 0
@@ -3586,27 +3623,27 @@ def compute_direction(velocity):
 		else:
 			return -1
 
-def int_dither(value):
+def int_dither(value, rng = random):
 	intvalue = int(value)
 	if(intvalue == value):
 		return intvalue
 	else:
-		if(random.random() < (value - intvalue)):
+		if(rng.random() < (value - intvalue)):
 			return intvalue + 1
 		else:
 			return intvalue
 
-def get_scroll_amount(player, tilemap):
-	playerpos = player.animations.get_position()[1]
-	#print(playerpos, tilemap.scroll_position)
-	if(playerpos < 120 and tilemap.scroll_position > 0):
-		if(tilemap.scroll_position > playerpos - 120):
+def get_scroll_amount(player, camera, rng = random, ticks = 1):
+	playerpos = camera.get_screen_y(player.animations.get_position()[1])
+	#print(playerpos, camera.scroll_position)
+	if(playerpos < 120 and camera.scroll_position > 0):
+		if(camera.scroll_position > playerpos - 120):
 			if(abs(playerpos - 120) < 2):
 				return int((-(playerpos - 120)))
 			else:
-				return min(max(1, int_dither(-(playerpos - 120) / 10)), 3)
+				return int_dither(min(max(1, -(playerpos - 120) / 10), 3) * ticks, rng) # 1 to 3 pixels per tick
 		else:
-			return int(tilemap.scroll_position)
+			return int(camera.scroll_position)
 	else:
 		return 0
 
@@ -3668,6 +3705,9 @@ class MusicController:
 		self.musicdb["final-boss"] = os.path.join("sound", "music", "final-boss.ogg")
 		self.musicdb["game-over"] = os.path.join("sound", "music", "game-over.ogg")
 		self.musicdb["ending"] = os.path.join("sound", "music", "ending.ogg")
+		self.reset()
+	
+	def reset(self):
 		self.fade_time = 0
 		self.fade_currenttime = 0
 		self.fading = False
@@ -3696,10 +3736,78 @@ class MusicController:
 		else:
 			pygame.mixer.music.set_volume(self.fade_currenttime / self.fade_time)
 
-def title_loop(clock, window, imgbuffer, sound_con, music_con):
+# PauseMenu: The pause screen, opened and closed with Escape. It only changes through the keys it is given, so the
+# headless mode and replays go through it the same way as the game
+class PauseMenu:
+	def __init__(self):
+		self.dark_screen = load_png("hud", "dark_pattern.png")
+		self.banner = load_png("hud", "pause.png")
+		self.cursor_image = load_png("hud", "cursor.png")
+		self.reset()
+
+	def reset(self):
+		self.paused = False
+		self.pressed = False
+		self.cursor = 0
+
+	def update(self, keys):
+		if keys[pygame.K_ESCAPE]:
+			if not self.pressed:
+				self.pressed = True
+				if self.paused:
+					self.paused = False
+					self.cursor = 0
+				else:
+					self.paused = True
+		else:
+			if self.pressed:
+				self.pressed = False
+		if self.paused:
+			if keys[pygame.K_DOWN]:
+				if self.cursor < 1:
+					self.cursor += 1
+			elif keys[pygame.K_UP]:
+				if self.cursor > 0:
+					self.cursor -= 1
+			if keys[pygame.K_RETURN]:
+				if self.cursor == 0:
+					self.paused = False
+				elif self.cursor == 1:
+					raise ExitedGame()
+
+	def draw(self, dest, hud_con):
+		if(self.paused):
+			dest.blit(self.dark_screen, (0, 0))
+			dest.blit(self.banner, (48, 60))
+			hud_con.draw_text(dest, "Continuar", 96, 112)
+			hud_con.draw_text(dest, "Sair do jogo", 96, 124)
+			dest.blit(self.cursor_image, (87, 113 + self.cursor * 12))
+
+# ResourceManager: What is slow to build and doesn't change between games - the controllers holding the decoded
+# sounds, fonts and HUD images, and the player - kept for the whole session. A new game only resets their state
+# (the sprites themselves are shared through image_cache and get_sprite_sheet)
+class ResourceManager:
+	def __init__(self):
+		self.sound_con = SoundController()
+		self.hud_con = HUDController()
+		self.music_con = MusicController()
+		self.player = None
+	
+	# new_game: Resets everything for a new game and returns the player
+	def new_game(self, rng):
+		if(self.player is None):
+			self.player = Player(rng)
+		else:
+			self.player.reset(rng)
+		self.sound_con.reset()
+		self.hud_con.reset()
+		self.music_con.reset()
+		return self.player
+
+def title_loop(clock, window, imgbuffer, sound_con, hud_con, music_con):
 	trans = Transition("transition-2.png", False, True, 0.5)
 	trans2 = Transition("transition-2f.png", False, False, 0.5)
-	text = HUDController()
+	text = hud_con
 	backdrop = load_png("hud", "title-backdrop.png")
 	backdrop_pos = [0.0, 0.0]
 	backdrop_delta = [0.5, 0.2]
@@ -3791,7 +3899,478 @@ def title_loop(clock, window, imgbuffer, sound_con, music_con):
 				sys.exit()
 
 
+def get_stage_data():
+	stage_data = dict()
+	stage_data["tileset"] = ["tilemap-1.png", "tilemap-2.png", "tilemap-3.png", "tilemap-4.png"]
+	stage_data["tilemap"] = ["map-1.hmf", "map-2.hmf", "map-3.hmf", "map-4.hmf"]
+	stage_data["uppermap"] = ["uppermap-1.hmf", "uppermap-2.hmf", "uppermap-3.hmf", "uppermap-4.hmf"]
+	stage_data["enemies"] = ["enemies-1.dat", "enemies-2.dat", "enemies-3.dat", "enemies-4.dat"]
+	stage_data["items"] = ["items-1.dat", "items-2.dat", "items-3.dat", "items-4.dat"]
+	stage_data["music"] = ["level-1", "level-2", "level-3", "level-4-1"]
+	stage_data["boss-music"] = ["boss-battle", "boss-battle", "boss-battle", "final-boss"]
+	stage_data["banner"] = ["stage-1.png", "stage-2.png", "stage-3.png", "stage-4.png"]
+	stage_data["name"] = ["Forte Carcerário", "Campo", "Floresta", "Base Militar"]
+	return stage_data
+
+# FrameProfiler: Adds up the time spent in named scopes during each frame. Keeps the last frames of every scope for
+# the overlay (mean and 99th percentile), and can write every frame to a CSV file. Does nothing while disabled.
+class FrameProfiler:
+	def __init__(self, history = 120):
+		self.enabled = False
+		self.overlay = False
+		self.history = history
+		self.timings = OrderedDict() # Scope name -> times of the last frames, in ms
+		self.frame_timings = OrderedDict()
+		self.starts = dict()
+		self.frame = 0
+		self.csv_file = None
+	
+	def open_csv(self, filename):
+		self.csv_file = open(filename, "w")
+		self.csv_file.write("frame,scope,ms\n")
+		self.enabled = True
+	
+	def close(self):
+		if(self.csv_file):
+			self.csv_file.close()
+			self.csv_file = None
+		self.enabled = self.overlay
+	
+	def toggle_overlay(self):
+		self.overlay = not self.overlay
+		self.enabled = self.overlay or self.csv_file is not None
+	
+	def begin(self, name):
+		if(self.enabled):
+			self.starts[name] = time.perf_counter()
+	
+	def end(self, name):
+		if(self.enabled and name in self.starts):
+			elapsed = (time.perf_counter() - self.starts.pop(name)) * 1000
+			self.frame_timings[name] = self.frame_timings.get(name, 0) + elapsed
+	
+	def end_frame(self):
+		if(not self.enabled):
+			return
+		for name in self.frame_timings:
+			if(not name in self.timings):
+				self.timings[name] = deque(maxlen=self.history)
+			self.timings[name].append(self.frame_timings[name])
+			if(self.csv_file):
+				self.csv_file.write(str(self.frame) + "," + name + "," + str(round(self.frame_timings[name], 4)) + "\n")
+		self.frame_timings.clear()
+		self.frame += 1
+	
+	def get_stats(self, name):
+		values = sorted(self.timings[name])
+		return (sum(values) / len(values), values[min(len(values) - 1, int(len(values) * 0.99))])
+	
+	def draw(self, dest, hud_con):
+		if(not self.overlay):
+			return
+		pygame.draw.rect(dest, pygame.Color(0, 0, 0), pygame.Rect(0, 0, 256, 14 + len(self.timings) * 10))
+		hud_con.draw_text(dest, "scope".ljust(24) + "  mean   p99", 2, 2)
+		y = 12
+		for name in self.timings:
+			mean, p99 = self.get_stats(name)
+			hud_con.draw_text(dest, name[:24].ljust(24) + ("%6.2f" % mean) + ("%6.2f" % p99), 2, y)
+			y += 10
+
+# FixedTimestep: Turns the time between rendered frames into a whole number of simulation steps of a fixed length.
+# What is left over carries on to the next frame, and no frame runs more than max_steps steps - after a long
+# hitch the game slows down for a moment instead of freezing while it catches up
+class FixedTimestep:
+	def __init__(self, rate = 60, max_steps = 5):
+		self.rate = rate
+		self.step = 1 / rate
+		self.max_steps = max_steps
+		self.accumulator = 0.0
+		self.dropped_steps = 0
+	
+	def advance(self, delta_time):
+		self.accumulator += delta_time
+		steps = 0
+		while(self.accumulator >= self.step):
+			self.accumulator -= self.step
+			steps += 1
+		if(steps > self.max_steps):
+			self.dropped_steps += steps - self.max_steps
+			steps = self.max_steps
+		return steps
+
+# StageLayers: The parts of a stage that take a while to build - its data files, parsed, and the tile layers, rendered
+class StageLayers:
+	def __init__(self, i, stage_data):
+		bundle = load_stage_bundle(stage_data, i)
+		self.tilemap = TilemapHandler(stage_data["tileset"][i], bundle.tilemap, bundle.collision_map)
+		self.uppermap = TilemapHandler(stage_data["tileset"][i], bundle.uppermap, bundle.collision_map, self.tilemap.camera, True)
+		self.enemies = bundle.enemies
+		self.items = bundle.items
+		self.banner = load_png("hud", stage_data["banner"][i])
+
+# StagePreloader: Builds the StageLayers of a stage on a worker thread. The stage before it starts one when its ending
+# begins, so the next stage is usually ready by the time the transition is over
+class StagePreloader:
+	def __init__(self, i, stage_data):
+		self.i = i
+		self.layers = None
+		self.error = None
+		self.thread = threading.Thread(target=self.run, args=(stage_data,), daemon=True)
+		self.thread.start()
+	
+	def run(self, stage_data):
+		try:
+			self.layers = StageLayers(self.i, stage_data)
+		except Exception as e: # Handed to the main thread by get
+			self.error = e
+	
+	# get: Waits for the layers if they aren't done yet
+	def get(self):
+		self.thread.join()
+		if(self.error is not None):
+			raise self.error
+		return self.layers
+
+# get_preloaded_layers: The layers of stage i if the previous stage loaded them already, or None
+def get_preloaded_layers(stage, i):
+	if(stage is None or stage.preloader is None or not stage.preloader.i == i):
+		return None
+	return stage.preloader.get()
+
+# Stage: One stage being played. update() takes the time since the last rendered frame and runs as many fixed
+# steps of the simulation as fit in it (see FixedTimestep)
+class Stage:
+	def __init__(self, i, stage_data, player, sound_con, hud_con, music_con, array_bullets = False, profiler = None, sim_rate = 60, max_steps = 5, layers = None):
+		self.i = i
+		if(profiler is None):
+			profiler = FrameProfiler()
+		self.profiler = profiler
+		self.timestep = FixedTimestep(sim_rate, max_steps)
+		self.stage_data = stage_data
+		self.player = player
+		self.sound_con = sound_con
+		self.hud_con = hud_con
+		self.music_con = music_con
+		self.boss = False
+		self.ending = False
+		self.end_timeout = 0.8
+		self.scroll_lock = False
+		if(layers is None):
+			layers = StageLayers(i, stage_data)
+		self.preloader = None # The next stage, once this one is ending
+		self.tilemap = layers.tilemap
+		self.camera = self.tilemap.camera
+		self.uppermap = layers.uppermap
+		if(array_bullets):
+			self.bullet_con = ArrayBulletController(self.camera)
+		else:
+			self.bullet_con = BulletController(self.camera)
+		self.rng = player.rng
+		self.particle_con = ParticleController(self.camera, self.rng)
+		self.enemy_con = EnemyController(layers.enemies, self.camera, self.rng)
+		#self.item_con = ItemController(self.camera) #TODO: Debugging only - uncomment this and remove line below
+		self.item_con = ItemController(self.camera, layers.items)
+		self.banner = ArbitraryBannerLeft()
+		self.banner.image = layers.banner
+		self.text = ArbitraryBannerRight()
+		surf = pygame.Surface((224, 64)).convert_alpha()
+		surf.fill(pygame.Color(0, 0, 0, 0))
+		self.text.image = surf
+		hud_con.draw_text(self.text.image, stage_data["name"][i], 75, 44)
+		self.banner.trigger()
+		self.text.trigger()
+		player.set_camera(self.camera)
+		player.moveto(112, self.camera.scroll_position + 40)
+		self.trans = Transition("transition-2.png", False, True, 0.3)
+		self.trans2 = Transition("transition-2f.png", False, False, 0.55)
+		music_con.play_song(stage_data["music"][i])
+	
+	def update(self, delta_time):
+		self.sound_con.new_frame()
+		for i in range(self.timestep.advance(delta_time)):
+			self.step(self.timestep.step)
+			if(self.is_over()):
+				break
+		self.profiler.begin("hud_con.update")
+		self.hud_con.update(self.player) # Only eases the meters towards their values, so it goes with the frames
+		self.profiler.end("hud_con.update")
+	
+	def step(self, delta_time):
+		alice = self.player
+		sound_con = self.sound_con
+		profiler = self.profiler
+		if(self.ending):
+			self.end_timeout -= delta_time
+			if not(self.trans2.has_completed()):
+				self.trans2.update(delta_time)
+		if(not self.trans.has_completed()):
+			self.trans.update(delta_time)
+		if(self.banner.moving):
+			self.banner.update(delta_time)
+		if(self.text.moving):
+			self.text.update(delta_time)
+		self.tilemap.clear_sight_cache()
+		profiler.begin("enemy_con.update_all")
+		self.enemy_con.update_all(delta_time, self.bullet_con, self.tilemap, alice, self.item_con, self.particle_con, sound_con)
+		profiler.end("enemy_con.update_all")
+		profiler.begin("item_con.update_all")
+		self.item_con.update_all(delta_time)
+		profiler.end("item_con.update_all")
+		profiler.begin("bullet_con.update_all")
+		self.bullet_con.update_all(delta_time, self.tilemap, sound_con)
+		profiler.end("bullet_con.update_all")
+		profiler.begin("particle_con.update_all")
+		self.particle_con.update_all(delta_time)
+		profiler.end("particle_con.update_all")
+		profiler.begin("alice.update")
+		alice.update(delta_time, self.tilemap, self.bullet_con, self.particle_con, self.enemy_con, sound_con)
+		alice.shoot_ifbuttonpressed(self.bullet_con, self.particle_con, sound_con)
+		alice.reload_ifbuttonpressed(sound_con)
+		alice.change_weapon_ifbuttonpressed()
+		alice.use_syringe_ifbuttonpressed(sound_con)
+		self.item_con.check_collision(alice.get_coll_hitbox(), alice, sound_con)
+		profiler.end("alice.update")
+		profiler.begin("scroll")
+		if(not self.scroll_lock):
+			if(self.enemy_con.count_enemies_onscreen() >= 4):
+				self.scroll_lock = True
+		else:
+			if(self.enemy_con.count_enemies_onscreen() == 0):
+				self.scroll_lock = False
+		if(not self.scroll_lock):
+			scroll = get_scroll_amount(alice, self.camera, self.rng.scroll, delta_time * TICKS_PER_SECOND)
+		else:
+			scroll = 0
+		if(scroll > 0):
+			self.camera.scroll(scroll)
+		profiler.end("scroll")
+	
+	# update_progress: Switches to the boss music, and starts the ending (and the loading of the next stage) once the boss is down - runs after drawing
+	def update_progress(self):
+		if not self.boss:
+			if(self.enemy_con.boss_battle):
+				self.music_con.play_song(self.stage_data["boss-music"][self.i])
+				self.boss = True
+		if(self.enemy_con.check_boss_killed()):
+			self.ending = True
+		if(self.ending and self.preloader is None and self.i + 1 < len(self.stage_data["tilemap"])):
+			self.preloader = StagePreloader(self.i + 1, self.stage_data)
+	
+	def is_over(self):
+		return not self.end_timeout > 0
+	
+	def draw(self, dest):
+		profiler = self.profiler
+		dest.fill((0, 0, 0)) # fill the buffer with black pixels
+		profiler.begin("tilemap.draw_ground")
+		self.tilemap.draw_ground(dest) # draw the ground tile layer
+		profiler.end("tilemap.draw_ground")
+		profiler.begin("item_con.draw_all")
+		self.item_con.draw_all(dest)
+		profiler.end("item_con.draw_all")
+		profiler.begin("enemy_con.draw_all")
+		self.enemy_con.draw_all(dest)
+		profiler.end("enemy_con.draw_all")
+		profiler.begin("alice.draw")
+		self.player.draw(dest) # draw the character
+		profiler.end("alice.draw")
+		profiler.begin("particle_con.draw_all")
+		self.particle_con.draw_all(dest)
+		profiler.end("particle_con.draw_all")
+		profiler.begin("bullet_con.draw_all")
+		self.bullet_con.draw_all(dest)
+		profiler.end("bullet_con.draw_all")
+		profiler.begin("uppermap.draw_ground")
+		self.uppermap.draw_ground(dest)
+		profiler.end("uppermap.draw_ground")
+		profiler.begin("hud_con.draw")
+		self.hud_con.draw(dest)
+		profiler.end("hud_con.draw")
+	
+	# draw_transitions: The stage banners and screen transitions, drawn over everything else (including the pause screen)
+	def draw_transitions(self, dest):
+		if(self.banner.moving):
+			self.banner.draw(dest)
+		if(self.text.moving):
+			self.text.draw(dest)
+		if(not self.trans.has_completed()):
+			self.trans.draw(dest)
+		if(self.ending):
+			self.trans2.draw(dest)
+
+# get_option: Value of a "--name=value" command line option, or default when it isn't given
+def get_option(name, default):
+	for i in sys.argv:
+		if i.startswith(name + "="):
+			return i[len(name) + 1:]
+	return default
+
+# get_seed: The --seed=N option, or None for a random seed
+def get_seed():
+	seed = get_option("--seed", "")
+	if(seed):
+		return int(seed)
+	return None
+
+# get_sim_rate: The --sim-rate=N option - how many simulation steps run per second, 60 by default
+def get_sim_rate():
+	return check_sim_rate(int(get_option("--sim-rate", str(TICKS_PER_SECOND))), "--sim-rate")
+
+# check_sim_rate: The rate if it can be used (at least one step per second), or the default one
+def check_sim_rate(sim_rate, source):
+	if(sim_rate < 1):
+		print(source, "needs to be at least 1, falling back to", TICKS_PER_SECOND)
+		return TICKS_PER_SECOND
+	return sim_rate
+
+# get_cheats: Whether -IDDQD was given, and the stage it skips to with -L2, -L3 or -L4
+def get_cheats():
+	iddqd = False
+	l_skip = 1
+	for i in sys.argv:
+		if i == "-IDDQD":
+			iddqd = True
+			print("Come get some.")
+		elif i == "-L2" and iddqd:
+			l_skip = 2
+		elif i == "-L3" and iddqd:
+			l_skip = 3
+		elif i == "-L4" and iddqd:
+			l_skip = 4
+	return iddqd, l_skip
+
+# get_array_bullets: Whether --array-bullets was given and can be used
+def get_array_bullets(wanted):
+	if not wanted:
+		return False
+	if numpy is None:
+		print("--array-bullets needs NumPy, falling back to the regular bullet controller")
+		return False
+	return True
+
+# get_replay_flags: The flags a ReplayWriter stores for these options
+def get_replay_flags(iddqd, array_bullets):
+	flags = 0
+	if(iddqd):
+		flags |= REPLAY_IDDQD
+	if(array_bullets):
+		flags |= REPLAY_ARRAY_BULLETS
+	return flags
+
+# run_headless: Runs the game loop without a window, title screen or frame cap, with a fixed delta_time and
+# scripted input, starting from a chosen stage and going on until the frame count runs out or the game ends.
+# With --replay=FILE, the seed, starting stage, options, keys and delta_time all come from a recorded run instead
+def run_headless():
+	os.environ["SDL_VIDEODRIVER"] = "dummy"
+	os.environ["SDL_AUDIODRIVER"] = "dummy"
+	pygame.mixer.pre_init(44100, -16, 2, 4096)
+	pygame.init()
+	pygame.mixer.init()
+	pygame.display.set_mode((256, 224)) # never shown, but needed to convert the images
+	imgbuffer = pygame.Surface((256, 224))
+	replay = None
+	if(get_option("--replay", "")):
+		replay = Replay(get_option("--replay", ""))
+		frames = replay.frames
+		first_stage = replay.first_stage
+		iddqd = replay.iddqd
+		array_bullets = get_array_bullets(replay.array_bullets)
+		sim_rate = check_sim_rate(replay.sim_rate, "The replay's simulation rate")
+		input_con = ReplayInputController(replay)
+		rng = RandomStreams(replay.seed)
+	else:
+		frames = int(get_option("--frames", "3600"))
+		first_stage = int(get_option("--stage", "1"))
+		iddqd = get_cheats()[0]
+		array_bullets = get_array_bullets("--array-bullets" in sys.argv)
+		script = get_option("--script", "")
+		if(script):
+			input_con = ScriptedInputController(load_input_script(script))
+		else:
+			input_con = ScriptedInputController(default_input_script)
+		sim_rate = get_sim_rate()
+		rng = RandomStreams(get_seed())
+	delta_time = 1 / float(get_option("--fps", "60"))
+	random.seed(rng.seed)
+	print("Seed:", rng.seed)
+	resources = ResourceManager()
+	alice = resources.new_game(rng)
+	alice.set_input(input_con)
+	sound_con = resources.sound_con
+	hud_con = resources.hud_con
+	music_con = resources.music_con
+	stage_data = get_stage_data()
+	pause_menu = PauseMenu()
+	profiler = FrameProfiler()
+	if(get_option("--profile-csv", "")):
+		profiler.open_csv(get_option("--profile-csv", ""))
+	recorder = None
+	if(get_option("--record", "")):
+		recorder = ReplayWriter(get_option("--record", ""), rng.seed, first_stage, get_replay_flags(iddqd, array_bullets), sim_rate)
+	frame = 0
+	stage = None
+	if(replay is not None):
+		result = "end of replay"
+	else:
+		result = "out of frames"
+	start_time = time.perf_counter()
+	try:
+		for i in range(4):
+			if i > 0:
+				alice.weapons.add_weapon(i)
+			if i + 1 < first_stage:
+				continue
+			pause_menu.reset()
+			layers = get_preloaded_layers(stage, i)
+			stage = Stage(i, stage_data, alice, sound_con, hud_con, music_con, array_bullets, profiler, sim_rate, sim_rate, layers) # Nothing to catch up with here, so never drop steps
+			while(not stage.is_over() and frame < frames):
+				profiler.begin("frame")
+				input_con.update()
+				if(replay is not None):
+					delta_time = input_con.delta_time
+				if(recorder is not None):
+					recorder.write_frame(delta_time, input_con.get_pressed())
+				if not pause_menu.paused:
+					stage.update(delta_time)
+				keys = input_con.get_pressed()
+				pause_menu.update(keys)
+				stage.draw(imgbuffer)
+				pause_menu.draw(imgbuffer, hud_con)
+				stage.draw_transitions(imgbuffer)
+				stage.update_progress()
+				if(iddqd and keys[pygame.K_p]):
+					stage.ending = True
+				profiler.end("frame")
+				profiler.end_frame()
+				if(alice.dead and (not alice.lives > 0)):
+					raise GameOver()
+				frame += 1
+			print("Stage", i + 1, "-", frame, "frames so far")
+			if(frame >= frames):
+				break
+		else:
+			result = "game finished"
+	except GameOver:
+		result = "game over"
+	except ExitedGame:
+		result = "exited from the pause menu"
+	elapsed = time.perf_counter() - start_time
+	print("Headless run:", frame, "frames in", round(elapsed, 3), "s (" + str(round(frame / max(elapsed, 1e-9), 1)) + " frames/s) -", result)
+	if(stage is not None): # Compare these between runs to check that a replay played out the same way
+		position = alice.animations.get_position()
+		print("Final state: stage", stage.i + 1, "- player at", [round(position[0], 3), round(position[1], 3)], "health", alice.health, "lives", alice.lives, "- scroll", round(stage.camera.scroll_position, 3), "-", len(stage.enemy_con.enemies), "enemies")
+	if(recorder is not None):
+		recorder.close()
+	profiler.close()
+	pygame.quit()
+
 def main():
+	if "--compile-data" in sys.argv:
+		compile_data()
+		return
+	if "--headless" in sys.argv:
+		run_headless()
+		return
 	pygame.mixer.pre_init(44100, -16, 2, 4096)
 	pygame.init() # initialize pygame
 	pygame.mixer.init()
@@ -3799,43 +4378,51 @@ def main():
 	window = pygame.display.set_mode((768, 672)) # create our window
 	pygame.display.set_caption("Alice no País de Bolsotaurus")
 	imgbuffer = pygame.Surface((256, 224)) # this is where we are going to draw the graphics
-	dark_screen = load_png("hud", "dark_pattern.png")
-	pause_banner = load_png("hud", "pause.png")
-	cursor = load_png("hud", "cursor.png")
+	pause_menu = PauseMenu()
+	profiler = FrameProfiler()
+	if(get_option("--profile-csv", "")):
+		profiler.open_csv(get_option("--profile-csv", ""))
+	profiler_pressed = False
+	record_file = get_option("--record", "") # Only the first game is recorded
+	replay = None
+	if(get_option("--replay", "")):
+		replay = Replay(get_option("--replay", ""))
+	resources = ResourceManager()
 	while(True):
-		alice = Player()
-		sound_con = SoundController()
-		hud_con = HUDController()
-		music_con = MusicController()
-		scroll_lock = False
-		random.seed()
+		if(replay is not None):
+			rng = RandomStreams(replay.seed)
+		else:
+			rng = RandomStreams(get_seed())
+		random.seed(rng.seed)
+		alice = resources.new_game(rng)
+		sound_con = resources.sound_con
+		hud_con = resources.hud_con
+		music_con = resources.music_con
+		if(replay is not None):
+			input_con = ReplayInputController(replay)
+		else:
+			input_con = InputController()
+		alice.set_input(input_con)
 		# Cheats #
-		iddqd = False
-		l_skip = 1
-		for i in sys.argv:
-			if i == "-IDDQD":
-				iddqd = True
-				print("Come get some.")
-			elif i == "-L2" and iddqd:
-				l_skip = 2
-			elif i == "-L3" and iddqd:
-				l_skip = 3
-			elif i == "-L4" and iddqd:
-				l_skip = 4
-	
-		title_loop(clock, window, imgbuffer, sound_con, music_con)
+		iddqd, l_skip = get_cheats()
+		# Options #
+		array_bullets = get_array_bullets("--array-bullets" in sys.argv)
+		sim_rate = get_sim_rate()
+		if(replay is not None): # The replay brings its own
+			iddqd = replay.iddqd
+			l_skip = replay.first_stage
+			array_bullets = get_array_bullets(replay.array_bullets)
+			sim_rate = check_sim_rate(replay.sim_rate, "The replay's simulation rate")
+		else:
+			title_loop(clock, window, imgbuffer, sound_con, hud_con, music_con)
 		
+		recorder = None
+		if(record_file):
+			recorder = ReplayWriter(record_file, rng.seed, l_skip, get_replay_flags(iddqd, array_bullets), sim_rate)
+			record_file = ""
 		# ------ #
-		stage_data = dict()
-		stage_data["tileset"] = ["tilemap-1.png", "tilemap-2.png", "tilemap-3.png", "tilemap-4.png"]
-		stage_data["tilemap"] = ["map-1.hmf", "map-2.hmf", "map-3.hmf", "map-4.hmf"]
-		stage_data["uppermap"] = ["uppermap-1.hmf", "uppermap-2.hmf", "uppermap-3.hmf", "uppermap-4.hmf"]
-		stage_data["enemies"] = ["enemies-1.dat", "enemies-2.dat", "enemies-3.dat", "enemies-4.dat"]
-		stage_data["items"] = ["items-1.dat", "items-2.dat", "items-3.dat", "items-4.dat"]
-		stage_data["music"] = ["level-1", "level-2", "level-3", "level-4-1"]
-		stage_data["boss-music"] = ["boss-battle", "boss-battle", "boss-battle", "final-boss"]
-		stage_data["banner"] = ["stage-1.png", "stage-2.png", "stage-3.png", "stage-4.png"]
-		stage_data["name"] = ["Forte Carcerário", "Campo", "Floresta", "Base Militar"]
+		stage_data = get_stage_data()
+		stage = None
 		# -- Stage loop -- #
 		try:
 			for i in range(4):
@@ -3843,138 +4430,50 @@ def main():
 					alice.weapons.add_weapon(i)
 				if i + 1 < l_skip:
 					continue
-				boss = False
-				ending = False
-				end_timeout = 0.8
-				paused = False
-				pause_pressed = False
-				pause_cur = 0
-				bullet_con = BulletController()
-				particle_con = ParticleController()
-				tilemap = TilemapHandler(stage_data["tileset"][i], stage_data["tilemap"][i], "tileset_collision.hmf")
-				uppermap = TilemapHandler(stage_data["tileset"][i], stage_data["uppermap"][i], "tileset_collision.hmf")
-				enemy_con = EnemyController(stage_data["enemies"][i], tilemap.scroll_position)
-				#item_con = ItemController() #TODO: Debugging only - uncomment this and remove line below
-				item_con = ItemController(stage_data["items"][i], tilemap.scroll_position)
-				banner = ArbitraryBannerLeft()
-				banner.image = load_png("hud", stage_data["banner"][i])
-				text = ArbitraryBannerRight()
-				surf = pygame.Surface((224, 64)).convert_alpha()
-				surf.fill(pygame.Color(0, 0, 0, 0))
-				text.image = surf
-				hud_con.draw_text(text.image, stage_data["name"][i], 75, 44)
-				banner.trigger()
-				text.trigger()
-				alice.moveto(112, 40)
-				trans = Transition("transition-2.png", False, True, 0.3)
-				trans2 = Transition("transition-2f.png", False, False, 0.55)
-				music_con.play_song(stage_data["music"][i])
+				pause_menu.reset()
+				layers = get_preloaded_layers(stage, i)
+				stage = Stage(i, stage_data, alice, sound_con, hud_con, music_con, array_bullets, profiler, sim_rate, layers = layers)
 		
 				# -- Main loop -- #
 				try:
-					while(end_timeout > 0):
+					while(not stage.is_over()):
 						# Update
 						delta_time = clock.tick(60) / 1000.0 # grab the time passed since last frame
-						if not paused:
-							if(ending):
-								end_timeout -= delta_time
-								if not(trans2.has_completed()):
-									trans2.update(delta_time)
-							if(not trans.has_completed()):
-								trans.update(delta_time)
-							if(banner.moving):
-								banner.update(delta_time)
-							if(text.moving):
-								text.update(delta_time)
-							enemy_con.update_all(delta_time, bullet_con, tilemap, alice, item_con, particle_con, sound_con)
-							item_con.update_all(delta_time)
-							bullet_con.update_all(delta_time, tilemap, sound_con)
-							particle_con.update_all(delta_time)
-							alice.update(delta_time, tilemap, bullet_con, particle_con, enemy_con, sound_con)
-							alice.shoot_ifbuttonpressed(bullet_con, particle_con, sound_con)
-							alice.reload_ifbuttonpressed(sound_con)
-							alice.change_weapon_ifbuttonpressed()
-							alice.use_syringe_ifbuttonpressed(sound_con)
-							item_con.check_collision(alice.get_coll_hitbox(), alice, sound_con)
-							hud_con.update(alice)
-							if(not scroll_lock):
-								if(enemy_con.count_enemies_onscreen() >= 4):
-									scroll_lock = True
-							else:
-								if(enemy_con.count_enemies_onscreen() == 0):
-									scroll_lock = False
-							if(not scroll_lock):
-								scroll = get_scroll_amount(alice, tilemap)
-							else:
-								scroll = 0
-							if(scroll > 0):
-								bullet_con.scroll(scroll)
-								alice.scroll(scroll)
-								tilemap.scroll(scroll)
-								uppermap.scroll(scroll)
-								enemy_con.scroll_all(scroll)
-								item_con.scroll_all(scroll)
-								particle_con.scroll_all(scroll)
-						keys = pygame.key.get_pressed()
-						if keys[pygame.K_ESCAPE]:
-							if not pause_pressed:
-								pause_pressed = True
-								if paused:
-									paused = False
-									pause_cur = 0
-								else:
-									paused = True
+						profiler.begin("frame")
+						input_con.update()
+						if(replay is not None):
+							if(input_con.finished):
+								raise ExitedGame()
+							delta_time = input_con.delta_time
+						if(recorder is not None):
+							recorder.write_frame(delta_time, input_con.get_pressed())
+						if not pause_menu.paused:
+							stage.update(delta_time)
+						keys = input_con.get_pressed()
+						if pygame.key.get_pressed()[pygame.K_F3]: # Timing overlay
+							if not profiler_pressed:
+								profiler_pressed = True
+								profiler.toggle_overlay()
 						else:
-							if pause_pressed:
-								pause_pressed = False
-						if paused:
-							if keys[pygame.K_DOWN]:
-								if pause_cur < 1:
-									pause_cur += 1
-							elif keys[pygame.K_UP]:
-								if pause_cur > 0:
-									pause_cur -= 1
-							if keys[pygame.K_RETURN]:
-								if pause_cur == 0:
-									paused = False
-								elif pause_cur == 1:
-									raise ExitedGame()
+							profiler_pressed = False
+						pause_menu.update(keys)
 						# Draw
-						imgbuffer.fill((0, 0, 0)) # fill the buffer with black pixels
-						tilemap.draw_ground(imgbuffer) # draw the ground tile layer
-						item_con.draw_all(imgbuffer)
-						enemy_con.draw_all(imgbuffer)
-						alice.draw(imgbuffer) # draw the character
-						particle_con.draw_all(imgbuffer)
-						bullet_con.draw_all(imgbuffer)
-						uppermap.draw_ground(imgbuffer)
-						hud_con.draw(imgbuffer)
-						if(paused):
-							imgbuffer.blit(dark_screen, (0, 0))
-							imgbuffer.blit(pause_banner, (48, 60))
-							hud_con.draw_text(imgbuffer, "Continuar", 96, 112)
-							hud_con.draw_text(imgbuffer, "Sair do jogo", 96, 124)
-							imgbuffer.blit(cursor, (87, 113 + pause_cur * 12))
-						if(banner.moving):
-							banner.draw(imgbuffer)
-						if(text.moving):
-							text.draw(imgbuffer)
-						if(not trans.has_completed()):
-							trans.draw(imgbuffer)
-						if(ending):
-							trans2.draw(imgbuffer)
+						stage.draw(imgbuffer)
+						pause_menu.draw(imgbuffer, hud_con)
+						stage.draw_transitions(imgbuffer)
+						profiler.draw(imgbuffer, hud_con)
+						profiler.begin("present")
 						window.blit(pygame.transform.scale(imgbuffer, (768, 672)), (0, 0)) # blit our buffer to the main window
 						pygame.display.update() # flip the display, showing the graphics
-						if not boss:
-							if(enemy_con.boss_battle):
-								music_con.play_song(stage_data["boss-music"][i])
-								boss = True
-						if(enemy_con.check_boss_killed()):
-							ending = True
+						profiler.end("present")
+						profiler.end("frame")
+						profiler.end_frame()
+						stage.update_progress()
 						if(iddqd and keys[pygame.K_p]):
-							ending = True
+							stage.ending = True
 						for event in pygame.event.get(): # check if the window has been closed
 							if(event.type == pygame.QUIT):
+								profiler.close()
 								pygame.quit() # quit the game
 								sys.exit()
 						if(alice.dead and (not alice.lives > 0)):
@@ -4025,6 +4524,10 @@ def main():
 								sys.exit()
 		except ExitedGame:
 			pass
+		finally:
+			if(recorder is not None):
+				recorder.close()
+		replay = None # Back to the title screen once the replay is over
 	
 
 	